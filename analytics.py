@@ -0,0 +1,177 @@
+"""Vectorized time-series analytics over a user's day records.
+
+Everything works on columns: one NumPy array of dates and two of hours, one
+entry per day that has classes (see attendance_store.daily_totals). There are
+no per-day Python loops after the columns are built.
+"""
+import numpy as np
+
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday",
+                 "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def day_columns(rows):
+    """Turns daily_totals() rows into (dates, conducted, present) arrays.
+
+    ``dates`` is datetime64[D]; the hour arrays are int64. Rows with a date
+    that is not "YYYY-MM-DD" are dropped.
+    """
+    conducted = np.fromiter((row["conducted"] for row in rows),
+                            dtype=np.int64, count=len(rows))
+    present = np.fromiter((row["present"] for row in rows),
+                          dtype=np.int64, count=len(rows))
+    try:
+        dates = np.array([row["_id"] for row in rows], dtype="datetime64[D]")
+    except ValueError:
+        # Rare: a hand-edited document with a malformed date.
+        keep = np.array([_is_iso_date(row["_id"]) for row in rows], dtype=bool)
+        dates = np.array([row["_id"] for row in rows if _is_iso_date(row["_id"])],
+                         dtype="datetime64[D]")
+        conducted, present = conducted[keep], present[keep]
+    return dates, conducted, present
+
+
+def _is_iso_date(value):
+    try:
+        np.datetime64(value, "D")
+    except (TypeError, ValueError):
+        return False
+    return isinstance(value, str) and len(value) == 10
+
+
+def weekday_index(dates):
+    """0 = Monday ... 6 = Sunday for a datetime64[D] array."""
+    # 1970-01-01 was a Thursday (index 3).
+    return (dates.astype(np.int64) + 3) % 7
+
+
+def longest_run(mask):
+    """Length of the longest run of True values in a boolean array."""
+    if not mask.any():
+        return 0
+    padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+def trailing_run(mask):
+    """Number of True values at the end of a boolean array."""
+    misses = np.flatnonzero(~mask)
+    return int(len(mask) - 1 - misses[-1]) if len(misses) else int(len(mask))
+
+
+def attendance_analytics(dates, conducted, present):
+    """Calendar heatmap grid, streaks and day-of-week absence rates.
+
+    Streaks count class days, so weekends and holidays do not break them:
+    a "present" day attended every conducted hour, an "absent" day none.
+
+    Returns a dict with:
+      ``heatmap``: float array (7, n_weeks) of daily attendance %, NaN where
+      there were no classes; rows are Monday..Sunday.
+      ``week_starts``: datetime64[D] Monday of each heatmap column.
+      ``longest_present_streak``, ``current_absence_streak``: ints.
+      ``weekday_absence_rate``: float array (7,) of absent hours / conducted
+      hours per weekday, NaN for weekdays without classes.
+    """
+    has_class = conducted > 0
+    dates, conducted, present = dates[has_class], conducted[has_class], present[has_class]
+    if len(dates) == 0:
+        return {
+            "heatmap": np.full((7, 0), np.nan),
+            "week_starts": np.array([], dtype="datetime64[D]"),
+            "longest_present_streak": 0,
+            "current_absence_streak": 0,
+            "weekday_absence_rate": np.full(7, np.nan),
+        }
+
+    percentage = present * 100.0 / conducted
+    weekday = weekday_index(dates)
+    monday = dates - weekday.astype("timedelta64[D]")
+    first_monday = monday.min()
+    week = ((monday - first_monday) // np.timedelta64(7, "D")).astype(np.int64)
+    n_weeks = int(week.max()) + 1
+    heatmap = np.full((7, n_weeks), np.nan)
+    heatmap[weekday, week] = percentage
+
+    absent_hours = np.bincount(weekday, weights=conducted - present, minlength=7)
+    conducted_hours = np.bincount(weekday, weights=conducted, minlength=7)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weekday_rate = np.where(conducted_hours > 0,
+                                absent_hours / conducted_hours, np.nan)
+
+    return {
+        "heatmap": heatmap,
+        "week_starts": first_monday + np.arange(n_weeks) * np.timedelta64(7, "D"),
+        "longest_present_streak": longest_run(present >= conducted),
+        "current_absence_streak": trailing_run(present == 0),
+        "weekday_absence_rate": weekday_rate,
+    }
+
+
+# ---- SEMESTER PROJECTION ----
+
+def scheduled_hours_index(weekly_hours, start, end, holidays=(), changes=()):
+    """Cumulative scheduled hours per subject over the semester.
+
+    ``weekly_hours`` is (n_subjects, 7) hours per weekday, Monday first;
+    ``start``/``end`` are inclusive "YYYY-MM-DD" strings and ``holidays``
+    an iterable of them. For a schedule that changed during the term,
+    ``changes`` are the sorted dates each new version took effect and
+    ``weekly_hours`` is (len(changes) + 1, n_subjects, 7), one block per
+    version (see models.Timetable.versioned_hours). Returns ``(dates,
+    cumulative)``: every calendar day of the term as datetime64[D], and an
+    int64 array (n_subjects, n_days) where ``cumulative[s, d]`` is subject
+    s's class hours from ``start`` through ``dates[d]``. Hours between two
+    dates are then one subtraction.
+    """
+    dates = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+    hours = np.asarray(weekly_hours, dtype=np.int64).reshape(len(changes) + 1, -1, 7)
+    # The version in force on each day, by binary search over the changes.
+    version = np.searchsorted(np.array(changes, dtype="datetime64[D]"), dates, side="right")
+    daily = hours[version, :, weekday_index(dates)].T
+    if len(holidays):
+        daily[:, np.isin(dates, np.array(holidays, dtype="datetime64[D]"))] = 0
+    return dates, np.cumsum(daily, axis=1)
+
+
+def semester_projection(dates, cumulative, after, conducted, present, target_pct=80):
+    """What is still possible per subject with the classes left after ``after``.
+
+    ``conducted``/``present`` are arrays of hours so far, one per row of
+    ``cumulative``; ``target_pct`` must be below 100. Returns a dict of
+    arrays, one entry per subject:
+      ``remaining``: class hours scheduled after ``after`` until term ends.
+      ``needed``: consecutive hours to attend to reach the target (0 if met).
+      ``reachable``: whether attending every remaining hour reaches it.
+      ``reach_date``: datetime64[D] day the target is reached when attending
+      every class from now on; NaT if already met or unreachable.
+      ``max_skippable``: hours that can still be missed while ending the
+      term at or above the target (0 if unreachable, at most ``remaining``).
+    """
+    conducted = np.asarray(conducted, dtype=np.int64)
+    present = np.asarray(present, dtype=np.int64)
+    n_subjects = len(conducted)
+    if len(dates) == 0:
+        cumulative = np.zeros((n_subjects, 1), dtype=np.int64)
+        done = np.zeros(n_subjects, dtype=np.int64)
+        dates = np.array(["NaT"], dtype="datetime64[D]")
+    else:
+        # Hours already behind us: through ``after`` (0 if before the term).
+        cut = int(np.searchsorted(dates, np.datetime64(after, "D"), side="right"))
+        done = cumulative[:, cut - 1] if cut else np.zeros(n_subjects, dtype=np.int64)
+    remaining = cumulative[:, -1] - done
+
+    # Same formula as attendance_store.classes_needed, for all subjects at once.
+    needed = np.maximum(0, -((100 * present - target_pct * conducted) // (100 - target_pct)))
+    reachable = needed <= remaining
+    # First day whose hours since ``after`` cover ``needed``.
+    covered = (cumulative - done[:, None]) >= needed[:, None]
+    first = covered.argmax(axis=1)
+    reach_date = np.where(reachable & (needed > 0), dates[first],
+                          np.datetime64("NaT", "D"))
+    final_conducted = conducted + remaining
+    max_skippable = np.minimum(remaining, np.maximum(
+        0, (100 * (present + remaining) - target_pct * final_conducted) // 100))
+    return {"remaining": remaining, "needed": needed, "reachable": reachable,
+            "reach_date": reach_date, "max_skippable": max_skippable}
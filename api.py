@@ -0,0 +1,325 @@
+"""JSON API for clients that don't need the Streamlit UI.
+
+Mobile shortcuts and kiosks only need "mark today" and "get my totals", so
+this serves them as plain HTTP endpoints instead of full script reruns. It
+uses the same building blocks as app.py: the session tokens from auth.py
+(a token is the same signed value as the login cookie, so logging out
+anywhere revokes it), the pipelines, update documents and archive helpers
+from attendance_store.py/archive.py, the models and the projections. It
+talks to MongoDB through pymongo's asyncio client, with one connection pool
+shared by every request.
+
+Run it next to the app (it needs cookie_secret in secrets.toml):
+    uvicorn api:create_app --factory --host 0.0.0.0 --port 8000
+
+Endpoints (all but POST /token need "Authorization: Bearer <token>"):
+    POST   /token                                  {"username", "password"}
+    DELETE /token
+    GET    /timetables
+    GET    /timetables/{list}/days/{date}
+    PUT    /timetables/{list}/days/{date}          {"records": [...], "expected_version"?}
+    GET    /timetables/{list}/totals?start=&end=
+    GET    /timetables/{list}/prediction?target=80
+    GET    /timetables/{list}/absences
+"""
+import contextlib
+import functools
+from datetime import datetime
+
+import numpy as np
+from pymongo import errors
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from analytics import WEEKDAY_NAMES, scheduled_hours_index, semester_projection
+from archive import archive_query, days_in_range, unarchive_day_async
+from attendance_store import (SaveConflict, classes_needed, day_key,
+                              fetch_range_stats_async, save_day_async)
+from auth import (DEFAULT_BCRYPT_ROUNDS, DEFAULT_BCRYPT_WORKERS,
+                  DEFAULT_SESSION_DAYS, PasswordHasher, new_session,
+                  session_query)
+from models import (DAY_RECORD_FIELDS, TIMETABLE_FIELDS, DayRecord, Timetable,
+                    record_subject, status_for)
+from mongo_connection import create_async_client, load_secrets
+from subjects import subject_dictionary_async
+
+
+class ApiError(Exception):
+    """Ends a request with ``status`` and a JSON ``{"error": message}`` body."""
+
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": message, **extra}
+
+
+def _date_param(value, name="date"):
+    """Validates a "YYYY-MM-DD" string; None stays None."""
+    if value is None:
+        return None
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ApiError(400, f"{name} must be YYYY-MM-DD")
+    return value
+
+
+def _day_json(record):
+    return {"date": record.date, "version": record.version,
+            "records": [{"subject": subject, "hours_conducted": conducted,
+                         "hours_present": present, "status": status}
+                        for subject, conducted, present, status in record]}
+
+
+def _parse_records(body):
+    """The day records from a PUT body, with statuses filled in."""
+    records = body.get("records") if isinstance(body, dict) else None
+    if not isinstance(records, list) or not records:
+        raise ApiError(400, "records must be a non-empty list")
+    parsed = []
+    for rec in records:
+        try:
+            subject = str(rec["subject"])
+            conducted = int(rec["hours_conducted"])
+            present = int(rec["hours_present"])
+        except (KeyError, TypeError, ValueError):
+            raise ApiError(400, "each record needs subject, hours_conducted and hours_present")
+        if conducted < 0 or not 0 <= present <= conducted:
+            raise ApiError(400, f"{subject}: need 0 <= hours_present <= hours_conducted")
+        parsed.append({"subject": subject, "hours_conducted": conducted,
+                       "hours_present": present, "status": status_for(conducted, present)})
+    return parsed
+
+
+@functools.lru_cache(maxsize=256)
+def _semester_index(weekly_hours, start, end, holidays, changes=()):
+    """scheduled_hours_index(), cached like the prediction page's copy."""
+    return scheduled_hours_index(weekly_hours, start, end, holidays, changes)
+
+
+class AttendanceApi:
+    """Request handlers; one instance per process owns the client and hasher."""
+
+    def __init__(self, secrets, client=None):
+        if not secrets.get("cookie_secret"):
+            raise RuntimeError("api.py needs cookie_secret in secrets.toml to issue tokens")
+        self.secrets = secrets
+        self.session_secret = secrets["cookie_secret"]
+        self.session_days = float(secrets.get("session_days", DEFAULT_SESSION_DAYS))
+        self.client = client
+        self.db = client.get_database() if client is not None else None
+        self.hasher = PasswordHasher(
+            rounds=int(secrets.get("bcrypt_rounds", DEFAULT_BCRYPT_ROUNDS)),
+            workers=int(secrets.get("bcrypt_workers", DEFAULT_BCRYPT_WORKERS)))
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app):
+        if self.client is None:
+            self.client = create_async_client(self.secrets)
+            self.db = self.client.get_database()
+        try:
+            yield
+        finally:
+            await self.client.close()
+
+    def routes(self):
+        return [
+            Route("/token", self.handler(self.login, auth=False), methods=["POST"]),
+            Route("/token", self.handler(self.logout), methods=["DELETE"]),
+            Route("/timetables", self.handler(self.timetables), methods=["GET"]),
+            Route("/timetables/{list_name}/days/{date}", self.handler(self.get_day), methods=["GET"]),
+            Route("/timetables/{list_name}/days/{date}", self.handler(self.put_day), methods=["PUT"]),
+            Route("/timetables/{list_name}/totals", self.handler(self.totals), methods=["GET"]),
+            Route("/timetables/{list_name}/prediction", self.handler(self.prediction), methods=["GET"]),
+            Route("/timetables/{list_name}/absences", self.handler(self.absences), methods=["GET"]),
+        ]
+
+    def handler(self, fn, auth=True):
+        """Wraps ``fn(request[, username])``: authentication, ApiError and
+        database outages become JSON error responses."""
+        async def endpoint(request):
+            try:
+                if auth:
+                    return JSONResponse(await fn(request, await self.authenticate(request)))
+                return JSONResponse(await fn(request))
+            except ApiError as e:
+                return JSONResponse(e.body, status_code=e.status)
+            except errors.ConnectionFailure:
+                return JSONResponse({"error": "database unavailable"}, status_code=503)
+        return endpoint
+
+    # ---- AUTH ----
+
+    async def authenticate(self, request):
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        query = session_query(self.session_secret, token.strip()) if scheme.lower() == "bearer" else None
+        doc = await self.db.sessions.find_one(query, {"username": 1}) if query else None
+        if doc is None:
+            raise ApiError(401, "missing, invalid or expired token")
+        return doc["username"]
+
+    async def login(self, request):
+        body = await self._json(request)
+        username, password = body.get("username"), body.get("password")
+        if not isinstance(username, str) or not isinstance(password, str):
+            raise ApiError(400, "username and password are required")
+        user = await self.db.users.find_one({"_id": username}, {"password": 1})
+        matches, new_hash = (await self.hasher.verify_async(password, user["password"])
+                             if user else (False, None))
+        if not matches:
+            raise ApiError(401, "invalid username or password")
+        if new_hash:
+            await self.db.users.update_one({"_id": username}, {"$set": {"password": new_hash}})
+        doc, token = new_session(self.session_secret, username, self.session_days)
+        await self.db.sessions.insert_one(doc)
+        return {"token": token, "expires_at": doc["expires_at"].isoformat()}
+
+    async def logout(self, request, username):
+        _, _, token = request.headers["authorization"].partition(" ")
+        await self.db.sessions.delete_one({"_id": session_query(self.session_secret, token.strip())["_id"]})
+        return {"ok": True}
+
+    # ---- TIMETABLES & DAYS ----
+
+    async def timetables(self, request, username):
+        cursor = self.db.timetables.find(
+            {"$or": [{"is_public": True}, {"owner": username}]},
+            {"_id": 1, "owner": 1, "is_public": 1})
+        return [{"name": doc["_id"], "owner": doc.get("owner"),
+                 "is_public": doc.get("is_public", False)} async for doc in cursor]
+
+    async def _timetable(self, request, username):
+        """The path's timetable, if this user may see it (404 otherwise)."""
+        list_name = request.path_params["list_name"]
+        timetable = Timetable.from_doc(await self.db.timetables.find_one(
+            {"_id": list_name, "$or": [{"is_public": True}, {"owner": username}]},
+            TIMETABLE_FIELDS))
+        if timetable is None:
+            raise ApiError(404, f"no timetable named {list_name!r}")
+        return timetable
+
+    async def get_day(self, request, username):
+        timetable = await self._timetable(request, username)
+        date_str = _date_param(request.path_params["date"])
+        doc = await self.db.attendance_records.find_one(
+            day_key(username, timetable.name, date_str), DAY_RECORD_FIELDS)
+        if doc is None:
+            doc = next(iter(days_in_range(await self.db.attendance_archive.find_one(
+                archive_query(username, timetable.name, date_str, date_str),
+                {"_id": 0, "data": 1}), date_str, date_str)), None)
+        if doc is None:
+            raise ApiError(404, f"no attendance on {date_str}")
+        return _day_json(DayRecord.from_doc(doc, timetable.subject_ids))
+
+    async def put_day(self, request, username):
+        """Saves a day with save_day_async(). Without ``expected_version`` only
+        the given subjects are replaced (like the app's merge). With it the
+        whole day is replaced if the stored version still matches (null: the
+        day must not exist yet), else 409 with the current day, like the
+        marking page's check. An archived day is moved back first, as the
+        marking page does when it opens one."""
+        timetable = await self._timetable(request, username)
+        date_str = _date_param(request.path_params["date"])
+        body = await self._json(request)
+        records = _parse_records(body)
+        merge = "expected_version" not in body
+        expected = body.get("expected_version")
+        # bool is an int subclass, but true/false is not a version.
+        if expected is not None and (isinstance(expected, bool) or not isinstance(expected, int)):
+            raise ApiError(400, "expected_version must be an integer or null")
+        await unarchive_day_async(self.db, username, timetable.name, date_str)
+        try:
+            version = await save_day_async(self.db, username, timetable.name, date_str,
+                                           records, expected_version=expected, merge=merge)
+        except SaveConflict as e:
+            stored = e.current["records"] if e.current else ()
+            current = DayRecord.from_doc(e.current, await subject_dictionary_async(
+                self.db, timetable.name, [record_subject(rec) for rec in stored]))
+            raise ApiError(409, "the day was changed elsewhere",
+                           current=_day_json(current) if current else None)
+        return {"date": date_str, "version": version}
+
+    # ---- TOTALS ----
+
+    async def totals(self, request, username):
+        timetable = await self._timetable(request, username)
+        start = _date_param(request.query_params.get("start"), "start")
+        end = _date_param(request.query_params.get("end"), "end")
+        subject_stats, weekly = await fetch_range_stats_async(
+            self.db, username, timetable.name, start, end)
+        return {"subjects": [{"subject": stats.subject, "conducted": stats.conducted,
+                              "present": stats.present, "percentage": round(stats.percentage, 2)}
+                             for stats in subject_stats.values()],
+                "weekly": weekly}
+
+    async def prediction(self, request, username):
+        """The Predict page as data: per subject, hours needed to reach the
+        target, plus the end-of-term projection when there is a calendar."""
+        timetable = await self._timetable(request, username)
+        try:
+            target = float(request.query_params.get("target", 80))
+        except ValueError:
+            raise ApiError(400, "target must be a number")
+        if not 0 < target < 100:
+            raise ApiError(400, "target must be between 0 and 100")
+        calendar = timetable.calendar
+        subject_stats, _ = await fetch_range_stats_async(
+            self.db, username, timetable.name, calendar.start if calendar else None)
+        subjects = list(timetable.subjects) or list(subject_stats)
+        rows = []
+        for subject in subjects:
+            stats = subject_stats.get(subject)
+            conducted, present = (stats.conducted, stats.present) if stats else (0, 0)
+            rows.append({"subject": subject, "conducted": conducted, "present": present,
+                         "percentage": round(present / conducted * 100, 2) if conducted else None,
+                         "classes_needed": classes_needed(conducted, present, target)})
+        if calendar is not None and timetable.subjects:
+            changes, weekly_hours = timetable.versioned_hours(WEEKDAY_NAMES)
+            dates, cumulative = _semester_index(
+                weekly_hours, calendar.start, calendar.end, calendar.holidays, changes)
+            projection = semester_projection(
+                dates, cumulative, datetime.now().strftime("%Y-%m-%d"),
+                [row["conducted"] for row in rows], [row["present"] for row in rows], target)
+            for i, row in enumerate(rows):
+                reach_date = projection["reach_date"][i]
+                row.update({
+                    "remaining_hours": int(projection["remaining"][i]),
+                    "reachable": bool(projection["reachable"][i]),
+                    "reach_date": None if np.isnat(reach_date) else str(reach_date),
+                    "max_skippable": int(projection["max_skippable"][i]),
+                })
+        return {"target": target, "semester_end": calendar.end if calendar else None,
+                "subjects": rows}
+
+    async def absences(self, request, username):
+        """Every subject-day with hours missed, newest first, archive included."""
+        timetable = await self._timetable(request, username)
+        docs = await self.db.attendance_records.find(
+            {"list_name": timetable.name, "username": username}, DAY_RECORD_FIELDS).to_list()
+        hot_dates = {doc["date"] for doc in docs}
+        docs += [doc for doc in days_in_range(await self.db.attendance_archive.find_one(
+            archive_query(username, timetable.name), {"_id": 0, "data": 1}))
+            if doc["date"] not in hot_dates]
+        docs.sort(key=lambda doc: doc["date"], reverse=True)
+        return [{"date": record.date, "subject": subject, "lost": conducted - present,
+                 "status": "Partial" if present > 0 else "Absent"}
+                for record in (DayRecord.from_doc(doc, timetable.subject_ids) for doc in docs)
+                for subject, conducted, present, _ in record if conducted > present]
+
+    @staticmethod
+    async def _json(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise ApiError(400, "body must be JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "body must be a JSON object")
+        return body
+
+
+def create_app(secrets=None, client=None):
+    """The ASGI app. ``client`` (an AsyncMongoClient) is created at startup if not given."""
+    api = AttendanceApi(secrets if secrets is not None else load_secrets(), client)
+    return Starlette(routes=api.routes(), lifespan=api.lifespan)
+
@@ -0,0 +1,237 @@
+"""Throughput benchmark for the JSON API (api.py).
+
+Seeds the benchmark dataset from load_test.py, starts the API in a child
+process (uvicorn, one worker) and drives it from this process with many
+keep-alive HTTP connections. Each connection logs in as one seeded user
+and then loops over a mix of requests: totals, the timetable list, reading
+a day and saving a day. Reports requests per second and latency
+percentiles per endpoint, and exits 1 if throughput is below --min-rps or
+any request failed.
+
+Needs a real MongoDB; the API uses pymongo's asyncio client, which
+mongomock does not emulate.
+
+Examples:
+    python api_load_test.py
+    python api_load_test.py --mongo-uri mongodb://localhost:27017/attendance_load --connections 128 --seconds 30
+    python api_load_test.py --url http://127.0.0.1:8000 --no-seed
+"""
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+from urllib.parse import quote, urlsplit
+
+from load_test import LOAD_TEST_PASSWORD, percentile, seed_database
+
+# (endpoint label, weight) of the request mix.
+REQUEST_MIX = [("totals", 4), ("timetables", 2), ("get_day", 2), ("put_day", 2)]
+
+
+def serve(args):
+    """Child process: run api.py's app for ``args.mongo_uri``."""
+    import uvicorn
+
+    from api import create_app
+    from mongo_connection import load_secrets
+    secrets_ = {**load_secrets(), "mongo_uri": args.mongo_uri,
+                "cookie_secret": args.cookie_secret, "bcrypt_workers": 4}
+    uvicorn.run(create_app(secrets_), host="127.0.0.1", port=args.port,
+                log_level="warning", access_log=False)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection speaking JSON."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.token = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}",
+                "Content-Type: application/json", f"Content-Length: {len(payload)}"]
+        if self.token:
+            head.append(f"Authorization: Bearer {self.token}")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        return status, json.loads(data) if data else None
+
+    def close(self):
+        self.writer.close()
+
+
+async def wait_until_up(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"The API did not start on {host}:{port}.")
+
+
+async def login(host, port, username, results):
+    """An open Connection logged in as ``username``, or None."""
+    conn = Connection(host, port)
+    await conn.open()
+    status, body = await conn.request(
+        "POST", "/token", {"username": username, "password": LOAD_TEST_PASSWORD})
+    if status != 200:
+        results["errors"].append(f"login {username}: {status} {body}")
+        conn.close()
+        return None
+    conn.token = body["token"]
+    return conn
+
+
+async def run_client(conn, list_name, deadline, results, rng):
+    base = f"/timetables/{quote(list_name, safe='')}"
+    labels = [label for label, _ in REQUEST_MIX]
+    weights = [weight for _, weight in REQUEST_MIX]
+    try:
+        while time.monotonic() < deadline:
+            label = rng.choices(labels, weights)[0]
+            day = (date.today() - timedelta(days=rng.randint(0, 30))).isoformat()
+            if label == "totals":
+                method, path, body = "GET", f"{base}/totals", None
+            elif label == "timetables":
+                method, path, body = "GET", "/timetables", None
+            elif label == "get_day":
+                method, path, body = "GET", f"{base}/days/{day}", None
+            else:
+                method, path, body = "PUT", f"{base}/days/{date.today().isoformat()}", {
+                    "records": [{"subject": "Benchmark", "hours_conducted": 1,
+                                 "hours_present": rng.randint(0, 1)}]}
+            started = time.perf_counter()
+            status, reply = await conn.request(method, path, body)
+            results["latency"].setdefault(label, []).append(time.perf_counter() - started)
+            # A day without attendance is a normal 404.
+            if status >= 500 or (status >= 400 and not (label == "get_day" and status == 404)):
+                results["errors"].append(f"{label}: {status} {reply}")
+    finally:
+        conn.close()
+
+
+async def run_benchmark(host, port, pairs, connections, seconds):
+    """Logs every connection in (bcrypt, not timed), then runs the mix for
+    ``seconds``. Returns (results, measured seconds)."""
+    results = {"latency": {}, "errors": []}
+    await wait_until_up(host, port)
+    users = [pairs[i % len(pairs)] for i in range(connections)]
+    conns = await asyncio.gather(*(login(host, port, username, results)
+                                   for username, _ in users))
+    rng = random.Random(11)
+    started = time.monotonic()
+    await asyncio.gather(*(
+        run_client(conn, list_name, started + seconds, results, random.Random(rng.random()))
+        for conn, (_, list_name) in zip(conns, users) if conn is not None))
+    return results, time.monotonic() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/attendance_load",
+                        help="Database to seed and serve (default: %(default)s).")
+    parser.add_argument("--url", help="Benchmark an API that is already running instead.")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="Reuse the data already in the database.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--connections", type=int, default=64,
+                        help="Concurrent keep-alive connections (default 64).")
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--min-rps", type=float, default=1000.0,
+                        help="Fail below this many requests per second.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--cookie-secret", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    import pymongo
+    db = pymongo.MongoClient(args.mongo_uri).get_database()
+    if args.no_seed:
+        pairs = [(doc["_id"], doc["list_name"]) for doc in db.attendance_records.aggregate([
+            {"$group": {"_id": "$username", "list_name": {"$first": "$list_name"}}},
+            {"$match": {"_id": {"$regex": "^loadtest_user_"}}}])]
+    else:
+        pairs = seed_database(db, users=args.users, days=args.days)
+    if not pairs:
+        sys.exit("No load test users in the database; run without --no-seed.")
+
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = "127.0.0.1", free_port()
+        server = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(port),
+                                   "--mongo-uri", args.mongo_uri,
+                                   "--cookie-secret", secrets.token_urlsafe(32)])
+    try:
+        results, wall = asyncio.run(run_benchmark(host, port, pairs, args.connections, args.seconds))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    total = sum(len(v) for v in results["latency"].values())
+    rps = total / wall if wall else 0.0
+    summary = {"requests": total, "seconds": round(wall, 1), "rps": round(rps, 1),
+               "errors": len(results["errors"]), "endpoints": {}}
+    print(f"{total} requests on {args.connections} connections in {wall:.1f}s: {rps:.0f} req/s")
+    print(f"{'endpoint':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, latencies in sorted(results["latency"].items()):
+        row = {"count": len(latencies),
+               "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+               "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+               "p99_ms": round(percentile(latencies, 99) * 1000, 2)}
+        summary["endpoints"][label] = row
+        print(f"{label:<12}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    for error in results["errors"][:10]:
+        print(f"ERROR: {error}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if results["errors"]:
+        return 1
+    if rps < args.min_rps:
+        print(f"Below --min-rps {args.min_rps:.0f}.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
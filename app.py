@@ -1,12 +1,47 @@
 import streamlit as st
 import base64
+import html
+import json
 import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import matplotlib.pyplot as plt
-from pymongo import MongoClient, errors
-from passlib.context import CryptContext
+import numpy as np
+from pymongo import errors
 import os
-import math
+import uuid
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from attendance_store import (backfill_days, classes_needed,
+                              daily_totals, dashboard_overview, day_key,
+                              delete_timetable_records, ensure_indexes,
+                              fetch_day_window, fetch_range_stats,
+                              move_user_records, records_stamp, roster_day,
+                              roster_usernames, save_day, save_roster,
+                              user_records_stamp)
+from mongo_connection import (UNAVAILABLE_ERRORS, CircuitBreaker, CircuitOpen,
+                              LastKnownResults, analytics_database,
+                              create_client)
+from session_footprint import FootprintRegistry, state_footprint
+from save_journal import CONFLICT, PENDING, SaveJournal
+from profiling import (ProfileRun, ProfileStore, call_tree, collapsed_stacks,
+                       function_label, pstats_bytes, top_functions)
+from archive import archived_days, ensure_archive_indexes
+from backup import BackupError, backup_file_name, export_backup, restore_backup
+from checkin import (CheckinQueue, CheckinQueueFull, active_codes, code_expired,
+                     create_code, ensure_checkin_indexes, find_code)
+from tombstones import (UNDO_DAYS, ensure_tombstone_indexes, recent_resets,
+                        reset_days, undo_reset)
+from subjects import (day_records, forget_dictionary, rename_subjects,
+                      subject_ids)
+from models import (DAY_RECORD_FIELDS, TIMETABLE_FIELDS, DayRecord,
+                    SemesterCalendar, SubjectTotals, Timetable, record_hours,
+                    status_for)
+from analytics import (WEEKDAY_NAMES, attendance_analytics, day_columns,
+                       scheduled_hours_index, semester_projection)
+from auth import (DEFAULT_BCRYPT_ROUNDS, DEFAULT_BCRYPT_WORKERS,
+                  DEFAULT_SESSION_DAYS, SESSION_COOKIE, PasswordHasher,
+                  create_session, ensure_session_indexes, resolve_session,
+                  revoke_session, revoke_user_sessions, session_max_age)
 
 # ---- Page Configuration ----
 st.set_page_config(page_title="Attendance Tracker", layout="centered")
@@ -16,35 +51,878 @@ st.set_page_config(page_title="Attendance Tracker", layout="centered")
 
 @st.cache_resource
 def init_connection():
-    """Initializes a connection to MongoDB, cached for performance."""
-    try:
-        # st.secrets reads from .streamlit/secrets.toml
-        return MongoClient(st.secrets["mongo_uri"])
-    except Exception as e:
-        st.error(
-            f"Failed to connect to MongoDB. Please check your connection string in secrets.toml. Error: {e}")
-        return None
+    """Initializes a connection to MongoDB, cached for performance.
 
+    Errors are not cached, so a failed attempt is retried on the next rerun.
+    """
+    # st.secrets reads from .streamlit/secrets.toml; the optional
+    # mongo_* entries there tune compression, pool size and timeouts.
+    return create_client(st.secrets)
 
-client = init_connection()
-# Proceed only if the client is not None, otherwise stop the app
-if client:
-    db = client.get_database()  # The DB name is taken from your connection string
-else:
-    st.error("Database connection could not be established. The app cannot proceed.")
+
+@st.cache_resource
+def init_circuit_breaker():
+    """One breaker per server process, shared by every session."""
+    return CircuitBreaker(
+        failure_threshold=int(st.secrets.get("mongo_breaker_failures", 3)),
+        reset_seconds=float(st.secrets.get("mongo_breaker_reset_s", 30)))
+
+
+@st.cache_resource
+def init_last_known_results():
+    return LastKnownResults()
+
+
+@st.cache_resource
+def init_indexes(_db):
+    """Creates the collection indexes once per server process."""
+    ensure_indexes(_db)
+    ensure_session_indexes(_db)
+    ensure_checkin_indexes(_db)
+    ensure_archive_indexes(_db)
+    ensure_tombstone_indexes(_db)
+
+
+@st.cache_resource
+def init_checkin_queue(_db):
+    """One buffered check-in writer per server process, shared by every session."""
+    return CheckinQueue(_db)
+
+
+@st.cache_resource
+def init_save_journal(_db):
+    """One journal of marking saves per server process. Its file must be on
+    a disk that outlives restarts, and not shared with another process."""
+    return SaveJournal(_db, st.secrets.get(
+        "save_journal_path",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "save_journal.sqlite3")))
+
+
+@st.cache_resource
+def init_read_pool():
+    """Threads that run a page's independent reads side by side, shared by
+    every session of the server process."""
+    return ThreadPoolExecutor(
+        max_workers=int(st.secrets.get("page_read_workers", 16)),
+        thread_name_prefix="page-read")
+
+
+try:
+    client = init_connection()
+except Exception as e:  # A malformed URI, or DNS failing for a mongodb+srv URI.
+    st.error(
+        f"Failed to connect to MongoDB. Please check your connection string in secrets.toml. Error: {e}")
     st.stop()
+db = client.get_database()  # The DB name is taken from your connection string
+# Pages that only show history read from here; it may be a secondary.
+read_db = analytics_database(client, st.secrets)
+breaker = init_circuit_breaker()
+last_known = init_last_known_results()
+checkins = init_checkin_queue(db)
+journal = init_save_journal(db)
+read_pool = init_read_pool()
+DB_UNAVAILABLE = (CircuitOpen,) + UNAVAILABLE_ERRORS
+NO_RESULT = object()
+# Not through the breaker: after the first run this is a cache hit, which
+# would count as a successful call. Not cached on failure, so it is retried.
+if not breaker.is_open:
+    try:
+        init_indexes(db)
+    except UNAVAILABLE_ERRORS:
+        pass
+
+
+def database_degraded():
+    """True while the database is unreachable and the app is read-only."""
+    return breaker.is_open
+
+
+def resilient_read(key, fn, *args):
+    """Runs a read through the circuit breaker and remembers its result.
+
+    While the database is unreachable the last result stored under ``key``
+    is returned instead. Without one the page shows an error and stops.
+    Keys must include the username for per-user data.
+    """
+    return _settle_read(key, lambda: breaker.call(fn, *args))
+
+
+def start_read(key, fn, *args):
+    """Starts resilient_read(key, fn, *args) on the read pool.
+
+    Returns a function that waits for the read and returns its result, with
+    the same fallback as resilient_read(). Start every independent read of
+    a page first and wait for them afterwards, so the page takes as long as
+    its slowest query rather than all of them added up. ``fn`` must not call
+    Streamlit; st.cache_data functions stay on the script thread.
+    """
+    future = read_pool.submit(breaker.call, fn, *args)
+    return lambda: _settle_read(key, future.result)
+
+
+def _settle_read(key, call):
+    try:
+        result = call()
+    except DB_UNAVAILABLE:
+        result = last_known.get(key, NO_RESULT)
+        if result is NO_RESULT:
+            st.error(
+                "⚠️ The database can't be reached right now. Please try again in a moment.")
+            if st.button("🔙 Back to Dashboard", key="unavailable_back"):
+                st.session_state.page = "dashboard"
+                st.rerun()
+            st.stop()
+        return result
+    last_known.put(key, result)
+    return result
+
+
+def guarded_write(fn, *args, **kwargs):
+    """Runs a write through the circuit breaker.
+
+    Returns True on success. If the database is unreachable an error is
+    shown and False returned, so the caller keeps the user's input.
+    """
+    try:
+        breaker.call(fn, *args, **kwargs)
+    except DB_UNAVAILABLE:
+        st.error("⚠️ The database can't be reached, so nothing was saved. Please try again in a moment.")
+        return False
+    return True
 
 
 # ---- PASSWORD HASHING SETUP ----
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@st.cache_resource
+def init_password_hasher():
+    """One bounded bcrypt worker pool per server process."""
+    return PasswordHasher(
+        rounds=int(st.secrets.get("bcrypt_rounds", DEFAULT_BCRYPT_ROUNDS)),
+        workers=int(st.secrets.get("bcrypt_workers", DEFAULT_BCRYPT_WORKERS)))
+
 
+password_hasher = init_password_hasher()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+
+def verify_password(plain_password, hashed_password, username=None):
+    """Checks a password; rehashes it for ``username`` if the bcrypt cost changed."""
+    matches, new_hash = password_hasher.verify(plain_password, hashed_password)
+    if matches and new_hash and username:
+        db.users.update_one({"_id": username}, {"$set": {"password": new_hash}})
+    return matches
 
 
 def hash_password(password):
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
+
+
+# ---- PERSISTENT LOGIN ----
+# Without a cookie_secret in secrets.toml, logins last only for the browser tab.
+SESSION_SECRET = st.secrets.get("cookie_secret")
+SESSION_DAYS = float(st.secrets.get("session_days", DEFAULT_SESSION_DAYS))
+
+
+def start_persistent_session(username):
+    """Creates a server-side session and queues its cookie for the browser."""
+    if SESSION_SECRET:
+        cookie = create_session(db, SESSION_SECRET, username, SESSION_DAYS)
+        st.session_state["session_cookie"] = cookie
+        st.session_state["pending_cookie"] = (cookie, session_max_age(SESSION_DAYS))
+
+
+def end_persistent_session():
+    """Revokes this browser's session and queues clearing its cookie."""
+    cookie = st.session_state.get("session_cookie")
+    if cookie:
+        revoke_session(db, cookie)
+        st.session_state["pending_cookie"] = ("", 0)
+
+
+def write_pending_cookie():
+    """Sets or clears the session cookie in the browser.
+
+    Streamlit has no API for writing cookies, so a small script sets
+    document.cookie on the page. The cookie is Secure, so browsers only
+    keep it over HTTPS (and on localhost).
+    """
+    pending = st.session_state.pop("pending_cookie", None)
+    if pending is None:
+        return
+    value, max_age = pending
+    cookie = json.dumps(f"{SESSION_COOKIE}={value}; max-age={int(max_age)}; path=/; SameSite=Strict; Secure")
+    st.html(f"<script>document.cookie = {cookie};</script>", unsafe_allow_javascript=True)
+
+# ---- PAGE-SCOPED STATE ----
+# State only one page needs is stored under "<scope>:<name>" keys. When the
+# user moves to a page with another scope, every scoped key of the other
+# scopes is dropped, so a long-lived session only holds its current page's
+# form values instead of every form it has ever opened.
+
+PAGE_SCOPES = {
+    "dashboard": "dashboard",
+    "new_timetable": "timetable_form",
+    "edit_timetable": "timetable_form",
+    "attendance_marking": "marking",
+    "analysis": "analysis",
+    "import_data": "import",
+    "prediction": "prediction",
+    "reset_attendance": "reset",
+    "view_attendance": "view",
+    "view_absent_report": "absent_report",
+    "session_memory": "session_memory",
+    "profiles": "profiles",
+    "roster": "roster",
+    "backup": "backup",
+}
+SCOPE_NAMES = set(PAGE_SCOPES.values())
+
+
+def page_key(scope, name):
+    return f"{scope}:{name}"
+
+
+def drop_page_state(keep_scope=None):
+    """Deletes every page-scoped key except those of ``keep_scope``."""
+    for key in list(st.session_state.keys()):
+        scope, sep, _ = str(key).partition(":")
+        if sep and scope in SCOPE_NAMES and scope != keep_scope:
+            del st.session_state[key]
+
+
+FORM_STEP_KEY = page_key("timetable_form", "form_step")
+SUBJECT_LIST_KEY = page_key("timetable_form", "subject_list")
+# Parallel to SUBJECT_LIST_KEY: (subject id, name its hours inputs are keyed
+# under) per row; (None, None) for a subject added on the form.
+SUBJECT_IDS_KEY = page_key("timetable_form", "subject_ids")
+IMPORT_SUBJECTS_KEY = page_key("import", "subjects")
+CONFIRM_DELETE_KEY = page_key("dashboard", "confirming_delete")
+CONFIRM_CLEAR_KEY = page_key("dashboard", "confirming_clear")
+# (reset id, list name, days) of the last "Clear My Records", for its Undo.
+CLEARED_KEY = page_key("dashboard", "cleared")
+
+
+def hours_key(day, subject_name):
+    """Widget key of one day x subject hours input on the timetable form."""
+    return page_key("timetable_form", f"{day}_{subject_name}_hours")
+
+# ---- SESSION FOOTPRINT ----
+# Admins (usernames under admin_users in secrets.toml) get a page showing
+# how much session state each connected browser holds on this server.
+ADMIN_USERS = set(st.secrets.get("admin_users", []))
+FOOTPRINT_EVERY_RERUNS = 20
+
+
+@st.cache_resource
+def init_footprint_registry():
+    return FootprintRegistry()
+
+
+footprints = init_footprint_registry()
+
+
+def record_session_footprint():
+    """Reports this session's state size, as its previous run left it.
+
+    Walking the whole state costs more the more a session holds, so it is
+    measured on every FOOTPRINT_EVERY_RERUNS-th rerun and on the Session
+    Memory page; other reruns only mark the session as seen and return None.
+    """
+    if "session_uid" not in st.session_state:
+        st.session_state["session_uid"] = uuid.uuid4().hex
+    reruns = st.session_state.get("footprint_reruns", 0)
+    st.session_state["footprint_reruns"] = reruns + 1
+    page = st.session_state.get("page")
+    if reruns % FOOTPRINT_EVERY_RERUNS and page != "session_memory" and footprints.touch(
+            st.session_state["session_uid"], username=st.session_state.get("username"), page=page):
+        return None
+    sizes = state_footprint(st.session_state)
+    footprints.record(st.session_state["session_uid"], sum(sizes.values()), len(sizes),
+                      username=st.session_state.get("username"), page=page)
+    return sizes
+
+# ---- PROFILING ----
+# An admin can profile the next reruns of their own tab, with the button on
+# the ⏱️ Profiles page or a link such as ?profile=5. Until then each rerun
+# only looks up two session keys.
+PROFILE_RERUNS_KEY = "profile_reruns"  # Reruns still to profile.
+PROFILE_RUN_KEY = "profile_run"  # ProfileRun of the rerun in progress.
+MAX_PROFILED_RERUNS = 20
+
+
+@st.cache_resource
+def init_profile_store():
+    return ProfileStore()
+
+
+profiles = init_profile_store()
+
+
+def arm_profiling(reruns):
+    st.session_state[PROFILE_RERUNS_KEY] = max(0, min(int(reruns), MAX_PROFILED_RERUNS))
+
+
+def start_rerun_profile():
+    """Stores the profile of the previous rerun if it ended through
+    st.rerun() or st.stop(), and starts profiling this one if it is armed."""
+    run = st.session_state.pop(PROFILE_RUN_KEY, None)
+    if run is not None:
+        profiles.add(run.finish())
+    username = st.session_state.get("username")
+    if username in ADMIN_USERS and "profile" in st.query_params:
+        try:
+            arm_profiling(st.query_params["profile"])
+        except ValueError:
+            pass
+        del st.query_params["profile"]  # A reload doesn't arm it again.
+    if not st.session_state.get(PROFILE_RERUNS_KEY):
+        return
+    if username not in ADMIN_USERS:
+        del st.session_state[PROFILE_RERUNS_KEY]
+        return
+    st.session_state[PROFILE_RERUNS_KEY] -= 1
+    run = ProfileRun(st.session_state.get("page"), username)
+    st.session_state[PROFILE_RUN_KEY] = run
+    run.start()
+
+
+def finish_rerun_profile():
+    """Stores the profile of a rerun that reached the end of the script."""
+    run = st.session_state.pop(PROFILE_RUN_KEY, None)
+    if run is not None:
+        profiles.add(run.finish())
+
+
+def plot_flame_graph(rows, total):
+    """Icicle-style flame graph: calls from the script on top, each box as
+    wide as its share of the rerun and its callees below it. Functions of
+    the same file share a colour."""
+    text_color = 'white' if st.session_state.theme == 'dark' else '#333'
+    depth = max(row[0] for row in rows) + 1
+    fig, ax = plt.subplots(figsize=(10, 0.32 * depth + 0.6))
+    colors = plt.get_cmap('Pastel1')
+    files = {}
+    for level, start, width, func in rows:
+        ax.barh(level, width, left=start, height=0.9, align='edge',
+                color=colors(files.setdefault(func[0], len(files)) % colors.N),
+                edgecolor='white', linewidth=0.3)
+        label = function_label(func)
+        # Roughly the characters that fit in the box at this figure size.
+        fits = int(width / total * 150)
+        if fits >= 4:
+            ax.text(start + total * 0.002, level + 0.45, label[:fits],
+                    va='center', fontsize=6, color='black', clip_on=True)
+    ax.set_xlim(0, total)
+    ax.set_ylim(depth, 0)
+    ax.set_yticks([])
+    ax.set_xlabel('seconds', color=text_color, fontsize=8)
+    ax.tick_params(colors=text_color, labelsize=7)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    fig.patch.set_alpha(0.0)
+    st.pyplot(fig)
+    plt.close(fig)
+
+# ---- TIMETABLES ----
+
+
+def fetch_timetable(list_name):
+    return Timetable.from_doc(db.timetables.find_one({"_id": list_name}, TIMETABLE_FIELDS))
+
+
+def load_timetable(list_name):
+    """The Timetable named ``list_name``, or None if it does not exist."""
+    return resilient_read(("timetable", list_name), fetch_timetable, list_name)
+
+
+def start_timetable_read(list_name):
+    """load_timetable() on the read pool; call the result to wait for it."""
+    return start_read(("timetable", list_name), fetch_timetable, list_name)
+
+
+def fetch_visible_timetables(username):
+    query = {"$or": [{"is_public": True}, {"owner": username}]}
+    return list(db.timetables.find(query, {"_id": 1, "owner": 1, "is_public": 1}))
+
+
+def visible_timetables(username):
+    """Public timetables plus the user's own, as ``_id``/owner/is_public dicts."""
+    return resilient_read(("timetables", username), fetch_visible_timetables, username)
+
+
+CALENDAR_ON_KEY = page_key("timetable_form", "calendar_on")
+CALENDAR_START_KEY = page_key("timetable_form", "calendar_start")
+CALENDAR_END_KEY = page_key("timetable_form", "calendar_end")
+HOLIDAYS_KEY = page_key("timetable_form", "holidays")
+EFFECTIVE_KEY = page_key("timetable_form", "effective")
+
+
+def prefill_timetable_form(timetable, days):
+    """Loads a timetable's subjects, hours and calendar into the edit form's widgets."""
+    st.session_state[FORM_STEP_KEY] = 1
+    st.session_state[SUBJECT_LIST_KEY] = list(timetable.subjects) if timetable and timetable.subjects else [""]
+    st.session_state[SUBJECT_IDS_KEY] = [
+        (timetable.subject_ids.id_for(name), name) if timetable else (None, None)
+        for name in st.session_state[SUBJECT_LIST_KEY]]
+    for day in days:
+        day_schedule = timetable.day(day) if timetable else None
+        for subject_name in st.session_state[SUBJECT_LIST_KEY]:
+            st.session_state[hours_key(day, subject_name)] = day_schedule.hours_for(
+                subject_name) if day_schedule else 0
+    calendar = timetable.calendar if timetable else None
+    st.session_state[CALENDAR_ON_KEY] = calendar is not None
+    if calendar is not None:
+        st.session_state[CALENDAR_START_KEY] = datetime.strptime(calendar.start, "%Y-%m-%d").date()
+        st.session_state[CALENDAR_END_KEY] = datetime.strptime(calendar.end, "%Y-%m-%d").date()
+        st.session_state[HOLIDAYS_KEY] = "\n".join(calendar.holidays)
+
+
+def form_subject_ids():
+    """SUBJECT_IDS_KEY, padded to the length of the subject list."""
+    rows = st.session_state.setdefault(SUBJECT_IDS_KEY, [])
+    rows += [(None, None)] * (len(st.session_state[SUBJECT_LIST_KEY]) - len(rows))
+    return rows
+
+
+def apply_subject_names(names, rows, days):
+    """Keeps the non-blank rows of the form, moving each renamed subject's
+    hours inputs to its new name. Returns False if a name is used twice."""
+    kept = [(name.strip(), row) for name, row in zip(names, rows) if name.strip()]
+    if len({name for name, _ in kept}) < len(kept):
+        return False
+    moved = {(day, name): st.session_state.get(hours_key(day, old), 0)
+             for name, (_, old) in kept if old and old != name for day in days}
+    names = {name for name, _ in kept}
+    for name, (_, old) in kept:
+        if old and old != name and old not in names:
+            for day in days:
+                st.session_state.pop(hours_key(day, old), None)
+    for (day, name), hours in moved.items():
+        st.session_state[hours_key(day, name)] = hours
+    st.session_state[SUBJECT_LIST_KEY] = [name for name, _ in kept]
+    st.session_state[SUBJECT_IDS_KEY] = [(subject_id, name) for name, (subject_id, _) in kept]
+    return True
+
+
+def schedule_versions(stored, schedule, effective):
+    """The stored ``schedule_versions`` with ``schedule`` in force from
+    ``effective`` on, replacing any version from that date or later. A
+    timetable saved before versions keeps its old schedule as the first
+    version, from "" (every earlier date)."""
+    versions = list(stored.get("schedule_versions") or ())
+    if not versions and stored.get("schedule"):
+        versions = [{"from": "", "schedule": stored["schedule"]}]
+    versions = [version for version in versions if version["from"] < effective]
+    if not versions or versions[-1]["schedule"] != schedule:
+        versions.append({"from": effective, "schedule": schedule})
+    return versions
+
+
+def save_timetable(list_name, names, rows, days, fields, calendar, effective):
+    """Writes the timetable form. Renamed subjects keep their ids, so their
+    attendance history follows the new name. The schedule applies from
+    ``effective`` ("YYYY-MM-DD", not in the future); earlier dates keep the
+    version they had. Returns False if a new name belongs to another
+    subject in the timetable's history."""
+    renames = {subject_id: name for name, (subject_id, _) in zip(names, rows)
+               if subject_id is not None}
+    if renames and not rename_subjects(db, list_name, renames):
+        return False
+    update = {"$set": fields}
+    if calendar is not None:
+        update["$set"]["calendar"] = calendar.to_doc()
+    else:
+        update["$unset"] = {"calendar": ""}
+    stored = db.timetables.find_one_and_update(
+        {"_id": list_name}, update, upsert=True,
+        projection={"schedule": 1, "schedule_versions": 1}) or {}
+    subjects = subject_ids(db, list_name, names)
+    schedule = {day: [{"id": subjects.id_for(name), "hours": hours}
+                      for name in names
+                      for hours in [st.session_state.get(hours_key(day, name), 0)] if hours > 0]
+                for day in days}
+    db.timetables.update_one({"_id": list_name}, {"$set": {
+        "schedule": schedule,
+        "schedule_versions": schedule_versions(stored, schedule, effective)}})
+    return True
+
+
+def delete_timetable(list_name):
+    """Deletes a timetable and every user's attendance for it."""
+    db.timetables.delete_one({"_id": list_name})
+    delete_timetable_records(db, list_name)
+    forget_dictionary(list_name)
+
+
+def parse_holidays(text):
+    """Holiday dates from one "YYYY-MM-DD" or "YYYY-MM-DD to YYYY-MM-DD" per line.
+
+    Returns (sorted "YYYY-MM-DD" strings, lines that could not be read).
+    """
+    holidays, bad_lines = set(), []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        first, _, last = (part.strip() for part in line.partition(" to "))
+        try:
+            start = np.datetime64(datetime.strptime(first, "%Y-%m-%d").date(), "D")
+            end = np.datetime64(datetime.strptime(last or first, "%Y-%m-%d").date(), "D")
+        except ValueError:
+            bad_lines.append(line)
+            continue
+        holidays.update(str(day) for day in np.arange(start, end + 1))
+    return sorted(holidays), bad_lines
+
+
+@st.cache_data(max_entries=200, show_spinner=False)
+def load_semester_index(weekly_hours, start, end, holidays, changes=()):
+    """scheduled_hours_index() for one timetable. Every argument is part of
+    the cache key, so editing the schedule or calendar rebuilds it."""
+    return scheduled_hours_index(weekly_hours, start, end, holidays, changes)
+
+# ---- DAY WINDOW ----
+# The marking and log pages show one date at a time, and users step through
+# dates one by one. Instead of a query per date, each page keeps the user's
+# day documents for DAY_WINDOW_DAYS dates around the last one loaded and
+# serves nearby dates from it. The window is page-scoped state, so every
+# other page (and whatever it changed) starts a fresh one, and saving the
+# marking form drops it. Changes from other devices show up after
+# DAY_WINDOW_SECONDS; the marking form's version check catches them on save
+# either way.
+
+DAY_WINDOW_DAYS = 31
+DAY_WINDOW_SECONDS = 60
+
+
+def day_window_bounds(date_str, window=None):
+    """("YYYY-MM-DD", "YYYY-MM-DD") of a new window holding ``date_str``:
+    ending on it when the user stepped back past ``window``, starting on it
+    when they stepped forward, otherwise centred on it."""
+    day = datetime.strptime(date_str, "%Y-%m-%d").date()
+    span = timedelta(days=DAY_WINDOW_DAYS - 1)
+    if window is not None and date_str < window["start"]:
+        start = day - span
+    elif window is not None and date_str > window["end"]:
+        start = day
+    else:
+        start = day - span / 2
+    return start.strftime("%Y-%m-%d"), (start + span).strftime("%Y-%m-%d")
+
+
+def window_day(scope, read_from, username, list_name, date_str):
+    """``(document, archived)`` of one of the user's days (document None if
+    not marked), from the ``scope`` page's window, loading a new window with
+    one range query when ``date_str`` is outside it or it is too old."""
+    window = st.session_state.get(page_key(scope, "day_window"))
+    if window is not None and (window["list_name"] != list_name or window["username"] != username
+                               or time.monotonic() - window["loaded_at"] > DAY_WINDOW_SECONDS):
+        window = None
+    if window is None or not window["start"] <= date_str <= window["end"]:
+        start, end = day_window_bounds(date_str, window)
+        docs, archived = resilient_read(("day_window", username, list_name, start, end),
+                                        fetch_day_window, read_from, username, list_name, start, end)
+        window = {"username": username, "list_name": list_name, "start": start, "end": end,
+                  "loaded_at": time.monotonic(), "docs": docs, "archived": archived}
+        st.session_state[page_key(scope, "day_window")] = window
+    return window["docs"].get(date_str), date_str in window["archived"]
+
+
+def forget_day_window(scope):
+    """Drops the ``scope`` page's window of days, after changing them."""
+    st.session_state.pop(page_key(scope, "day_window"), None)
+
+
+# ---- ATTENDANCE SAVES ----
+# Day documents carry a version. The marking form remembers the version it
+# was loaded from and saves with a compare-and-set, so a save from another
+# tab or device in between is detected instead of silently overwritten.
+# Saves go through the server's SaveJournal: the user's marks are safe once
+# they are in the journal, and a slow or unreachable database only delays
+# when they reach attendance_records.
+
+JOURNAL_WAIT_SECONDS = 0.5  # How long a save waits to report it reached the database.
+
+FORM_WIDGET_PREFIXES = tuple(page_key("marking", prefix)
+                             for prefix in ("slider_", "conducted_", "attended_"))
+
+
+def loaded_version_key(list_name, date_str):
+    return page_key("marking", f"loaded_version_{list_name}_{date_str}")
+
+
+def reset_marking_form(list_name, date_str):
+    """Forgets the loaded version and widget values so the form reloads from the database."""
+    forget_day_window("marking")
+    st.session_state.pop(loaded_version_key(list_name, date_str), None)
+    for key in list(st.session_state.keys()):
+        if key.startswith(FORM_WIDGET_PREFIXES):
+            del st.session_state[key]
+
+
+def save_marking_form(username, list_name, date_str, records, existing_day, success_message,
+                      base_save_id=None):
+    """Journals the marking form and reports whether it reached the database.
+
+    ``existing_day`` is the DayRecord the form was filled from, or None;
+    ``base_save_id`` is set when it came from a save still in the journal.
+    A conflict shows up as the prompt of render_save_conflict().
+    """
+    # Only subjects the user actually edited take part in a merge.
+    changed = [rec for rec in records
+               if existing_day is None
+               or existing_day.hours(rec["subject"]) != record_hours(rec)]
+    entry_id = journal.append(
+        username, list_name, date_str, records,
+        expected_version=st.session_state.get(loaded_version_key(list_name, date_str)),
+        changed=changed, base_save_id=base_save_id)
+    outcome = journal.wait(entry_id, JOURNAL_WAIT_SECONDS)
+    if outcome == CONFLICT:
+        # The prompt compares against the day as it is now, not the window's copy.
+        forget_day_window("marking")
+        st.rerun()
+    reset_marking_form(list_name, date_str)
+    if outcome == PENDING:
+        st.info("💾 Saved on this server. It will be written to the database as soon as it responds.")
+    else:
+        st.success(success_message)
+    time.sleep(1)
+    st.rerun()
+
+
+def render_save_conflict(username, list_name, date_str, conflict):
+    """Shows the keep-mine / keep-theirs / merge prompt for a journal entry
+    that conflicted, against the day as the database has it now."""
+    theirs = resilient_read(
+        ("day", username, list_name, date_str),
+        lambda: day_records(db, list_name, [db.attendance_records.find_one(
+            day_key(username, list_name, date_str), DAY_RECORD_FIELDS)])[0])
+    st.warning(
+        "⚠️ This day was changed from another tab or device after you opened it. Choose which version to keep.")
+    if theirs is None:
+        st.caption("The other change deleted this day's record.")
+    else:
+        for subject, conducted, present, _ in theirs:
+            st.caption(f"Saved elsewhere: {subject}: {present}/{conducted} hours")
+    c1, c2, c3 = st.columns(3)
+    if c1.button("🔀 Merge My Changes", key=f"conflict_merge_{date_str}",
+                 help="Save only the subjects you edited and keep the rest of the other version."):
+        if not conflict["changed"] or guarded_write(
+                save_day, db, username, list_name, date_str, conflict["changed"], merge=True):
+            journal.discard(username, list_name, date_str)
+            reset_marking_form(list_name, date_str)
+            st.rerun()
+    if c2.button("💾 Keep Mine", key=f"conflict_mine_{date_str}"):
+        if guarded_write(save_day, db, username, list_name, date_str, conflict["records"], force=True):
+            journal.discard(username, list_name, date_str)
+            reset_marking_form(list_name, date_str)
+            st.rerun()
+    if c3.button("↩️ Keep Theirs", key=f"conflict_theirs_{date_str}"):
+        journal.discard(username, list_name, date_str)
+        reset_marking_form(list_name, date_str)
+        st.rerun()
+    st.divider()
+
+# ---- CHECK-IN CODES ----
+# Students redeem an owner's code with one click. The check-in goes into the
+# shared CheckinQueue and is written in a batch by its background thread,
+# so a whole class checking in at once does not mean one write per rerun.
+
+CHECKIN_CODE_KEY = page_key("dashboard", "checkin_code")
+
+
+@st.cache_data(ttl=60, max_entries=1000, show_spinner=False)
+def load_checkin_code(code):
+    """The code document, cached briefly: a class redeems the same code at once."""
+    return find_code(db, code)
+
+
+def redeem_checkin(username, code):
+    """Queues a check-in for ``code`` and shows the outcome."""
+    try:
+        code_doc = breaker.call(load_checkin_code, code.strip().upper())
+    except DB_UNAVAILABLE:
+        st.error("⚠️ The database can't be reached right now. Please try again in a moment.")
+        return
+    if code_doc is None or code_expired(code_doc):
+        st.error("That check-in code is not valid or has expired.")
+        return
+    when = datetime.strptime(code_doc["date"], "%Y-%m-%d").strftime("%A, %d %B")
+    try:
+        queued = checkins.submit(code_doc, username)
+    except CheckinQueueFull:
+        st.warning("⏳ Too many check-ins are being saved right now. Please try again in a moment.")
+        return
+    if queued:
+        st.success(f"✅ Checked in to {code_doc['subject']} ({code_doc['list_name']}) for {when}.")
+    else:
+        st.info(f"You have already checked in to {code_doc['subject']} for {when}.")
+
+# ---- BACKUPS ----
+# Backups are built only when their download button is clicked, into a
+# temporary file that moves to disk once it is larger than this.
+BACKUP_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+def backup_download_button(scope, label, key):
+    """A download button for the backup of ``scope`` (see backup.py)."""
+    def build():
+        out = tempfile.SpooledTemporaryFile(max_size=BACKUP_SPOOL_BYTES)
+        export_backup(db, scope, out)
+        out.seek(0)
+        return out
+    st.download_button(label, build, file_name=backup_file_name(scope),
+                       mime="application/gzip", key=key, on_click="ignore",
+                       disabled=database_degraded())
+
+# ---- DATE RANGE FILTER ----
+DATE_RANGE_OPTIONS = ["All Time", "This Week",
+                      "This Month", "Last 30 Days", "Custom Range"]
+
+
+def date_range_selector(key):
+    """Renders the date range picker and returns inclusive (start, end) "YYYY-MM-DD" strings.
+
+    Either bound is None when it is open, so "All Time" returns (None, None).
+    """
+    today = datetime.now().date()
+    choice = st.selectbox("Date range:", DATE_RANGE_OPTIONS, key=f"{key}_range")
+    if choice == "This Week":
+        start, end = today - timedelta(days=today.weekday()), today
+    elif choice == "This Month":
+        start, end = today.replace(day=1), today
+    elif choice == "Last 30 Days":
+        start, end = today - timedelta(days=29), today
+    elif choice == "Custom Range":
+        picked = st.date_input("From / to:", (today - timedelta(days=29), today),
+                               key=f"{key}_custom")
+        # While the user is still picking, only the start date is set.
+        start = picked[0] if len(picked) > 0 else None
+        end = picked[1] if len(picked) > 1 else None
+    else:
+        return None, None
+    return (start.strftime("%Y-%m-%d") if start else None,
+            end.strftime("%Y-%m-%d") if end else None)
+
+
+def plot_weekly_trend(weekly):
+    """Line chart of attendance % per ISO week."""
+    text_color = 'white' if st.session_state.theme == 'dark' else '#333'
+    labels = [f"W{w['week']}" for w in weekly]
+    fig, ax = plt.subplots(figsize=(6, 2.5))
+    ax.plot(labels, [w['percentage'] for w in weekly],
+            marker='o', color='#00DFFC')
+    ax.axhline(80, color='#F44336', linestyle='--', linewidth=1)
+    ax.set_ylim(0, 105)
+    ax.set_ylabel("Attendance %", color=text_color)
+    ax.tick_params(colors=text_color, labelsize=8)
+    for spine in ax.spines.values():
+        spine.set_color(text_color)
+    fig.patch.set_alpha(0.0)
+    ax.patch.set_alpha(0.0)
+    st.pyplot(fig)
+    plt.close(fig)  # pyplot keeps every open figure alive otherwise
+
+# ---- CALENDAR & STREAKS ----
+
+
+@st.cache_data(max_entries=500, show_spinner=False)
+def load_calendar_analytics(username, list_name, start, end, stamp):
+    """Heatmap and streak analytics for a date range.
+
+    ``stamp`` is the user's records_stamp() for the list; it is only part of
+    the cache key, so any save or delete makes the next call recompute.
+    """
+    return attendance_analytics(*day_columns(
+        daily_totals(read_db, username, list_name, start, end)))
+
+
+def plot_calendar_heatmap(heatmap, week_starts):
+    """GitHub-style calendar of daily attendance %: weeks across, weekdays down."""
+    text_color = 'white' if st.session_state.theme == 'dark' else '#333'
+    # Drop Sunday when nobody has classes on it.
+    rows = 6 if np.isnan(heatmap[6]).all() else 7
+    fig, ax = plt.subplots(figsize=(7, 2.2))
+    ax.imshow(heatmap[:rows], cmap='RdYlGn', vmin=0, vmax=100, aspect='auto')
+    ax.set_yticks(range(rows))
+    ax.set_yticklabels([name[:3] for name in WEEKDAY_NAMES[:rows]])
+    starts = week_starts.astype(object)  # datetime.date values
+    month_ticks = [i for i, start in enumerate(starts)
+                   if i == 0 or start.month != starts[i - 1].month]
+    ax.set_xticks(month_ticks)
+    ax.set_xticklabels([starts[i].strftime('%b') for i in month_ticks])
+    ax.tick_params(colors=text_color, labelsize=8, length=0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    fig.patch.set_alpha(0.0)
+    st.pyplot(fig)
+    plt.close(fig)
+
+
+def load_calendar_section(username, list_name, start, end):
+    """The analytics behind render_calendar_section()."""
+    # The stamp is read from the same place as the data, so a lagging
+    # secondary gives an older stamp rather than caching stale data under a new one.
+    return resilient_read(
+        ("calendar", username, list_name, start, end),
+        lambda: load_calendar_analytics(username, list_name, start, end,
+                                        records_stamp(read_db, username, list_name)))
+
+
+def render_calendar_section(analytics):
+    """Heatmap, streaks and weekday absence rates for the analysis page."""
+    if analytics["heatmap"].shape[1] == 0:
+        return
+    st.markdown("<h3>Attendance Calendar</h3>", unsafe_allow_html=True)
+    plot_calendar_heatmap(analytics["heatmap"], analytics["week_starts"])
+
+    rates = analytics["weekday_absence_rate"]
+    worst_day = "—"
+    if not np.isnan(rates).all():
+        worst = int(np.nanargmax(rates))
+        worst_day = f"{WEEKDAY_NAMES[worst][:3]} ({rates[worst] * 100:.0f}%)"
+    streak_cols = st.columns(3)
+    streak_cols[0].markdown(
+        f'<div class="glass-stat-box"><div class="stat-value">{analytics["longest_present_streak"]}</div><div class="stat-label">Longest Present Streak</div></div>', unsafe_allow_html=True)
+    streak_cols[1].markdown(
+        f'<div class="glass-stat-box"><div class="stat-value">{analytics["current_absence_streak"]}</div><div class="stat-label">Current Absence Streak</div></div>', unsafe_allow_html=True)
+    streak_cols[2].markdown(
+        f'<div class="glass-stat-box"><div class="stat-value" style="font-size: 1.5rem;">{worst_day}</div><div class="stat-label">Most Missed Day</div></div>', unsafe_allow_html=True)
+
+    st.caption("Share of conducted hours missed, by day of the week")
+    rate_cols = st.columns(6)
+    for i, name in enumerate(WEEKDAY_NAMES[:6]):
+        rate = rates[i]
+        rate_cols[i].metric(name[:3], "—" if np.isnan(rate) else f"{rate * 100:.0f}%")
+
+# ---- DASHBOARD OVERVIEW ----
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def load_dashboard_overview(username, weekday, stamp):
+    """dashboard_overview(), cached until the user's next save (``stamp``).
+
+    ``stamp`` is only part of the cache key. The weekday is too, so the
+    "today" column changes at midnight.
+    """
+    return dashboard_overview(read_db, username, weekday)
+
+
+def render_dashboard_overview(username):
+    weekday = datetime.now().strftime("%A")
+    overview = resilient_read(
+        ("overview", username, weekday),
+        lambda: load_dashboard_overview(username, weekday, user_records_stamp(read_db, username)))
+    if not overview:
+        return
+    st.markdown("<h2>Overview</h2>", unsafe_allow_html=True)
+    st.dataframe(
+        [{"Timetable": row["list_name"],
+          "Overall": round(row["percentage"], 1),
+          "Below 80%": ", ".join(f"{subject} ({pct:.0f}%)" for subject, pct in row["below_target"]) or "—",
+          f"{weekday}'s Classes": ", ".join(f"{subject} ({hours}h)" for subject, hours in row["today"]) or "—"}
+         for row in overview],
+        column_config={"Overall": st.column_config.ProgressColumn(
+            "Overall", format="%.1f%%", min_value=0, max_value=100)},
+        width="stretch", hide_index=True)
+    st.divider()
 
 # ---- UI & STYLING ----
 
@@ -326,6 +1204,24 @@ if "page" not in st.session_state:
 if "auth_page" not in st.session_state:
     st.session_state["auth_page"] = "Login"
 
+session_state_sizes = record_session_footprint()
+
+# --- Returning browsers: log in from the session cookie, once per session ---
+if not st.session_state["authenticated"] and SESSION_SECRET and not st.session_state.get("session_checked"):
+    st.session_state["session_checked"] = True
+    session_cookie = st.context.cookies.get(SESSION_COOKIE)
+    try:
+        cookie_username = breaker.call(resolve_session, db, SESSION_SECRET, session_cookie)
+    except DB_UNAVAILABLE:
+        cookie_username = None
+        st.session_state["session_checked"] = False  # Try again on the next rerun.
+    if cookie_username:
+        st.session_state["authenticated"] = True
+        st.session_state["username"] = cookie_username
+        st.session_state["session_cookie"] = session_cookie
+write_pending_cookie()
+start_rerun_profile()
+
 # --- 1. AUTHENTICATION PAGE (Login & Sign Up) ---
 if not st.session_state["authenticated"]:
     st.markdown('<div class="auth-container">', unsafe_allow_html=True)
@@ -344,10 +1240,16 @@ if not st.session_state["authenticated"]:
         username = st.text_input("Username", key="login_user")
         password = st.text_input("Password", type="password", key="login_pass")
         if st.button("Login", key="login_button"):
-            user_data = db.users.find_one({"_id": username})
-            if user_data and verify_password(password, user_data["password"]):
+            try:
+                user_data = breaker.call(db.users.find_one, {"_id": username}, {"password": 1})
+            except DB_UNAVAILABLE:
+                user_data = NO_RESULT
+            if user_data is NO_RESULT:
+                st.error("⚠️ The database can't be reached right now. Please try again in a moment.")
+            elif user_data and verify_password(password, user_data["password"], username):
                 st.session_state["authenticated"] = True
                 st.session_state["username"] = username
+                start_persistent_session(username)
                 st.rerun()
             else:
                 st.error("❌ Invalid username or password")
@@ -365,17 +1267,18 @@ if not st.session_state["authenticated"]:
             elif new_password != confirm_password:
                 st.error("Passwords do not match.")
             else:
-                if db.users.find_one({"_id": new_username}):
+                if db.users.find_one({"_id": new_username}, {"_id": 1}):
                     st.error("Username already exists.")
                 else:
                     hashed_pass = hash_password(new_password)
-                    db.users.insert_one(
-                        {"_id": new_username, "password": hashed_pass})
-                    st.success("Account created! Logging you in...")
-                    st.session_state["authenticated"] = True
-                    st.session_state["username"] = new_username
-                    time.sleep(1.5)
-                    st.rerun()
+                    if guarded_write(db.users.insert_one,
+                                     {"_id": new_username, "password": hashed_pass}):
+                        st.success("Account created! Logging you in...")
+                        st.session_state["authenticated"] = True
+                        st.session_state["username"] = new_username
+                        start_persistent_session(new_username)
+                        time.sleep(1.5)
+                        st.rerun()
 
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -384,6 +1287,16 @@ else:
     DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday",
                     "Thursday", "Friday", "Saturday"]
 
+    # Moving to a page with another scope drops the old page's state.
+    current_scope = PAGE_SCOPES.get(st.session_state.page)
+    if st.session_state.get("state_scope") != current_scope:
+        drop_page_state(keep_scope=current_scope)
+        st.session_state["state_scope"] = current_scope
+
+    if database_degraded():
+        st.warning(
+            "⚠️ The database can't be reached right now. You are seeing the last known data. Attendance you mark is kept and saved once it is back; other changes can't be saved until then.")
+
     # --- PAGE ROUTER ---
 
     # 2A. TIMETABLE CREATION/EDIT PAGE
@@ -397,11 +1310,11 @@ else:
         st.markdown(f"<h1>{page_title}</h1>", unsafe_allow_html=True)
 
         if is_edit_mode:
-            st.markdown(f"<h2>{list_name}</h2>", unsafe_allow_html=True)
-            timetable_doc = db.timetables.find_one({"_id": list_name})
-            default_is_public = timetable_doc.get("is_public", True)
+            st.markdown(f"<h2>{html.escape(list_name)}</h2>", unsafe_allow_html=True)
+            timetable = load_timetable(list_name)
+            default_is_public = timetable.is_public if timetable else True
         else:
-            list_name = st.text_input("Semester Name", key="new_list_name",
+            list_name = st.text_input("Semester Name", key=page_key("timetable_form", "new_list_name"),
                                       label_visibility="collapsed", placeholder="Enter Semester Name")
             default_is_public = True
 
@@ -409,68 +1322,91 @@ else:
                               help="Public timetables are visible to all users. Private ones are only visible to you.")
         st.divider()
 
-        if 'form_step' not in st.session_state:
-            st.session_state.form_step = 1
+        if FORM_STEP_KEY not in st.session_state:
+            st.session_state[FORM_STEP_KEY] = 1
 
-        if st.session_state.form_step == 1:
+        if st.session_state[FORM_STEP_KEY] == 1:
             st.markdown("<h3>Step 1: Define All Subjects</h3>",
                         unsafe_allow_html=True)
-            if 'subject_list' not in st.session_state:
-                st.session_state.subject_list = [""]
-            for i in range(len(st.session_state.subject_list)):
-                st.session_state.subject_list[i] = st.text_input(
-                    f"Subject {i+1}", st.session_state.subject_list[i], key=f"subj_{i}")
+            if SUBJECT_LIST_KEY not in st.session_state:
+                st.session_state[SUBJECT_LIST_KEY] = [""]
+            subject_list = st.session_state[SUBJECT_LIST_KEY]
+            subject_rows = form_subject_ids()
+            for i in range(len(subject_list)):
+                subject_list[i] = st.text_input(
+                    f"Subject {i+1}", subject_list[i], key=page_key("timetable_form", f"subj_{i}"))
             st.divider()
             col1, col2, col3 = st.columns([2, 2, 1])
             if col1.button("➕ Add Another Subject"):
-                st.session_state.subject_list.append("")
+                subject_list.append("")
+                subject_rows.append((None, None))
                 st.rerun()
             if col2.button("Next: Assign Hours ➡️"):
-                st.session_state.subject_list = [
-                    s.strip() for s in st.session_state.subject_list if s.strip()]
-                if not st.session_state.subject_list:
+                if not apply_subject_names(subject_list, subject_rows, DAYS_OF_WEEK):
+                    st.warning("Each subject needs a different name.")
+                elif not st.session_state[SUBJECT_LIST_KEY]:
                     st.warning("Please define at least one subject.")
                 else:
-                    st.session_state.form_step = 2
+                    st.session_state[FORM_STEP_KEY] = 2
                     st.rerun()
             if col3.button("Back"):
                 st.session_state.page = "dashboard"
                 st.rerun()
 
-        elif st.session_state.form_step == 2:
+        elif st.session_state[FORM_STEP_KEY] == 2:
             st.markdown(
                 "<h3>Step 2: Assign Hours Per Day (Mon-Sat)</h3>", unsafe_allow_html=True)
             st.caption("Set hours to 0 if there is no class.")
+            effective = datetime.now().date()
+            if is_edit_mode:
+                # Earlier dates keep the schedule they had, so marking a past
+                # date shows the classes held then.
+                effective = st.date_input("These hours apply from:", effective,
+                                          max_value=effective, key=EFFECTIVE_KEY)
+                if timetable is not None and timetable.changes:
+                    st.caption("Earlier schedule changes took effect on "
+                               + ", ".join(timetable.changes) + ".")
             day_tabs = st.tabs(DAYS_OF_WEEK)
             for i, day in enumerate(DAYS_OF_WEEK):
                 with day_tabs[i]:
                     st.markdown(
                         f"<h4>Schedule for {day}</h4>", unsafe_allow_html=True)
-                    for subject_name in st.session_state.subject_list:
+                    for subject_name in st.session_state[SUBJECT_LIST_KEY]:
                         st.number_input(subject_name, min_value=0,
-                                        step=1, key=f"{day}_{subject_name}_hours")
+                                        step=1, key=hours_key(day, subject_name))
+            st.markdown("<h3>Semester Calendar (optional)</h3>", unsafe_allow_html=True)
+            st.caption(
+                "With term dates and holidays, the Predict page can tell whether 80% is still reachable this semester.")
+            calendar = None
+            if st.toggle("Set semester dates", key=CALENDAR_ON_KEY):
+                cal_cols = st.columns(2)
+                term_start = cal_cols[0].date_input("First day of term", key=CALENDAR_START_KEY)
+                term_end = cal_cols[1].date_input("Last day of term", key=CALENDAR_END_KEY)
+                holidays, bad_lines = parse_holidays(st.text_area(
+                    "Holidays", key=HOLIDAYS_KEY,
+                    placeholder="One per line: 2026-12-25 or 2026-12-24 to 2027-01-01"))
+                if bad_lines:
+                    st.warning("Ignoring lines that are not dates: " + ", ".join(bad_lines))
+                calendar = SemesterCalendar(term_start.strftime("%Y-%m-%d"),
+                                            term_end.strftime("%Y-%m-%d"), holidays)
             st.divider()
             col1, col2 = st.columns(2)
             if col1.button("⬅️ Back to Subjects"):
-                st.session_state.form_step = 1
+                st.session_state[FORM_STEP_KEY] = 1
                 st.rerun()
             if col2.button("💾 Save Timetable"):
                 if not list_name:
                     st.warning("⚠️ Please provide a name.")
+                elif calendar is not None and calendar.end < calendar.start:
+                    st.warning("⚠️ The last day of term is before the first.")
+                elif not save_timetable(list_name, st.session_state[SUBJECT_LIST_KEY], form_subject_ids(), DAYS_OF_WEEK,
+                                        {"owner": st.session_state.get("username"), "is_public": is_public},
+                                        calendar, effective.strftime("%Y-%m-%d")):
+                    st.warning("⚠️ A new subject name is already used by another subject in this timetable's history.")
                 else:
-                    schedule = {day: [{"name": s, "hours": st.session_state.get(
-                        f"{day}_{s}_hours", 0)} for s in st.session_state.subject_list if st.session_state.get(f"{day}_{s}_hours", 0) > 0] for day in DAYS_OF_WEEK}
-                    db.timetables.update_one(
-                        {"_id": list_name},
-                        {"$set": {"schedule": schedule, "owner": st.session_state.get(
-                            "username"), "is_public": is_public}},
-                        upsert=True
-                    )
                     st.success(f"✅ Timetable '{list_name}' saved!")
+                    # Leaving the page drops the form's scoped state.
                     st.session_state.page = "dashboard"
-                    for key in ["form_step", "subject_list"]:
-                        if key in st.session_state:
-                            del st.session_state[key]
                     time.sleep(1)
                     st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
@@ -481,7 +1417,7 @@ else:
         username = st.session_state.get("username")
         st.markdown('<div class="main-container">', unsafe_allow_html=True)
         st.markdown(f"<h1>✒️ Mark Attendance</h1>", unsafe_allow_html=True)
-        st.markdown(f"<h2>{list_name}</h2>", unsafe_allow_html=True)
+        st.markdown(f"<h2>{html.escape(list_name)}</h2>", unsafe_allow_html=True)
         selected_date = st.date_input(
             "Select a date to view or edit", datetime.now())
         selected_day_str = selected_date.strftime('%A')
@@ -490,69 +1426,80 @@ else:
             f"<h3>Schedule for: {selected_date.strftime('%A, %d %B %Y')}</h3>", unsafe_allow_html=True)
         st.divider()
 
-        timetable_doc = db.timetables.find_one({"_id": list_name})
-        query = {"list_name": list_name,
-                 "date": selected_date_str_key, "username": username}
-        attendance_doc = db.attendance_records.find_one(query)
+        # The timetable, the day and the cumulative totals don't depend on
+        # each other, so they are fetched at the same time.
+        timetable_read = start_timetable_read(list_name)
+        totals_read = start_read(
+            ("range", username, list_name, None, None),
+            fetch_range_stats, db, username, list_name)
+        # Nearby dates come from the session's window of days. An archived
+        # date is shown from the archive and only moved back when it is saved.
+        day_doc, archived = window_day("marking", db, username, list_name, selected_date_str_key)
+        existing_day = resilient_read(
+            ("day", username, list_name, selected_date_str_key),
+            lambda: day_records(db, list_name, [day_doc])[0])
+        if archived:
+            st.caption("🗄️ This date is archived. Saving it moves it back with your changes.")
+        timetable = timetable_read()
+        # A save of this date still in the journal is what the form shows.
+        journaled = journal.day_entry(username, list_name, selected_date_str_key)
+        base_save_id = None
+        if journaled is not None and journaled["state"] == CONFLICT:
+            render_save_conflict(username, list_name, selected_date_str_key, journaled)
+        elif journaled is not None:
+            st.info("⏳ Your last save of this date is kept on this server and hasn't reached the database yet. It will be written automatically.")
+            existing_day = DayRecord.from_doc({"date": selected_date_str_key,
+                                               "version": journaled["expected_version"],
+                                               "records": journaled["records"]})
+            base_save_id = journaled["save_id"]
+        # Remember which version the form was filled from, for the save check.
+        if loaded_version_key(list_name, selected_date_str_key) not in st.session_state:
+            st.session_state[loaded_version_key(
+                list_name, selected_date_str_key)] = existing_day.version if existing_day else None
 
         if selected_day_str == "Saturday":
             st.info(
                 "This is an Open Saturday. Enter hours only for classes that were conducted.")
-            schedule = timetable_doc.get("schedule", {})
-            master_subject_list = sorted(
-                list({s['name'] for day_sched in schedule.values() for s in day_sched}))
+            master_subject_list = timetable.subjects_on(selected_date_str_key) if timetable else ()
             if not master_subject_list:
                 st.warning(
                     "No subjects found. Please edit the timetable to add subjects.")
             else:
                 with st.form(key=f"attendance_form_saturday_{selected_date_str_key}"):
-                    existing_records = {rec['subject']: rec for rec in attendance_doc.get(
-                        "records", [])} if attendance_doc else {}
-
                     form_submission_data = []
 
                     for subject in master_subject_list:
-                        st.markdown(f"<h4>{subject}</h4>",
+                        st.markdown(f"<h4>{html.escape(str(subject))}</h4>",
                                     unsafe_allow_html=True)
                         cols = st.columns([1, 2])
 
                         # Get existing values
-                        existing_rec = existing_records.get(subject, {})
-                        existing_hours = existing_rec.get('hours_conducted', 0)
-                        existing_attended = existing_rec.get('hours_present', 0)
+                        existing_hours, existing_attended = (
+                            existing_day.hours(subject) if existing_day else None) or (0, 0)
 
                         conducted_hours = cols[0].number_input(
-                            "Hours Conducted", min_value=0, step=1, key=f"conducted_{subject}", value=existing_hours)
+                            "Hours Conducted", min_value=0, step=1, key=page_key("marking", f"conducted_{subject}"), value=existing_hours)
 
                         attended_hours = cols[1].number_input(
                             "Hours Attended", min_value=0, max_value=conducted_hours if conducted_hours > 0 else 100,
-                            step=1, key=f"attended_{subject}", value=existing_attended)
+                            step=1, key=page_key("marking", f"attended_{subject}"), value=existing_attended)
 
                         if conducted_hours > 0:
-                            if attended_hours == 0:
-                                status_str = "Absent"
-                            elif attended_hours == conducted_hours:
-                                status_str = "Present"
-                            else:
-                                status_str = "Partial"
-
                             form_submission_data.append({
                                 "subject": subject,
                                 "hours_conducted": conducted_hours,
                                 "hours_present": attended_hours,
-                                "status": status_str
+                                "status": status_for(conducted_hours, attended_hours)
                             })
 
                     if st.form_submit_button(f"Save Attendance for Saturday"):
-                        db.attendance_records.update_one(
-                            query, {"$set": {"records": form_submission_data}}, upsert=True)
-                        st.success(f"Saturday's attendance has been saved!")
-                        time.sleep(1)
-                        st.rerun()
+                        save_marking_form(username, list_name, selected_date_str_key, form_submission_data,
+                                          existing_day, "Saturday's attendance has been saved!",
+                                          base_save_id)
 
         else:  # REGULAR LOGIC FOR MONDAY - FRIDAY
-            schedule = timetable_doc.get("schedule", {}).get(
-                selected_day_str, []) if timetable_doc else []
+            # The schedule in force on the chosen date, not today's.
+            schedule = timetable.day_on(selected_date_str_key) if timetable else ()
 
             if not schedule:
                 st.info(f"No classes scheduled for {selected_day_str}. 🌴")
@@ -560,32 +1507,15 @@ else:
                 with st.form(key=f"attendance_form_{selected_date_str_key}"):
                     st.caption("Slide to select how many hours you attended.")
 
-                    # Get existing records to pre-fill the form
-                    existing_data = {
-                        rec['subject']: rec
-                        for rec in attendance_doc.get("records", [])
-                    } if attendance_doc else {}
-
                     form_submission_data = []
 
-                    for subject in schedule:
-                        subj_name = subject['name']
-                        total_hours = subject['hours']
-
+                    for subj_name, total_hours in schedule:
                         # Retrieve previous value if it exists, otherwise default to total_hours (assuming present)
-                        prev_record = existing_data.get(subj_name, {})
-
-                        # Handle old data format (status='Present') vs new format (hours_present=X)
-                        if 'hours_present' in prev_record:
-                            default_val = prev_record['hours_present']
-                        elif prev_record.get('status') == 'Absent':
-                            default_val = 0
-                        else:
-                            # Default to full attendance if no record or previously marked 'Present'
-                            default_val = total_hours
+                        prev_hours = existing_day.hours(subj_name) if existing_day else None
+                        default_val = min(prev_hours[1], total_hours) if prev_hours else total_hours
 
                         st.markdown(
-                            f"<h4>{subj_name} (Total: {total_hours} Hours)</h4>", unsafe_allow_html=True)
+                            f"<h4>{html.escape(str(subj_name))} (Total: {total_hours} Hours)</h4>", unsafe_allow_html=True)
 
                         # THE NEW SLIDER LOGIC
                         attended_count = st.slider(
@@ -594,17 +1524,12 @@ else:
                             max_value=total_hours,
                             value=default_val,
                             step=1,
-                            key=f"slider_{subj_name}",
+                            key=page_key("marking", f"slider_{subj_name}"),
                             label_visibility="collapsed"
                         )
 
                         # Determine status string for visual clarity
-                        if attended_count == 0:
-                            status_str = "Absent"
-                        elif attended_count == total_hours:
-                            status_str = "Present"
-                        else:
-                            status_str = "Partial"
+                        status_str = status_for(total_hours, attended_count)
 
                         st.caption(
                             f"Status: {status_str} ({attended_count}/{total_hours})")
@@ -617,42 +1542,23 @@ else:
                         })
 
                     if st.form_submit_button(f"Save Attendance"):
-                        db.attendance_records.update_one(
-                            query,
-                            {"$set": {"records": form_submission_data}},
-                            upsert=True
-                        )
-                        st.success(
-                            f"Attendance for {selected_date.strftime('%A, %d %B')} has been saved!")
-                        time.sleep(1)
-                        st.rerun()
+                        save_marking_form(username, list_name, selected_date_str_key, form_submission_data,
+                                          existing_day, f"Attendance for {selected_date.strftime('%A, %d %B')} has been saved!",
+                                          base_save_id)
 
         st.divider()
         st.markdown(f"<h2>📊 Your Cumulative Statistics</h2>",
                     unsafe_allow_html=True)
 
         # --- COMPLETE CUMULATIVE STATISTICS LOGIC ---
-        user_records_cursor = list(db.attendance_records.find(
-            {"list_name": list_name, "username": username}))
-
-        total_conducted = 0
-        total_present = 0
-
-        for doc in user_records_cursor:
-            for entry in doc.get("records", []):
-                # Get conducted hours (new or old format)
-                c_hours = entry.get('hours_conducted', entry.get('hours', 1))
-                total_conducted += c_hours
-
-                # Get present hours (new or old format)
-                if 'hours_present' in entry:
-                    total_present += entry['hours_present']
-                else:
-                    # Fallback for old data
-                    total_present += c_hours if entry.get(
-                        'status') == 'Present' else 0
-
-        total_absent = total_conducted - total_present
+        # Summed on the server per subject, so only the totals come back.
+        subject_stats, _ = totals_read()
+        cumulative = SubjectTotals(list_name)
+        for stats in subject_stats.values():
+            cumulative.conducted += stats.conducted
+            cumulative.present += stats.present
+        total_conducted, total_present = cumulative.conducted, cumulative.present
+        total_absent = cumulative.absent
         # --- END OF CUMULATIVE STATISTICS LOGIC ---
 
         stat_cols = st.columns(3)
@@ -670,19 +1576,7 @@ else:
             st.rerun()
         if col_edit.button("✏️ Edit This Timetable"):
             st.session_state.page = "edit_timetable"
-            st.session_state.form_step = 1
-            timetable_doc = db.timetables.find_one({"_id": list_name}) or {}
-            schedule = timetable_doc.get("schedule", {})
-            subjects = sorted(
-                list({s['name'] for day_sched in schedule.values() for s in day_sched}))
-            st.session_state.subject_list = subjects if subjects else [""]
-            for day in DAYS_OF_WEEK:
-                day_schedule = schedule.get(day, [])
-                subject_hours_map = {subj['name']: subj['hours']
-                                     for subj in day_schedule}
-                for subject_name in st.session_state.subject_list:
-                    st.session_state[f"{day}_{subject_name}_hours"] = subject_hours_map.get(
-                        subject_name, 0)
+            prefill_timetable_form(timetable, DAYS_OF_WEEK)
             st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -694,64 +1588,45 @@ else:
         st.markdown('<div class="main-container">', unsafe_allow_html=True)
         st.markdown("<h1>📊 Your Attendance Analysis</h1>",
                     unsafe_allow_html=True)
-        st.markdown(f"<h2>{list_name}</h2>", unsafe_allow_html=True)
+        st.markdown(f"<h2>{html.escape(list_name)}</h2>", unsafe_allow_html=True)
         st.divider()
 
-        subject_stats = {}
-        user_records_cursor = db.attendance_records.find(
-            {"list_name": list_name, "username": username})
-
-        for doc in user_records_cursor:
-            for record in doc.get("records", []):
-                subject_name = record['subject']
-
-                # --- NEW COMPATIBILITY LOGIC ---
-                # 1. Get Total Conducted Hours
-                # Use 'hours_conducted' if available (new format), else use 'hours' (old format)
-                # 'hours' from old import logic may be 1, so default to 1.
-                conducted = record.get('hours_conducted', record.get('hours', 1))
-
-                # 2. Get Total Present Hours
-                # Use 'hours_present' (new format).
-                # If not found, fallback to old logic: if Status is Present, count full hours, else 0.
-                if 'hours_present' in record:
-                    present = record['hours_present']
-                else:
-                    present = conducted if record.get(
-                        'status') == 'Present' else 0
-                # -------------------------------
-
-                if subject_name not in subject_stats:
-                    subject_stats[subject_name] = {'conducted': 0, 'present': 0}
+        range_start, range_end = date_range_selector(page_key("analysis", "dates"))
+        # Totals and the weekly trend come from one aggregation over the
+        # range; it runs while the calendar analytics load here.
+        totals_read = start_read(
+            ("range", username, list_name, range_start, range_end),
+            fetch_range_stats, read_db, username, list_name, range_start, range_end)
+        analytics = load_calendar_section(username, list_name, range_start, range_end)
+        subject_stats, weekly_trend = totals_read()
 
-                subject_stats[subject_name]['conducted'] += conducted
-                subject_stats[subject_name]['present'] += present
+        if len(weekly_trend) > 1:
+            st.markdown("<h3>Weekly Trend</h3>", unsafe_allow_html=True)
+            plot_weekly_trend(weekly_trend)
+        render_calendar_section(analytics)
 
         if not subject_stats:
-            st.info("You haven't marked any attendance for this list yet.")
+            st.info("You haven't marked any attendance for this list in this date range.")
         else:
             for subject, stats in subject_stats.items():
-                stats['absent'] = stats['conducted'] - stats['present']
                 st.markdown('<div class="glass-subject-row">',
                             unsafe_allow_html=True)
                 col1, col2 = st.columns([2, 1])
                 with col1:
-                    st.markdown(f"<h3>{subject}</h3>", unsafe_allow_html=True)
-                    percentage = (
-                        stats['present'] / stats['conducted'] * 100) if stats['conducted'] > 0 else 0
+                    st.markdown(f"<h3>{html.escape(str(subject))}</h3>", unsafe_allow_html=True)
                     st.markdown(
-                        f"**Attendance:** <span class='percentage-display'>{percentage:.1f}%</span>", unsafe_allow_html=True)
+                        f"**Attendance:** <span class='percentage-display'>{stats.percentage:.1f}%</span>", unsafe_allow_html=True)
                     mini_stat_cols = st.columns(3)
                     mini_stat_cols[0].markdown(
-                        f"<div class='glass-stat-box' style='padding: 0.5rem;'><div class='stat-value' style='font-size: 1.5rem;'>{stats['conducted']}</div><div class='stat-label'>Conducted</div></div>", unsafe_allow_html=True)
+                        f"<div class='glass-stat-box' style='padding: 0.5rem;'><div class='stat-value' style='font-size: 1.5rem;'>{stats.conducted}</div><div class='stat-label'>Conducted</div></div>", unsafe_allow_html=True)
                     mini_stat_cols[1].markdown(
-                        f"<div class='glass-stat-box' style='padding: 0.5rem;'><div class='stat-value' style='font-size: 1.5rem;'>{stats['present']}</div><div class='stat-label'>Present</div></div>", unsafe_allow_html=True)
+                        f"<div class='glass-stat-box' style='padding: 0.5rem;'><div class='stat-value' style='font-size: 1.5rem;'>{stats.present}</div><div class='stat-label'>Present</div></div>", unsafe_allow_html=True)
                     mini_stat_cols[2].markdown(
-                        f"<div class='glass-stat-box' style='padding: 0.5rem;'><div class='stat-value' style='font-size: 1.5rem;'>{stats['absent']}</div><div class='stat-label'>Absent</div></div>", unsafe_allow_html=True)
+                        f"<div class='glass-stat-box' style='padding: 0.5rem;'><div class='stat-value' style='font-size: 1.5rem;'>{stats.absent}</div><div class='stat-label'>Absent</div></div>", unsafe_allow_html=True)
                 with col2:
-                    if stats['conducted'] > 0 and (stats['present'] > 0 or stats['absent'] > 0):
+                    if stats.conducted > 0 and (stats.present > 0 or stats.absent > 0):
                         labels, sizes, colors = ['Present', 'Absent'], [
-                            stats['present'], stats['absent']], ['#00DFFC', '#F44336']
+                            stats.present, stats.absent], ['#00DFFC', '#F44336']
                         text_color = 'white' if st.session_state.theme == 'dark' else '#333'
                         fig, ax = plt.subplots(figsize=(3, 3))
                         ax.pie(sizes, autopct='%1.1f%%', startangle=90,
@@ -762,7 +1637,8 @@ else:
                                  size=10, weight="bold")
                         ax.axis('equal')
                         st.pyplot(fig)
-                    elif stats['conducted'] > 0:
+                        plt.close(fig)
+                    elif stats.conducted > 0:
                         st.info("No data to plot.")
                 st.markdown('</div>', unsafe_allow_html=True)
         if st.button("🔙 Back to Dashboard"):
@@ -776,7 +1652,7 @@ else:
         st.markdown('<div class="main-container">', unsafe_allow_html=True)
         username = st.session_state.get("username")
         st.markdown("<h1>🔑 Change Password</h1>", unsafe_allow_html=True)
-        st.markdown(f"<h2>User: {username}</h2>", unsafe_allow_html=True)
+        st.markdown(f"<h2>User: {html.escape(username)}</h2>", unsafe_allow_html=True)
         st.divider()
         with st.form(key="change_password_form"):
             old_password = st.text_input("Old Password", type="password")
@@ -788,16 +1664,19 @@ else:
                 if not old_password or not new_password or not confirm_new_password:
                     st.warning("Please fill in all fields.")
                 else:
-                    user_data = db.users.find_one({"_id": username})
+                    user_data = db.users.find_one({"_id": username}, {"password": 1})
                     if user_data and verify_password(old_password, user_data["password"]):
                         if new_password == confirm_new_password:
                             hashed_pass = hash_password(new_password)
-                            db.users.update_one({"_id": username}, {
-                                "$set": {"password": hashed_pass}})
-                            st.success("Password updated successfully!")
-                            time.sleep(1.5)
-                            st.session_state.page = "dashboard"
-                            st.rerun()
+                            if guarded_write(db.users.update_one, {"_id": username}, {
+                                    "$set": {"password": hashed_pass}}):
+                                # Sign out every other browser that used the old password.
+                                revoke_user_sessions(
+                                    db, username, keep_cookie=st.session_state.get("session_cookie"))
+                                st.success("Password updated successfully!")
+                                time.sleep(1.5)
+                                st.session_state.page = "dashboard"
+                                st.rerun()
                         else:
                             st.error("New passwords do not match.")
                     else:
@@ -813,7 +1692,7 @@ else:
         old_username = st.session_state.get("username")
         st.markdown("<h1>👤 Change Username</h1>", unsafe_allow_html=True)
         st.markdown(
-            f"<h2>Current User: {old_username}</h2>", unsafe_allow_html=True)
+            f"<h2>Current User: {html.escape(old_username)}</h2>", unsafe_allow_html=True)
         st.warning(
             "Changing your username will update all your owned timetables and attendance records.")
         st.divider()
@@ -828,9 +1707,9 @@ else:
                 elif new_username == old_username:
                     st.error("New username cannot be the same as the old one.")
                 else:
-                    user_data = db.users.find_one({"_id": old_username})
+                    user_data = db.users.find_one({"_id": old_username}, {"password": 1})
                     if user_data and verify_password(current_password, user_data["password"]):
-                        if db.users.find_one({"_id": new_username}):
+                        if db.users.find_one({"_id": new_username}, {"_id": 1}):
                             st.error(
                                 "This username is already taken. Please choose another one.")
                         else:
@@ -841,10 +1720,17 @@ else:
                                             {"_id": new_username, "password": user_data["password"]}, session=session)
                                         db.timetables.update_many({"owner": old_username}, {
                                             "$set": {"owner": new_username}}, session=session)
-                                        db.attendance_records.update_many({"username": old_username}, {
+                                        move_user_records(db, old_username, new_username, session=session)
+                                        db.attendance_stamps.update_many({"username": old_username}, {
+                                            "$set": {"username": new_username}}, session=session)
+                                        db.attendance_tombstones.update_many({"username": old_username}, {
+                                            "$set": {"username": new_username, "day.username": new_username}},
+                                            session=session)
+                                        db.sessions.update_many({"username": old_username}, {
                                             "$set": {"username": new_username}}, session=session)
                                         db.users.delete_one(
                                             {"_id": old_username}, session=session)
+                                journal.rename_user(old_username, new_username)
                                 st.success(
                                     f"Username successfully changed to '{new_username}'!")
                                 st.session_state["username"] = new_username
@@ -869,8 +1755,7 @@ else:
             "Enter the totals from your Excel sheet to bring your records up to date.")
         st.divider()
         username = st.session_state.get("username")
-        user_timetables = list(db.timetables.find({}, {"_id": 1}))
-        timetable_options = [t["_id"] for t in user_timetables]
+        timetable_options = [t["_id"] for t in visible_timetables(username)]
         if not timetable_options:
             st.warning(
                 "You must create or have access to at least one timetable before importing data.")
@@ -882,26 +1767,27 @@ else:
             import_date_str = import_date.strftime("%Y-%m-%d")
             st.markdown("<h3>Enter Subject Totals</h3>",
                         unsafe_allow_html=True)
-            if 'import_subjects' not in st.session_state:
-                st.session_state.import_subjects = [
+            if IMPORT_SUBJECTS_KEY not in st.session_state:
+                st.session_state[IMPORT_SUBJECTS_KEY] = [
                     {"name": "", "present": 0, "absent": 0}]
-            for i, subject in enumerate(st.session_state.import_subjects):
+            import_subjects = st.session_state[IMPORT_SUBJECTS_KEY]
+            for i, subject in enumerate(import_subjects):
                 cols = st.columns([2, 1, 1])
-                st.session_state.import_subjects[i]['name'] = cols[0].text_input(
-                    "Subject Name", value=subject['name'], key=f"import_name_{i}")
-                st.session_state.import_subjects[i]['present'] = cols[1].number_input(
-                    "Present", min_value=0, value=subject['present'], key=f"import_present_{i}")
-                st.session_state.import_subjects[i]['absent'] = cols[2].number_input(
-                    "Absent", min_value=0, value=subject['absent'], key=f"import_absent_{i}")
+                import_subjects[i]['name'] = cols[0].text_input(
+                    "Subject Name", value=subject['name'], key=page_key("import", f"name_{i}"))
+                import_subjects[i]['present'] = cols[1].number_input(
+                    "Present", min_value=0, value=subject['present'], key=page_key("import", f"present_{i}"))
+                import_subjects[i]['absent'] = cols[2].number_input(
+                    "Absent", min_value=0, value=subject['absent'], key=page_key("import", f"absent_{i}"))
             if st.button("➕ Add Subject"):
-                st.session_state.import_subjects.append(
+                import_subjects.append(
                     {"name": "", "present": 0, "absent": 0})
                 st.rerun()
             st.divider()
             if st.button("✅ Import Data", type="primary"):
                 with st.spinner("Importing records..."):
                     all_records = []
-                    for subject_data in st.session_state.import_subjects:
+                    for subject_data in import_subjects:
                         name = subject_data['name'].strip()
                         if not name:
                             continue
@@ -916,19 +1802,36 @@ else:
                     if not all_records:
                         st.warning(
                             "Please enter some attendance data before importing.")
-                    else:
-                        db.attendance_records.update_one({"list_name": selected_list, "date": import_date_str, "username": username}, {
-                            "$set": {"records": all_records, "is_import": True}}, upsert=True)
+                    elif guarded_write(save_day, db, username, selected_list, import_date_str,
+                                       all_records, force=True, extra={"is_import": True}):
                         st.success(
                             f"Successfully imported historical data for '{selected_list}'!")
-                        del st.session_state.import_subjects
                         time.sleep(2)
                         st.session_state.page = "dashboard"
                         st.rerun()
+
+            st.divider()
+            st.markdown("<h3>Backfill From the Timetable</h3>", unsafe_allow_html=True)
+            st.caption(
+                "Marks every class between two dates as attended, using the timetable as it was on each date. Holidays and dates you have already marked are left alone.")
+            today = datetime.now().date()
+            picked = st.date_input("From / to:", (today - timedelta(days=6), today),
+                                   max_value=today, key=page_key("import", "backfill_dates"))
+            if st.button("📅 Backfill Attended Classes", disabled=len(picked) < 2):
+                timetable = load_timetable(selected_list)
+                if timetable is None:
+                    st.error(f"'{selected_list}' no longer exists.")
+                else:
+                    outcome = []
+                    if guarded_write(lambda: outcome.append(backfill_days(
+                            db, username, selected_list, timetable,
+                            picked[0].strftime("%Y-%m-%d"), picked[1].strftime("%Y-%m-%d")))):
+                        if outcome[0]:
+                            st.success(f"Marked {outcome[0]} day(s) of '{selected_list}' as attended.")
+                        else:
+                            st.info("Every scheduled day in that range is already marked.")
         if st.button("🔙 Back to Dashboard"):
             st.session_state.page = "dashboard"
-            if 'import_subjects' in st.session_state:
-                del st.session_state.import_subjects
             st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -941,9 +1844,7 @@ else:
         st.divider()
 
         username = st.session_state.get("username")
-        query = {"$or": [{"is_public": True}, {"owner": username}]}
-        timetable_options = [t["_id"]
-                             for t in db.timetables.find(query, {"_id": 1})]
+        timetable_options = [t["_id"] for t in visible_timetables(username)]
 
         if not timetable_options:
             st.warning("No timetables available. Please create one first.")
@@ -952,44 +1853,53 @@ else:
                 "Select a timetable for prediction:", timetable_options)
 
             if selected_list:
-                timetable_doc = db.timetables.find_one({"_id": selected_list})
-                schedule = timetable_doc.get("schedule", {})
-                all_subjects = sorted(
-                    list({s['name'] for day_sched in schedule.values() for s in day_sched}))
-
-                user_records_cursor = list(db.attendance_records.find(
-                    {"list_name": selected_list, "username": username}))
+                range_start, range_end = date_range_selector(page_key("prediction", "dates"))
+                # The range totals load while the timetable and the semester
+                # totals (which need its calendar) are fetched here.
+                totals_read = start_read(
+                    ("range", username, selected_list, range_start, range_end),
+                    fetch_range_stats, read_db, username, selected_list, range_start, range_end)
+                timetable = load_timetable(selected_list)
+                all_subjects = timetable.subjects if timetable else ()
 
                 st.markdown(
-                    f"<h3>Prediction Status for '{selected_list}'</h3>", unsafe_allow_html=True)
+                    f"<h3>Prediction Status for '{html.escape(selected_list)}'</h3>", unsafe_allow_html=True)
+
+                # With a semester calendar, project each subject to the end of
+                # term from its totals since the first day of term.
+                projection = None
+                calendar = timetable.calendar if timetable else None
+                today_str = datetime.now().strftime("%Y-%m-%d")
+                if all_subjects and calendar is not None:
+                    semester_stats, _ = resilient_read(
+                        ("range", username, selected_list, calendar.start, None),
+                        fetch_range_stats, read_db, username, selected_list, calendar.start, None)
+                    totals = [semester_stats.get(subject) or SubjectTotals(subject)
+                              for subject in all_subjects]
+                    changes, weekly_hours = timetable.versioned_hours(WEEKDAY_NAMES)
+                    dates, cumulative = load_semester_index(
+                        weekly_hours, calendar.start, calendar.end, calendar.holidays, changes)
+                    projection = semester_projection(
+                        dates, cumulative, today_str,
+                        [t.conducted for t in totals], [t.present for t in totals], 80)
+                    if today_str >= calendar.end:
+                        st.info(f"The semester ended on {calendar.end}.")
+                    else:
+                        st.caption(
+                            f"Semester: {calendar.start} to {calendar.end}, {len(calendar.holidays)} holiday(s). Projections count the classes left after today.")
+                subject_stats, _ = totals_read()
 
                 if not all_subjects:
                     st.warning("No subjects are defined for this timetable.")
                 else:
-                    for subject_name in all_subjects:
-                        subject_conducted = 0
-                        subject_present = 0
-
-                        # --- UPDATED PREDICTION LOGIC ---
-                        for doc in user_records_cursor:
-                            for record in doc.get("records", []):
-                                if record.get("subject") == subject_name:
-                                    # 1. Get Conducted
-                                    c_hours = record.get(
-                                        'hours_conducted', record.get('hours', 1))
-                                    subject_conducted += c_hours
-
-                                    # 2. Get Present
-                                    if 'hours_present' in record:
-                                        subject_present += record['hours_present']
-                                    else:
-                                        subject_present += c_hours if record.get(
-                                            'status') == 'Present' else 0
-                        # --- END UPDATED LOGIC ---
+                    for subject_index, subject_name in enumerate(all_subjects):
+                        stats = subject_stats.get(subject_name) or SubjectTotals(subject_name)
+                        subject_conducted = stats.conducted
+                        subject_present = stats.present
 
                         st.markdown('<div class="glass-subject-row">',
                                     unsafe_allow_html=True)
-                        st.markdown(f"<h4>{subject_name}</h4>",
+                        st.markdown(f"<h4>{html.escape(str(subject_name))}</h4>",
                                     unsafe_allow_html=True)
 
                         if subject_conducted == 0:
@@ -1009,14 +1919,27 @@ else:
                                 # 0.8C - P = 0.2x
                                 # 5 * (0.8C - P) = x
                                 # 4C - 5P = x
-                                classes_needed = math.ceil(
-                                    (4 * subject_conducted) - (5 * subject_present))
-                                if classes_needed <= 0:
+                                needed = classes_needed(
+                                    subject_conducted, subject_present, 80)
+                                if needed <= 0:
                                     # This can happen due to ceil() and floating point, means they are very close
                                     st.success("🎉 Target met! Keep it up.")
                                 else:
                                     st.warning(
-                                        f"You need to attend **{classes_needed} more classes** (hours) of this subject to reach 80%.")
+                                        f"You need to attend **{needed} more classes** (hours) of this subject to reach 80%.")
+                        if projection is not None:
+                            remaining = int(projection["remaining"][subject_index])
+                            semester_needed = int(projection["needed"][subject_index])
+                            if not projection["reachable"][subject_index]:
+                                st.error(
+                                    f"❌ Only {remaining} hour(s) are left this semester but you need {semester_needed}, so 80% can't be reached before {calendar.end}.")
+                            elif semester_needed > 0:
+                                reach_date = projection["reach_date"][subject_index].item()
+                                st.info(
+                                    f"📅 Attend every class and you reach 80% on **{reach_date.strftime('%A, %d %B')}**.")
+                            if remaining > 0 and projection["reachable"][subject_index]:
+                                st.caption(
+                                    f"You can miss at most {int(projection['max_skippable'][subject_index])} of the {remaining} hour(s) left this semester and still finish at 80%.")
                         st.markdown('</div>', unsafe_allow_html=True)
 
         if st.button("🔙 Back to Dashboard"):
@@ -1030,40 +1953,56 @@ else:
         st.markdown('<div class="main-container">', unsafe_allow_html=True)
         st.markdown("<h1>🗑️ Reset Attendance</h1>", unsafe_allow_html=True)
         st.caption(
-            "Permanently delete your attendance record for a specific date.")
+            f"Delete your attendance for one date or a range of dates. A reset can be undone for {UNDO_DAYS} days.")
         st.divider()
 
         username = st.session_state.get("username")
-        query = {"$or": [{"is_public": True}, {"owner": username}]}
-        timetable_options = [t["_id"]
-                             for t in db.timetables.find(query, {"_id": 1})]
+        timetable_options = [t["_id"] for t in visible_timetables(username)]
 
         if not timetable_options:
             st.warning("No timetables available to reset.")
         else:
             selected_list = st.selectbox(
                 "Select a timetable:", timetable_options)
-            selected_date = st.date_input(
-                "Select the date to reset:", datetime.now())
+            today = datetime.now().date()
+            picked = st.date_input(
+                "Select the date, or the first and last date, to reset:", (today, today))
+            # While the user is still picking, only the first date is set.
+            start_str = picked[0].strftime("%Y-%m-%d") if len(picked) > 0 else None
+            end_str = picked[1].strftime("%Y-%m-%d") if len(picked) > 1 else start_str
+            dates_label = (f"on {start_str}" if start_str == end_str
+                           else f"from {start_str} to {end_str}")
 
             st.divider()
 
-            if st.button("Find and Reset Record", type="primary"):
-                date_str = selected_date.strftime("%Y-%m-%d")
-                query_to_delete = {"list_name": selected_list,
-                                   "date": date_str, "username": username}
-
-                # Check if a record exists before attempting deletion
-                record_to_delete = db.attendance_records.find_one(
-                    query_to_delete)
+            if st.button("Find and Reset Records", type="primary", disabled=start_str is None):
+                # Every day in the range moves to the tombstones in one go.
+                outcome = []
+                if guarded_write(lambda: outcome.append(
+                        reset_days(db, username, selected_list, start_str, end_str))):
+                    reset_id, days = outcome[0]
+                    if days:
+                        st.success(
+                            f"Your attendance for {selected_list} {dates_label} has been deleted ({days} day(s)).")
+                    else:
+                        st.error(
+                            f"No attendance record found for you in '{selected_list}' {dates_label}.")
 
-                if record_to_delete:
-                    db.attendance_records.delete_one(query_to_delete)
-                    st.success(
-                        f"Your attendance record for {selected_list} on {date_str} has been successfully deleted.")
-                else:
-                    st.error(
-                        f"No attendance record found for you in '{selected_list}' on {date_str}.")
+        resets = resilient_read(("resets", username), recent_resets, db, username)
+        if resets:
+            st.divider()
+            st.subheader("Undo a Reset")
+            for reset in resets:
+                dates = (reset["first_date"] if reset["first_date"] == reset["last_date"]
+                         else f"{reset['first_date']} to {reset['last_date']}")
+                cols = st.columns([4, 1])
+                cols[0].caption(f"{reset['list_name']}: {reset['days']} day(s), {dates}")
+                if cols[1].button("↩️ Undo", key=page_key("reset", f"undo_{reset['_id']}")):
+                    outcome = []
+                    if guarded_write(lambda: outcome.append(undo_reset(db, username, reset["_id"]))):
+                        st.success(f"Restored {outcome[0]} day(s) of {reset['list_name']}.")
+                        time.sleep(2)
+                        st.rerun()
 
         if st.button("🔙 Back to Dashboard"):
             st.session_state.page = "dashboard"
@@ -1080,51 +2019,38 @@ else:
         st.divider()
 
         username = st.session_state.get("username")
-        query = {"$or": [{"is_public": True}, {"owner": username}]}
-        timetable_options = [t["_id"]
-                             for t in db.timetables.find(query, {"_id": 1})]
+        timetable_options = [t["_id"] for t in visible_timetables(username)]
 
         if not timetable_options:
             st.warning("No timetables available to view.")
         else:
             selected_list = st.selectbox(
-                "Select a timetable:", timetable_options, key="view_list_select")
+                "Select a timetable:", timetable_options, key=page_key("view", "list_select"))
             selected_date = st.date_input(
-                "Select the date to view:", datetime.now(), key="view_date_select")
+                "Select the date to view:", datetime.now(), key=page_key("view", "date_select"))
 
             st.divider()
 
             date_str = selected_date.strftime("%Y-%m-%d")
-            query_to_view = {"list_name": selected_list,
-                             "date": date_str, "username": username}
-
-            attendance_doc = db.attendance_records.find_one(query_to_view)
+            # Stepping through dates is served from the session's window of days.
+            day_doc, _ = window_day("view", read_db, username, selected_list, date_str)
+            day_record = resilient_read(
+                ("day", username, selected_list, date_str),
+                lambda: day_records(read_db, selected_list, [day_doc])[0])
 
-            if attendance_doc:
+            if day_record:
                 st.markdown(
                     f"<h3>Records for {selected_date.strftime('%A, %d %B %Y')}</h3>", unsafe_allow_html=True)
-                records = attendance_doc.get("records", [])
-                if not records:
+                if not len(day_record):
                     st.info(
                         "No records found for this day, though the entry exists.")
 
-                for record in records:
-                    subj_name = record.get('subject')
-                    conducted = record.get(
-                        'hours_conducted', record.get('hours', 1))
-
-                    if 'hours_present' in record:
-                        present = record['hours_present']
-                    else:
-                        present = conducted if record.get(
-                            'status') == 'Present' else 0
-
-                    status = record.get('status', 'N/A')
+                for subj_name, conducted, present, status in day_record:
 
                     st.markdown(
                         '<div class="glass-subject-row">', unsafe_allow_html=True)
                     st.markdown(
-                        f"<h4>{subj_name}</h4>", unsafe_allow_html=True)
+                        f"<h4>{html.escape(str(subj_name))}</h4>", unsafe_allow_html=True)
 
                     cols = st.columns(2)
                     cols[0].metric("Hours", f"{present} / {conducted}")
@@ -1156,23 +2082,30 @@ else:
         st.divider()
 
         username = st.session_state.get("username")
-        query = {"$or": [{"is_public": True}, {"owner": username}]}
-        timetable_options = [t["_id"] for t in db.timetables.find(query, {"_id": 1})]
+        timetable_options = [t["_id"] for t in visible_timetables(username)]
 
         if not timetable_options:
             st.warning("No timetables available.")
         else:
-            selected_list = st.selectbox("Select a timetable:", timetable_options, key="absent_list_select")
+            selected_list = st.selectbox("Select a timetable:", timetable_options, key=page_key("absent_report", "list_select"))
             
-            # Fetch all records for this list
-            all_records_cursor = db.attendance_records.find(
-                {"list_name": selected_list, "username": username}
-            ).sort("date", -1) # Sort by date descending (newest first)
+            # Fetch all records for this list, archived semesters included
+            def load_all_days():
+                docs = list(read_db.attendance_records.find(
+                    {"list_name": selected_list, "username": username}, DAY_RECORD_FIELDS))
+                hot_dates = {doc["date"] for doc in docs}
+                docs += [doc for doc in archived_days(read_db, username, selected_list)
+                         if doc["date"] not in hot_dates]
+                # Sort by date descending (newest first)
+                docs.sort(key=lambda doc: doc["date"], reverse=True)
+                return day_records(read_db, selected_list, docs)
+
+            absent_days = resilient_read(("days", username, selected_list), load_all_days)
 
             absent_data = []
 
-            for doc in all_records_cursor:
-                date_str = doc.get("date")
+            for day_record in absent_days:
+                date_str = day_record.date
                 try:
                     date_obj = datetime.strptime(date_str, "%Y-%m-%d")
                     day_name = date_obj.strftime("%A")
@@ -1181,18 +2114,8 @@ else:
                     day_name = "Unknown"
                     formatted_date = date_str
 
-                for record in doc.get("records", []):
-                    subject = record.get("subject")
-                    
+                for subject, conducted, present, _ in day_record:
                     # Calculate hours lost
-                    conducted = record.get('hours_conducted', record.get('hours', 1))
-                    
-                    if 'hours_present' in record:
-                        present = record['hours_present']
-                    else:
-                        # Old data fallback
-                        present = conducted if record.get('status') == 'Present' else 0
-                    
                     hours_lost = conducted - present
 
                     if hours_lost > 0:
@@ -1214,7 +2137,7 @@ else:
                     "Filter by Subject:",
                     options=unique_subjects,
                     default=unique_subjects,
-                    key="absent_subject_filter"
+                    key=page_key("absent_report", "subject_filter")
                 )
                 
                 # Filter the data based on selection
@@ -1248,11 +2171,282 @@ else:
 
         st.markdown('</div>', unsafe_allow_html=True)
 
-    # 2K. DASHBOARD PAGE (Default)
+    # 2K. ROSTER PAGE (timetable owners mark a whole class)
+    elif st.session_state.page == "roster":
+        list_name = st.session_state.get("selected_list", "Unknown")
+        username = st.session_state.get("username")
+        st.markdown('<div class="main-container">', unsafe_allow_html=True)
+        st.markdown("<h1>🧑‍🏫 Class Roster</h1>", unsafe_allow_html=True)
+        st.markdown(f"<h2>{html.escape(list_name)}</h2>", unsafe_allow_html=True)
+
+        timetable = load_timetable(list_name)
+        if not timetable or timetable.owner != username:
+            st.error("Only the owner of this timetable can mark the class roster.")
+        else:
+            roster_date = st.date_input("Date to mark:", datetime.now(),
+                                        key=page_key("roster", "date"))
+            roster_date_str = roster_date.strftime("%Y-%m-%d")
+            students = resilient_read(("roster", list_name),
+                                      roster_usernames, read_db, list_name)
+            if not students:
+                st.info("Nobody has marked attendance on this timetable yet, so there is no class list.")
+            else:
+                st.caption(
+                    f"{len(students)} students. Set the hours held today, then the hours each student attended. Saving replaces the students' own entries for this date.")
+                day_schedule = timetable.day_on(roster_date_str)
+                hour_cols = st.columns(min(len(timetable.subjects), 4) or 1)
+                conducted = {}
+                for i, subject in enumerate(timetable.subjects):
+                    conducted[subject] = hour_cols[i % len(hour_cols)].number_input(
+                        f"{subject} (hours held)", min_value=0, step=1,
+                        value=day_schedule.hours_for(subject),
+                        key=page_key("roster", f"held_{roster_date_str}_{subject}"))
+                held = [subject for subject in timetable.subjects if conducted[subject] > 0]
+
+                if not held:
+                    st.info("Set the hours held for at least one subject.")
+                else:
+                    # One editable grid for the whole class; students without a
+                    # record for the date start as fully present.
+                    def load_roster_records():
+                        docs = roster_day(db, list_name, roster_date_str, students)
+                        return dict(zip(docs, day_records(db, list_name, list(docs.values()))))
+
+                    existing = resilient_read(
+                        ("roster_day", list_name, roster_date_str), load_roster_records)
+                    grid = {"Student": students}
+                    for subject in held:
+                        grid[subject] = [
+                            min((existing[name].hours(subject) or (0, conducted[subject]))[1],
+                                conducted[subject]) if name in existing else conducted[subject]
+                            for name in students]
+                    edited = st.data_editor(
+                        grid, hide_index=True, width="stretch", disabled=["Student"],
+                        column_config={subject: st.column_config.NumberColumn(
+                            subject, min_value=0, max_value=conducted[subject], step=1)
+                            for subject in held},
+                        key=page_key("roster", f"grid_{roster_date_str}"))
+
+                    if st.button(f"💾 Save Roster for {len(students)} Students", type="primary",
+                                 disabled=database_degraded()):
+                        marks = {}
+                        for row, name in enumerate(edited["Student"]):
+                            records = []
+                            for subject in held:
+                                present = min(max(int(edited[subject][row] or 0), 0), conducted[subject])
+                                records.append({"subject": subject,
+                                                "hours_conducted": conducted[subject],
+                                                "hours_present": present,
+                                                "status": status_for(conducted[subject], present)})
+                            marks[name] = records
+                        if guarded_write(save_roster, db, list_name, roster_date_str, marks, username):
+                            st.success(
+                                f"Attendance for {roster_date.strftime('%A, %d %B')} saved for {len(marks)} students!")
+                            time.sleep(1)
+                            st.rerun()
+
+            st.divider()
+            st.markdown("<h3>🎟️ Check-in Codes</h3>", unsafe_allow_html=True)
+            st.caption(
+                "Students enter the code on their dashboard (or open the app with ?checkin=CODE) to mark themselves present for one subject on this date.")
+            code_cols = st.columns(3)
+            code_subject = code_cols[0].selectbox(
+                "Subject", timetable.subjects, key=page_key("roster", "code_subject"))
+            code_hours = code_cols[1].number_input(
+                "Hours", min_value=1, step=1,
+                value=max(timetable.day_on(roster_date_str).hours_for(code_subject), 1),
+                key=page_key("roster", f"code_hours_{roster_date_str}_{code_subject}"))
+            code_minutes = code_cols[2].number_input(
+                "Valid for (minutes)", min_value=1, max_value=180, value=10, step=1,
+                key=page_key("roster", "code_minutes"))
+            if st.button("🎟️ Create Check-in Code", disabled=database_degraded() or not code_subject):
+                if guarded_write(create_code, db, list_name, roster_date_str, code_subject,
+                                 code_hours, username, minutes=code_minutes):
+                    st.rerun()
+            for code_doc in resilient_read(("checkin_codes", list_name, roster_date_str),
+                                           active_codes, db, list_name, roster_date_str):
+                expires = code_doc["expires_at"].replace(tzinfo=timezone.utc).astimezone()
+                st.markdown(
+                    f"<h2 style='letter-spacing: 0.3em;'>{code_doc['_id']}</h2>", unsafe_allow_html=True)
+                st.caption(
+                    f"{code_doc['subject']}, {code_doc['hours']} hour(s) — valid until {expires.strftime('%H:%M')}")
+
+        st.divider()
+        if st.button("🔙 Back to Dashboard"):
+            st.session_state.page = "dashboard"
+            st.rerun()
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # 2L. ADMIN: SESSION MEMORY PAGE
+    elif st.session_state.page == "session_memory" and st.session_state.get("username") in ADMIN_USERS:
+        st.markdown('<div class="main-container">', unsafe_allow_html=True)
+        st.markdown("<h1>🧠 Session Memory</h1>", unsafe_allow_html=True)
+        st.caption(
+            f"Server memory held in session state by each open browser tab, measured every {FOOTPRINT_EVERY_RERUNS} interactions.")
+        st.divider()
+
+        sessions = footprints.snapshot()
+        total_bytes = sum(row["bytes"] for row in sessions)
+        stat_cols = st.columns(4)
+        stat_cols[0].metric("Live Sessions", len(sessions))
+        stat_cols[1].metric("Total State", f"{total_bytes / 1024:.1f} KB")
+        stat_cols[2].metric("Average per Session",
+                            f"{total_bytes / len(sessions) / 1024:.1f} KB" if sessions else "—")
+        stat_cols[3].metric("This Session", f"{sum(session_state_sizes.values()) / 1024:.1f} KB")
+
+        st.markdown("<h3>Sessions</h3>", unsafe_allow_html=True)
+        now = time.time()
+        st.dataframe([{"User": row["username"] or "(not logged in)", "Page": row["page"],
+                       "Keys": row["keys"], "KB": round(row["bytes"] / 1024, 1),
+                       "Idle (s)": int(now - row["seen_at"])} for row in sessions],
+                     width="stretch", hide_index=True)
+
+        st.markdown("<h3>This Session's Largest Keys</h3>", unsafe_allow_html=True)
+        st.dataframe([{"Key": key, "KB": round(size / 1024, 2)}
+                      for key, size in list(session_state_sizes.items())[:25]],
+                     width="stretch", hide_index=True)
+
+        if st.button("🔙 Back to Dashboard"):
+            st.session_state.page = "dashboard"
+            st.rerun()
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # 2M. ADMIN: PROFILES PAGE
+    elif st.session_state.page == "profiles" and st.session_state.get("username") in ADMIN_USERS:
+        st.markdown('<div class="main-container">', unsafe_allow_html=True)
+        st.markdown("<h1>⏱️ Profiles</h1>", unsafe_allow_html=True)
+        st.caption(
+            "Where the Python time and memory of a rerun went, for reruns admins chose to profile on this server.")
+        st.divider()
+
+        st.markdown("<h3>Profile My Next Reruns</h3>", unsafe_allow_html=True)
+        arm_cols = st.columns([1, 2])
+        reruns = arm_cols[0].number_input("Reruns", min_value=1, max_value=MAX_PROFILED_RERUNS,
+                                          value=5, key=page_key("profiles", "reruns"),
+                                          label_visibility="collapsed")
+        if arm_cols[1].button("⏱️ Start Profiling"):
+            arm_profiling(reruns)
+        remaining = st.session_state.get(PROFILE_RERUNS_KEY, 0)
+        if remaining:
+            st.info(f"The next {remaining} rerun(s) of this tab will be profiled. "
+                    "Open the slow page and use it as usual, then come back here.")
+        st.caption("A link ending in ?profile=5 does the same for the tab that opens it.")
+
+        st.divider()
+        stored = profiles.snapshot()
+        if not stored:
+            st.info("No profiles yet.")
+        else:
+            chosen = st.selectbox(
+                "Profile:", range(len(stored)), key=page_key("profiles", "chosen"),
+                format_func=lambda i: (
+                    f"{datetime.fromtimestamp(stored[i]['started_at']).strftime('%Y-%m-%d %H:%M:%S')}"
+                    f" · {stored[i]['page']} · {stored[i]['username']} · {stored[i]['seconds']:.3f} s"))
+            profile = stored[chosen]
+            stat_cols = st.columns(3)
+            stat_cols[0].metric("Page", profile["page"])
+            stat_cols[1].metric("Profiled Time", f"{profile['seconds'] * 1000:.0f} ms")
+            stat_cols[2].metric("Function Calls", f"{profile['calls']:,}")
+
+            st.markdown("<h3>Flame Graph</h3>", unsafe_allow_html=True)
+            flame = call_tree(profile["stats"])
+            if flame:
+                plot_flame_graph(flame, sum(row[2] for row in flame if row[0] == 0))
+            st.caption("Calls made by the page's code are on top; what each one called is below it. "
+                       "Time spent in app.py's own lines between calls isn't counted.")
+
+            st.markdown("<h3>Top Functions</h3>", unsafe_allow_html=True)
+            sort = st.radio("Sort by:", ["cumulative", "self"], horizontal=True,
+                            key=page_key("profiles", "sort"))
+            st.dataframe([{"Function": row["function"], "Calls": row["calls"],
+                           "Self (ms)": round(row["self_s"] * 1000, 2),
+                           "Cumulative (ms)": round(row["cumulative_s"] * 1000, 2)}
+                          for row in top_functions(profile["stats"], sort=sort)],
+                         width="stretch", hide_index=True)
+
+            st.markdown("<h3>Top Allocation Sites</h3>", unsafe_allow_html=True)
+            if profile["allocations"]:
+                st.dataframe([{"Line": row["site"], "File": row["file"], "KB": round(row["kb"], 1),
+                               "Blocks": row["blocks"]} for row in profile["allocations"]],
+                             width="stretch", hide_index=True)
+                st.caption("Memory still allocated at the end of the rerun, by the line that "
+                           "allocated it. Other sessions running at the same time are included.")
+            else:
+                st.caption("No allocations recorded.")
+
+            stamp = datetime.fromtimestamp(profile["started_at"]).strftime('%Y%m%d-%H%M%S')
+            dl_cols = st.columns(2)
+            dl_cols[0].download_button("⬇️ pstats File", pstats_bytes(profile["stats"]),
+                                       file_name=f"{profile['page']}-{stamp}.pstats",
+                                       key=page_key("profiles", "pstats"))
+            dl_cols[1].download_button("⬇️ Collapsed Stacks", collapsed_stacks(profile["stats"]),
+                                       file_name=f"{profile['page']}-{stamp}.txt",
+                                       key=page_key("profiles", "stacks"))
+            if st.button("🗑️ Clear Profiles"):
+                profiles.clear()
+                st.rerun()
+
+        if st.button("🔙 Back to Dashboard"):
+            st.session_state.page = "dashboard"
+            st.rerun()
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # 2N. BACKUP & RESTORE PAGE
+    elif st.session_state.page == "backup":
+        st.markdown('<div class="main-container">', unsafe_allow_html=True)
+        st.markdown("<h1>💾 Backup & Restore</h1>", unsafe_allow_html=True)
+        st.caption(
+            "Download your data as a file, and bring it back after a delete or reset.")
+        st.divider()
+        username = st.session_state.get("username")
+
+        st.markdown("<h3>Download a Backup</h3>", unsafe_allow_html=True)
+        owned = [t["_id"] for t in visible_timetables(username) if t.get("owner") == username]
+        choice = st.selectbox(
+            "What to back up:", [None] + owned, key=page_key("backup", "choice"),
+            format_func=lambda name: "All my attendance and timetables" if name is None
+            else f"Timetable '{name}' (every user's attendance)")
+        scope = {"username": username} if choice is None else {"list_name": choice}
+        backup_download_button(scope, "⬇️ Download Backup", key=page_key("backup", "download"))
+
+        st.divider()
+        st.markdown("<h3>Restore a Backup</h3>", unsafe_allow_html=True)
+        st.caption(
+            "Only records that are missing now come back, so attendance marked since the backup is kept.")
+        uploaded = st.file_uploader("Backup file (.bson.gz)", type=["gz"],
+                                    key=page_key("backup", "file"))
+        overwrite = st.checkbox("Replace records that exist now with the backed-up copy",
+                                key=page_key("backup", "overwrite"))
+        if st.button("♻️ Restore", type="primary", disabled=uploaded is None or database_degraded()):
+            outcome = []
+            try:
+                restored = guarded_write(lambda: outcome.append(
+                    restore_backup(db, uploaded, overwrite=overwrite, as_user=username)))
+            except BackupError as e:
+                st.error(f"This file can't be restored: {e}.")
+            else:
+                if restored:
+                    counts = outcome[0]["restored"]
+                    st.success(
+                        f"Restored {counts.get('attendance_records', 0)} day(s), "
+                        f"{counts.get('attendance_archive', 0)} archived semester(s) and "
+                        f"{counts.get('timetables', 0)} timetable(s). "
+                        f"{outcome[0]['unchanged']} item(s) were already there.")
+                    if outcome[0]["skipped"]:
+                        st.info(
+                            f"{outcome[0]['skipped']} item(s) of other students were not restored, "
+                            "because the timetable no longer exists. An administrator can restore them.")
+
+        if st.button("🔙 Back to Dashboard"):
+            st.session_state.page = "dashboard"
+            st.rerun()
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # 2O. DASHBOARD PAGE (Default)
     else:
         st.markdown('<div class="main-container">', unsafe_allow_html=True)
         username = st.session_state.get('username', 'User')
-        st.markdown(f"<h1>Welcome, {username}!</h1>", unsafe_allow_html=True)
+        st.markdown(f"<h1>Welcome, {html.escape(username)}!</h1>", unsafe_allow_html=True)
         st.markdown(
             f"<p style='text-align: center; color: #90EE90;'>Today is <strong>{datetime.now().strftime('%A, %d %B %Y')}</strong>.</p>", unsafe_allow_html=True)
 
@@ -1270,17 +2464,29 @@ else:
 
         st.divider()
 
+        # Saves still in the server's journal.
+        waiting_saves = journal.user_entries(username)
+        clashes = waiting_saves.pop(CONFLICT, 0)
+        if clashes:
+            st.warning(f"⚠️ {clashes} of your saved days clashed with a change made elsewhere. Open the date on Mark Attendance to choose which version to keep.")
+        if sum(waiting_saves.values()):
+            st.info(f"⏳ {sum(waiting_saves.values())} saved day(s) are waiting to be written to the database.")
+
         # Dashboard buttons organized in a 3x2 grid for clarity
         st.markdown("<h4>Actions</h4>", unsafe_allow_html=True)
-        d_cols1 = st.columns(2)
+        d_cols1 = st.columns(3)
         if d_cols1[0].button("➕ Create List"):
             st.session_state.page = "new_timetable"
-            st.session_state.form_step = 1
-            st.session_state.subject_list = [""]
+            st.session_state[FORM_STEP_KEY] = 1
+            st.session_state[SUBJECT_LIST_KEY] = [""]
+            st.session_state[SUBJECT_IDS_KEY] = [(None, None)]
             st.rerun()
         if d_cols1[1].button("📥 Import Data"):
             st.session_state.page = "import_data"
             st.rerun()
+        if d_cols1[2].button("💾 Backup"):
+            st.session_state.page = "backup"
+            st.rerun()
         
         d_cols2 = st.columns(3)
         if d_cols2[0].button("🔮 Predict"):
@@ -1293,6 +2499,17 @@ else:
             st.session_state.page = "view_absent_report"
             st.rerun()
 
+        st.markdown("<h4>Check In to a Class</h4>", unsafe_allow_html=True)
+        if CHECKIN_CODE_KEY not in st.session_state:
+            # A shared link such as ?checkin=ABC123 fills the code in.
+            st.session_state[CHECKIN_CODE_KEY] = st.query_params.get("checkin", "")
+        ci_cols = st.columns([3, 1])
+        checkin_code = ci_cols[0].text_input(
+            "Check-in code", key=CHECKIN_CODE_KEY, max_chars=12,
+            placeholder="Code from your instructor", label_visibility="collapsed")
+        if ci_cols[1].button("🎟️ Check In", disabled=not checkin_code.strip()):
+            redeem_checkin(username, checkin_code)
+
         st.markdown("<h4>Account Settings</h4>", unsafe_allow_html=True)
         d_cols3 = st.columns(3)
         if d_cols3[0].button("🔑 Change Password"):
@@ -1304,16 +2521,37 @@ else:
         if d_cols3[2].button("🗑️ Reset Date"):
             st.session_state.page = "reset_attendance"
             st.rerun()
+        if username in ADMIN_USERS and st.button("🧠 Session Memory"):
+            st.session_state.page = "session_memory"
+            st.rerun()
+        if username in ADMIN_USERS and st.button("⏱️ Profiles"):
+            st.session_state.page = "profiles"
+            st.rerun()
 
         st.divider()
+        # The list loads while the overview is read.
+        timetables_read = start_read(("timetables", username), fetch_visible_timetables, username)
+        render_dashboard_overview(username)
         st.markdown("<h2>Available Attendance Lists</h2>",
                     unsafe_allow_html=True)
         st.caption(
             "You can see all public lists and any private lists you have created.")
 
-        query = {"$or": [{"is_public": True}, {"owner": username}]}
-        all_timetables = list(db.timetables.find(
-            query, {"_id": 1, "owner": 1, "is_public": 1}))
+        cleared = st.session_state.get(CLEARED_KEY)
+        if cleared:
+            reset_id, cleared_list, cleared_days = cleared
+            cols = st.columns([4, 1])
+            cols[0].success(
+                f"Your records for '{cleared_list}' have been cleared ({cleared_days} day(s)).")
+            if reset_id is not None and cols[1].button("↩️ Undo", key=page_key("dashboard", "undo_clear")):
+                outcome = []
+                if guarded_write(lambda: outcome.append(undo_reset(db, username, reset_id))):
+                    st.session_state[CLEARED_KEY] = None
+                    st.success(f"Restored {outcome[0]} day(s) of '{cleared_list}'.")
+                    time.sleep(2)
+                    st.rerun()
+
+        all_timetables = timetables_read()
         if not all_timetables:
             st.info("No attendance lists available. Be the first to create one!")
         else:
@@ -1322,54 +2560,56 @@ else:
                 owner = timetable.get("owner")
                 is_public = timetable.get("is_public", False)
 
-                if st.session_state.get("confirming_delete") == list_name:
+                if st.session_state.get(CONFIRM_DELETE_KEY) == list_name:
                     st.markdown(
                         '<div class="glass-list-item" style="border-color: #F44336;">', unsafe_allow_html=True)
                     st.warning(
                         f"⚠️ Are you sure you want to delete '{list_name}' for EVERYONE?")
                     st.caption(
-                        "This will permanently delete the timetable and all associated attendance records for ALL users. This action cannot be undone.")
+                        "This will permanently delete the timetable and all associated attendance records for ALL users. Download a backup first if you may want it back.")
+                    backup_download_button({"list_name": list_name}, "💾 Download Backup",
+                                           key=f"backup_delete_{list_name}")
                     c1, c2 = st.columns(2)
                     if c1.button("Yes, Delete for All", key=f"confirm_delete_{list_name}", type="primary"):
-                        db.timetables.delete_one({"_id": list_name})
-                        db.attendance_records.delete_many(
-                            {"list_name": list_name})
-                        st.session_state.confirming_delete = None
-                        st.success(
-                            f"'{list_name}' has been permanently deleted.")
-                        time.sleep(2)
-                        st.rerun()
+                        if guarded_write(delete_timetable, list_name):
+                            st.session_state[CONFIRM_DELETE_KEY] = None
+                            st.success(
+                                f"'{list_name}' has been permanently deleted.")
+                            time.sleep(2)
+                            st.rerun()
                     if c2.button("Cancel", key=f"cancel_delete_{list_name}"):
-                        st.session_state.confirming_delete = None
+                        st.session_state[CONFIRM_DELETE_KEY] = None
                         st.rerun()
                     st.markdown('</div>', unsafe_allow_html=True)
                     continue
 
-                if st.session_state.get("confirming_clear") == list_name:
+                if st.session_state.get(CONFIRM_CLEAR_KEY) == list_name:
                     st.markdown(
                         '<div class="glass-list-item" style="border-color: #FFC107;">', unsafe_allow_html=True)
                     st.warning(
                         f"⚠️ Are you sure you want to clear YOUR records for '{list_name}'?")
                     st.caption(
-                        "This will only delete your personal attendance data. The public timetable will remain.")
+                        f"This will only delete your personal attendance data, and it can be undone for {UNDO_DAYS} days. The public timetable will remain.")
+                    backup_download_button({"username": username, "list_name": list_name},
+                                           "💾 Download Backup", key=f"backup_clear_{list_name}")
                     c1, c2 = st.columns(2)
                     if c1.button("Yes, Clear My Records", key=f"confirm_clear_{list_name}"):
-                        db.attendance_records.delete_many(
-                            {"list_name": list_name, "username": username})
-                        st.session_state.confirming_clear = None
-                        st.success(
-                            f"Your records for '{list_name}' have been cleared.")
-                        time.sleep(2)
-                        st.rerun()
+                        # Archived days too; all of them go to the tombstones.
+                        outcome = []
+                        if guarded_write(lambda: outcome.append(reset_days(db, username, list_name))):
+                            st.session_state[CONFIRM_CLEAR_KEY] = None
+                            reset_id, days = outcome[0]
+                            st.session_state[CLEARED_KEY] = (reset_id, list_name, days)
+                            st.rerun()
                     if c2.button("Cancel", key=f"cancel_clear_{list_name}"):
-                        st.session_state.confirming_clear = None
+                        st.session_state[CONFIRM_CLEAR_KEY] = None
                         st.rerun()
                     st.markdown('</div>', unsafe_allow_html=True)
                     continue
 
                 st.markdown('<div class="glass-list-item">',
                             unsafe_allow_html=True)
-                st.markdown(f"<h3>{list_name}</h3>", unsafe_allow_html=True)
+                st.markdown(f"<h3>{html.escape(list_name)}</h3>", unsafe_allow_html=True)
                 visibility = "Public" if is_public else "Private (Yours)"
                 st.caption(f"Created by: {owner} | Status: {visibility}")
                 cols = st.columns([2, 2, 4])
@@ -1383,40 +2623,40 @@ else:
                     st.rerun()
                 with cols[2]:
                     if owner == username:
-                        c1, c2 = st.columns(2)
+                        c1, c2, c3 = st.columns(3)
                         if c1.button("✏️", key=f"edit_{list_name}", help="Edit Timetable"):
                             st.session_state.selected_list = list_name
                             st.session_state.page = "edit_timetable"
-                            st.session_state.form_step = 1
-                            timetable_doc = db.timetables.find_one(
-                                {"_id": list_name}) or {}
-                            schedule = timetable_doc.get("schedule", {})
-                            subjects = sorted(
-                                list({s['name'] for day_sched in schedule.values() for s in day_sched}))
-                            st.session_state.subject_list = subjects if subjects else [
-                                ""]
-                            for day in DAYS_OF_WEEK:
-                                day_schedule = schedule.get(day, [])
-                                subject_hours_map = {
-                                    subj['name']: subj['hours'] for subj in day_schedule}
-                                for subject_name in st.session_state.subject_list:
-                                    st.session_state[f"{day}_{subject_name}_hours"] = subject_hours_map.get(
-                                        subject_name, 0)
+                            prefill_timetable_form(
+                                load_timetable(list_name), DAYS_OF_WEEK)
                             st.rerun()
                         if c2.button("🗑️", key=f"delete_all_{list_name}", help="Delete for All Users"):
-                            st.session_state.confirming_delete = list_name
+                            st.session_state[CONFIRM_DELETE_KEY] = list_name
+                            st.rerun()
+                        if c3.button("🧑‍🏫", key=f"roster_{list_name}", help="Mark the Whole Class"):
+                            st.session_state.selected_list = list_name
+                            st.session_state.page = "roster"
                             st.rerun()
                     else:
                         if st.button("🧹 Clear My Records", key=f"clear_{list_name}"):
-                            st.session_state.confirming_clear = list_name
+                            st.session_state[CONFIRM_CLEAR_KEY] = list_name
                             st.rerun()
                 st.markdown('</div>', unsafe_allow_html=True)
 
         st.divider()
         if st.button("Logout"):
+            finish_rerun_profile()
+            end_persistent_session()
+            pending_cookie = st.session_state.get("pending_cookie")
             for key in list(st.session_state.keys()):
                 if key != 'authenticated':
                     del st.session_state[key]
             st.session_state['authenticated'] = False
+            if pending_cookie:
+                st.session_state["pending_cookie"] = pending_cookie
             st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
+
+# Reruns that end here, rather than through st.rerun() or st.stop(), store
+# their profile now.
+finish_rerun_profile()
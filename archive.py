@@ -0,0 +1,281 @@
+"""Cold storage for past semesters' day documents.
+
+archive_days() moves day documents out of ``attendance_records`` into
+``attendance_archive``: one document per (username, list_name) holding every
+archived day as a single zlib-compressed BSON blob, plus an uncompressed
+summary (per-subject totals and per-day totals). The hot collection and its
+indexes then only hold current data.
+
+Reads stay transparent. attendance_store merges the summary into the range
+totals used by the analysis and prediction pages without decompressing
+anything. Pages that show single days (the log, the absent report) read the
+archived days through archived_day()/archived_days(). Editing an archived
+date first moves that day back with unarchive_day() (unarchive_day_async()
+for api.py), and resets move a whole range back with unarchive_days(). No
+Streamlit imports.
+"""
+import zlib
+from datetime import datetime, timezone
+
+import bson
+from pymongo import ASCENDING, errors
+
+from models import record_hours, record_subject
+
+ARCHIVE_INDEX = "archive_username_list_unique"
+SUMMARY_FIELDS = {"_id": 0, "first_date": 1, "last_date": 1, "totals": 1, "daily": 1}
+COMPRESSION_LEVEL = 9
+
+
+def ensure_archive_indexes(db):
+    db.attendance_archive.create_index(
+        [("username", ASCENDING), ("list_name", ASCENDING)],
+        unique=True, name=ARCHIVE_INDEX)
+
+
+def _pack(days):
+    return bson.Binary(zlib.compress(bson.encode({"days": days}), COMPRESSION_LEVEL))
+
+
+def _unpack(blob):
+    return bson.decode(zlib.decompress(blob))["days"]
+
+
+def subject_hours(days):
+    """{subject key: [conducted, present]} summed over day documents; the
+    keys are subject ids, or names for records from before subject ids."""
+    totals = {}
+    for day in days:
+        for rec in day.get("records", []):
+            c, p = record_hours(rec)
+            subject = totals.setdefault(record_subject(rec), [0, 0])
+            subject[0] += c
+            subject[1] += p
+    return totals
+
+
+def _summary(days):
+    """The uncompressed part of an archive document, for ``days`` sorted by date."""
+    daily = []
+    for day in days:
+        hours = [record_hours(rec) for rec in day.get("records", [])]
+        daily.append({"_id": day["date"], "conducted": sum(c for c, _ in hours),
+                      "present": sum(p for _, p in hours)})
+    return {
+        "first_date": days[0]["date"],
+        "last_date": days[-1]["date"],
+        "day_count": len(days),
+        "totals": [{"subject": s, "conducted": c, "present": p} for s, (c, p)
+                   in sorted(subject_hours(days).items(), key=lambda item: str(item[0]))],
+        "daily": daily,
+    }
+
+
+def _archive_document(key, days_by_date):
+    """The archive document for ``days_by_date``, or None when it is empty."""
+    if not days_by_date:
+        return None
+    days = [days_by_date[d] for d in sorted(days_by_date)]
+    return {**key, **_summary(days), "data": _pack(days),
+            "archived_at": datetime.now(timezone.utc)}
+
+
+def _write_archive(db, username, list_name, days_by_date):
+    """Replaces one archive document, or deletes it when no days are left."""
+    key = {"username": username, "list_name": list_name}
+    doc = _archive_document(key, days_by_date)
+    if doc is None:
+        db.attendance_archive.delete_one(key)
+    else:
+        db.attendance_archive.replace_one(key, doc, upsert=True)
+
+
+def _days_by_date(doc):
+    return {day["date"]: day for day in _unpack(doc["data"])} if doc else {}
+
+
+def _load_days(db, username, list_name):
+    return _days_by_date(db.attendance_archive.find_one(
+        {"username": username, "list_name": list_name}, {"_id": 0, "data": 1}))
+
+
+# ---- ARCHIVING ----
+
+def archive_days(db, list_name=None, before=None, dry_run=False):
+    """Moves matching day documents into the archive.
+
+    ``list_name`` limits it to one timetable and ``before`` ("YYYY-MM-DD",
+    exclusive) to older dates; at least one is required. Each user's days
+    are merged into their archive document before they are deleted from
+    the hot collection, so an interrupted run loses nothing and the next
+    run finishes the move. Returns ``{"users": n, "days": n}``.
+    """
+    if not list_name and not before:
+        raise ValueError("archive_days needs a list_name, a before date, or both")
+    query = {}
+    if list_name:
+        query["list_name"] = list_name
+    if before:
+        query["date"] = {"$lt": before}
+    cursor = db.attendance_records.find(query).sort(
+        [("username", ASCENDING), ("list_name", ASCENDING), ("date", ASCENDING)])
+
+    moved = {"users": 0, "days": 0}
+    group_key, group = None, []
+    for doc in cursor:
+        key = (doc["username"], doc["list_name"])
+        if key != group_key and group:
+            _archive_group(db, group_key, group, dry_run, moved)
+            group = []
+        group_key = key
+        group.append(doc)
+    if group:
+        _archive_group(db, group_key, group, dry_run, moved)
+    return moved
+
+
+def _archive_group(db, key, docs, dry_run, moved):
+    moved["users"] += 1
+    moved["days"] += len(docs)
+    if dry_run:
+        return
+    username, list_name = key
+    days_by_date = _load_days(db, username, list_name)
+    for doc in docs:
+        days_by_date[doc["date"]] = {k: v for k, v in doc.items() if k != "_id"}
+    _write_archive(db, username, list_name, days_by_date)
+    db.attendance_records.delete_many({"username": username, "list_name": list_name,
+                                       "_id": {"$in": [doc["_id"] for doc in docs]}})
+
+
+def rewrite_archived_days(db, username, list_name, rewrite):
+    """Replaces each archived day of a user's ``list_name`` archive with
+    ``rewrite(day)`` and rebuilds the summary; for data migrations."""
+    days_by_date = _load_days(db, username, list_name)
+    if days_by_date:
+        _write_archive(db, username, list_name,
+                       {date: rewrite(day) for date, day in days_by_date.items()})
+
+
+def restore_days(db, list_name, username=None):
+    """Moves every archived day of ``list_name`` (one user's, if given) back
+    into the hot collection. Returns the number of days restored."""
+    query = {"list_name": list_name}
+    if username:
+        query["username"] = username
+    restored = 0
+    for doc in db.attendance_archive.find(query, {"username": 1, "list_name": 1, "data": 1}):
+        for day in _unpack(doc["data"]):
+            try:
+                db.attendance_records.insert_one(dict(day))
+                restored += 1
+            except errors.DuplicateKeyError:
+                pass  # Marked again after archiving; the hot copy is newer.
+        db.attendance_archive.delete_one({"username": doc["username"], "list_name": list_name})
+    return restored
+
+
+# ---- READ-THROUGH ----
+
+def archived_summary(db, username, list_name):
+    """``first_date``, ``last_date``, ``totals`` and ``daily`` of a user's
+    archive for ``list_name``, without the compressed days; None if none."""
+    return db.attendance_archive.find_one(
+        {"username": username, "list_name": list_name}, SUMMARY_FIELDS)
+
+
+def archive_query(username, list_name, start=None, end=None):
+    """Filter for a user's archive document, if it overlaps ``start``..``end``."""
+    query = {"username": username, "list_name": list_name}
+    if start:
+        query["last_date"] = {"$gte": start}
+    if end:
+        query["first_date"] = {"$lte": end}
+    return query
+
+
+def days_in_range(doc, start=None, end=None):
+    """The days of a fetched archive document (with ``data``) inside the range."""
+    if doc is None:
+        return []
+    return [day for day in _unpack(doc["data"])
+            if (not start or day["date"] >= start) and (not end or day["date"] <= end)]
+
+
+def archive_overlap(summary, start=None, end=None):
+    """``(daily, whole)`` for an archived_summary() and a date range.
+
+    ``daily`` is the summary's per-day rows inside the range and ``whole``
+    whether that is every archived day, in which case the stored totals
+    apply as they are. None if nothing archived falls in the range.
+    """
+    if summary is None or (start and summary["last_date"] < start) \
+            or (end and summary["first_date"] > end):
+        return None
+    daily = [row for row in summary["daily"]
+             if (not start or row["_id"] >= start) and (not end or row["_id"] <= end)]
+    return daily, len(daily) == len(summary["daily"])
+
+
+def archived_days(db, username, list_name, start=None, end=None):
+    """Archived day documents, oldest first; ``start``/``end`` inclusive."""
+    return days_in_range(db.attendance_archive.find_one(
+        archive_query(username, list_name, start, end), {"_id": 0, "data": 1}), start, end)
+
+
+def archived_day(db, username, list_name, date_str):
+    """One archived day document, or None. Dates outside the archive's
+    range are answered by the index without fetching the blob."""
+    days = archived_days(db, username, list_name, date_str, date_str)
+    return days[0] if days else None
+
+
+def unarchive_days(db, username, list_name, start=None, end=None):
+    """Moves the archived days from ``start`` to ``end`` (inclusive; all of
+    them by default) back into the hot collection, so they can be edited or
+    deleted. Returns the moved day documents, oldest first."""
+    doc = db.attendance_archive.find_one(archive_query(username, list_name, start, end),
+                                         {"_id": 0, "data": 1})
+    days = days_in_range(doc, start, end)
+    if not days:
+        return []
+    try:
+        db.attendance_records.insert_many([dict(day) for day in days], ordered=False)
+    except errors.BulkWriteError as e:
+        # Duplicates are days another session moved first.
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+    moved = {day["date"] for day in days}
+    _write_archive(db, username, list_name, {date: day for date, day in
+                                             _load_days(db, username, list_name).items()
+                                             if date not in moved})
+    return days
+
+
+def unarchive_day(db, username, list_name, date_str):
+    """Moves one archived day back into the hot collection so it can be
+    edited or deleted. Returns the day document, or None if not archived."""
+    days = unarchive_days(db, username, list_name, date_str, date_str)
+    return days[0] if days else None
+
+
+async def unarchive_day_async(db, username, list_name, date_str):
+    """unarchive_day() for an asyncio database handle."""
+    key = {"username": username, "list_name": list_name}
+    days = days_in_range(await db.attendance_archive.find_one(
+        archive_query(username, list_name, date_str, date_str), {"_id": 0, "data": 1}),
+        date_str, date_str)
+    if not days:
+        return None
+    try:
+        await db.attendance_records.insert_one(dict(days[0]))
+    except errors.DuplicateKeyError:  # Another session moved it first.
+        pass
+    days_by_date = _days_by_date(await db.attendance_archive.find_one(key, {"_id": 0, "data": 1}))
+    days_by_date.pop(date_str, None)
+    doc = _archive_document(key, days_by_date)
+    if doc is None:
+        await db.attendance_archive.delete_one(key)
+    else:
+        await db.attendance_archive.replace_one(key, doc, upsert=True)
+    return days[0]
@@ -0,0 +1,72 @@
+"""Moves past semesters' attendance into cold storage, or brings it back.
+
+Archiving rolls each user's matching day documents into one compressed
+document per (user, timetable) in ``attendance_archive`` and deletes them
+from ``attendance_records``, so the hot collection and its indexes only
+hold current data. The app still shows archived days: analysis and
+prediction use the stored totals and the log and absent report read the
+compressed days on demand. Nothing is lost; --restore moves them back.
+
+The at-risk report only scans the hot collection, so archive a timetable
+once its semester is over.
+
+Examples:
+    python archive_attendance.py --list "Semester 4"
+    python archive_attendance.py --before 2026-01-01 --dry-run
+    python archive_attendance.py --restore --list "Semester 4" --username alice
+"""
+import argparse
+import sys
+
+from pymongo import errors
+
+from archive import archive_days, ensure_archive_indexes, restore_days
+from attendance_store import touch_records
+from mongo_connection import create_client, load_secrets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--list", dest="list_name",
+                        help="Only this timetable.")
+    parser.add_argument("--before", metavar="YYYY-MM-DD",
+                        help="Only days before this date.")
+    parser.add_argument("--restore", action="store_true",
+                        help="Move the archived days of --list back instead.")
+    parser.add_argument("--username", help="With --restore, only this user.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Count what would be archived without changing anything.")
+    parser.add_argument("--mongo-uri",
+                        help="Defaults to mongo_uri from .streamlit/secrets.toml or $MONGO_URI.")
+    args = parser.parse_args(argv)
+
+    if args.restore and not args.list_name:
+        parser.error("--restore needs --list.")
+    if not args.restore and not (args.list_name or args.before):
+        parser.error("Pass --list, --before or both.")
+    secrets = load_secrets()
+    mongo_uri = args.mongo_uri or secrets.get("mongo_uri")
+    if not mongo_uri:
+        parser.error("No MongoDB URI: pass --mongo-uri or set mongo_uri in secrets.toml.")
+
+    db = create_client(secrets, mongo_uri).get_database()
+    try:
+        ensure_archive_indexes(db)
+        if args.restore:
+            restored = restore_days(db, args.list_name, args.username)
+            touch_records(db, args.username, args.list_name)
+            print(f"Restored {restored} days of '{args.list_name}'.")
+            return 0
+        moved = archive_days(db, args.list_name, args.before, dry_run=args.dry_run)
+        if not args.dry_run:
+            touch_records(db, list_name=args.list_name)
+        verb = "Would archive" if args.dry_run else "Archived"
+        print(f"{verb} {moved['days']} days for {moved['users']} (user, timetable) pairs.")
+    except errors.PyMongoError as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
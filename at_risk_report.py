@@ -0,0 +1,107 @@
+"""Finds every student below the attendance target in any subject.
+
+Runs the same totals logic as the "prediction" page for all (username,
+list_name) pairs at once, as a single server-side aggregation. The shortfall
+is the prediction page's formula generalized to any target (4C - 5P at 80%).
+
+Results go either to a CSV file, streamed row by row, or to the ``at_risk``
+collection, which the server replaces in one step with ``$out``. Memory use
+stays flat whatever the number of users: grouping happens in MongoDB (with
+disk spill allowed) and rows are never collected in Python. --max-seconds
+puts a hard limit on the server-side run time.
+
+Meant to run on a schedule, e.g. every morning at 06:00 from cron:
+    0 6 * * * cd /path/to/Attendance_manager && python at_risk_report.py --csv /var/reports/at_risk.csv
+
+Examples:
+    python at_risk_report.py --collection
+    python at_risk_report.py --csv at_risk.csv --target 75 --list "Semester 5"
+"""
+import argparse
+import csv
+import sys
+from datetime import datetime, timezone
+
+from pymongo import errors
+
+from attendance_store import at_risk_pipeline
+from mongo_connection import create_client, load_secrets
+
+CSV_FIELDS = ["username", "list_name", "subject", "conducted", "present",
+              "percentage", "classes_needed", "target"]
+
+
+def write_csv(db, pipeline, path, max_seconds):
+    """Streams the pipeline results into ``path``; returns the row count."""
+    pipeline = pipeline + [{"$sort": {"list_name": 1, "username": 1, "subject": 1}}]
+    cursor = db.attendance_records.aggregate(
+        pipeline, allowDiskUse=True, batchSize=1000,
+        maxTimeMS=int(max_seconds * 1000))
+    rows = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for row in cursor:
+            row["percentage"] = f"{row['percentage']:.2f}"
+            row["classes_needed"] = int(row["classes_needed"])
+            writer.writerow(row)
+            rows += 1
+    return rows
+
+
+def write_collection(db, pipeline, max_seconds):
+    """Replaces the at_risk collection server-side; returns its size."""
+    pipeline = pipeline + [
+        {"$set": {"generated_at": datetime.now(timezone.utc)}},
+        {"$out": "at_risk"},
+    ]
+    db.attendance_records.aggregate(
+        pipeline, allowDiskUse=True, maxTimeMS=int(max_seconds * 1000))
+    return db.at_risk.estimated_document_count()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--csv", metavar="PATH", help="Write the report to a CSV file.")
+    output.add_argument("--collection", action="store_true",
+                        help="Replace the at_risk collection with the report.")
+    parser.add_argument("--target", type=float, default=80.0,
+                        help="Target attendance percentage (default 80).")
+    parser.add_argument("--list", dest="list_name",
+                        help="Only scan this timetable.")
+    parser.add_argument("--mongo-uri",
+                        help="Defaults to mongo_uri from .streamlit/secrets.toml or $MONGO_URI.")
+    parser.add_argument("--max-seconds", type=float, default=600.0,
+                        help="Abort if the aggregation runs longer than this.")
+    args = parser.parse_args(argv)
+
+    if not 0 < args.target < 100:
+        parser.error("--target must be between 0 and 100.")
+    secrets = load_secrets()
+    mongo_uri = args.mongo_uri or secrets.get("mongo_uri")
+    if not mongo_uri:
+        parser.error("No MongoDB URI: pass --mongo-uri or set mongo_uri in secrets.toml.")
+
+    # The scan may legitimately run for minutes; let maxTimeMS end it, not the socket.
+    db = create_client(secrets, mongo_uri,
+                       socketTimeoutMS=int((args.max_seconds + 60) * 1000)).get_database()
+    pipeline = at_risk_pipeline(args.target, args.list_name)
+    try:
+        if args.csv:
+            rows = write_csv(db, pipeline, args.csv, args.max_seconds)
+            print(f"Wrote {rows} at-risk subject rows to {args.csv}.")
+        else:
+            rows = write_collection(db, pipeline, args.max_seconds)
+            print(f"at_risk collection now holds {rows} rows.")
+    except errors.ExecutionTimeout:
+        print(f"Aborted: the scan took longer than {args.max_seconds:.0f}s.", file=sys.stderr)
+        return 2
+    except errors.PyMongoError as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
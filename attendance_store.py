@@ -0,0 +1,849 @@
+"""Reads and writes of attendance day documents.
+
+One document in ``attendance_records`` holds one user's marks for one
+timetable on one date. This module has no Streamlit imports, so the app and
+the command-line tools can share it.
+"""
+import logging
+import math
+from datetime import date, datetime, timedelta, timezone
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne, errors
+
+from archive import (SUMMARY_FIELDS, archive_overlap, archive_query,
+                     archived_days, archived_summary, days_in_range,
+                     subject_hours)
+from models import (DAY_RECORD_FIELDS, RECORD_FIELDS, DaySchedule,
+                    SubjectDictionary, SubjectTotals)
+from subjects import (encode_records, replaced_keys, subject_dictionary,
+                      subject_dictionary_async, subject_ids, subject_ids_async)
+
+logger = logging.getLogger(__name__)
+
+DAY_KEY_INDEX = "username_list_date_unique"
+LIST_DATE_INDEX = "list_date_username"
+STAMP_INDEX = "username_list_unique"
+STAMPED_COLLECTIONS = ("attendance_records", "attendance_archive")
+
+
+class SaveConflict(Exception):
+    """The day document changed after the caller loaded it.
+
+    ``current`` is the document as it is now (date, version and records
+    only), or None if it was deleted.
+    """
+
+    def __init__(self, current):
+        super().__init__("attendance for this day was changed elsewhere")
+        self.current = current
+
+
+def ensure_indexes(db):
+    """Creates the unique (username, list_name, date) key on day documents.
+
+    If old duplicate day documents exist the index cannot be built; that is
+    logged and saves still work, just without the duplicate protection.
+    """
+    try:
+        db.attendance_records.create_index(
+            [("username", ASCENDING), ("list_name", ASCENDING),
+             ("date", ASCENDING)],
+            unique=True, name=DAY_KEY_INDEX)
+    except errors.OperationFailure as e:
+        logger.warning(
+            "Could not create the unique day index on attendance_records: %s", e)
+    # Per-timetable reads across all users (roster, delete for all).
+    db.attendance_records.create_index(
+        [("list_name", ASCENDING), ("date", ASCENDING), ("username", ASCENDING)],
+        name=LIST_DATE_INDEX)
+    db.attendance_stamps.create_index(
+        [("username", ASCENDING), ("list_name", ASCENDING)],
+        unique=True, name=STAMP_INDEX)
+
+
+# ---- CHANGE STAMPS ----
+# attendance_stamps keeps one small document per (username, list_name) with
+# the time of the last write to that user's days. Caches of derived data key
+# on it, so they are invalidated by any save or delete without a scan.
+
+def _stamp_update(username, list_name):
+    return ({"username": username, "list_name": list_name},
+            {"$set": {"modified_at": datetime.now(timezone.utc)}})
+
+
+def touch_records(db, username=None, list_name=None):
+    """Marks a user's records (optionally for one list) as modified now.
+
+    With only ``list_name`` every user's stamp for that list is bumped, for
+    deletes that affect the whole timetable.
+    """
+    if username is not None and list_name is not None:
+        db.attendance_stamps.update_one(*_stamp_update(username, list_name), upsert=True)
+        return
+    now = datetime.now(timezone.utc)
+    query = {}
+    if username is not None:
+        query["username"] = username
+    if list_name is not None:
+        query["list_name"] = list_name
+    db.attendance_stamps.update_many(query, {"$set": {"modified_at": now}})
+
+
+def backfill_stamps(db, batch_size=1000):
+    """Creates the missing change stamp of every (username, list_name) with
+    day documents or an archive, for data written before stamps existed.
+    One full scan of each collection; backfill_stamps.py runs it once per
+    database."""
+    now = datetime.now(timezone.utc)
+    for collection in STAMPED_COLLECTIONS:
+        ops = []
+        for group in db[collection].aggregate([
+                {"$group": {"_id": {"username": "$username", "list_name": "$list_name"}}},
+        ], allowDiskUse=True):
+            if group["_id"].get("username") is None or group["_id"].get("list_name") is None:
+                continue
+            ops.append(UpdateOne(group["_id"], {"$setOnInsert": {"modified_at": now}}, upsert=True))
+            if len(ops) >= batch_size:
+                _write_stamps(db, ops)
+                ops = []
+        if ops:
+            _write_stamps(db, ops)
+
+
+def _write_stamps(db, ops):
+    try:
+        db.attendance_stamps.bulk_write(ops, ordered=False)
+    except errors.BulkWriteError as e:
+        # A save created the same stamp at the same moment.
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+
+
+def records_stamp(db, username, list_name):
+    """Time of the last write to this user's days in ``list_name``, or None."""
+    doc = db.attendance_stamps.find_one(
+        {"username": username, "list_name": list_name},
+        {"_id": 0, "modified_at": 1})
+    return doc["modified_at"] if doc else None
+
+
+def day_key(username, list_name, date_str):
+    """The filter that identifies one day document."""
+    return {"username": username, "list_name": list_name, "date": date_str}
+
+
+def fetch_day_window(db, username, list_name, start, end):
+    """A user's day documents from ``start`` to ``end`` (inclusive), for
+    paging through dates without a query per date.
+
+    Returns ``({date: document}, archived)``, where ``archived`` is the set
+    of those dates served from the archive. One range query on the day key,
+    plus one archive lookup that its index answers when nothing archived
+    falls in the range.
+    """
+    docs = {doc["date"]: doc for doc in db.attendance_records.find(
+        {"username": username, "list_name": list_name, "date": {"$gte": start, "$lte": end}},
+        DAY_RECORD_FIELDS)}
+    archived = set()
+    for day in archived_days(db, username, list_name, start, end):
+        if day["date"] not in docs:
+            docs[day["date"]] = day
+            archived.add(day["date"])
+    return docs, archived
+
+
+def doc_version(doc):
+    """Version of a loaded day document, or None if there was no document.
+
+    Documents written before versioning have no field and count as 0.
+    """
+    if doc is None:
+        return None
+    return doc.get("version", 0)
+
+
+def merge_update(records, extra=None, replaced=None):
+    """Update pipeline that replaces only the subjects in ``records`` and bumps the version.
+
+    ``replaced`` lists the stored subject keys to drop (see
+    subjects.replaced_keys()); by default the records' ``subject`` names.
+    """
+    if replaced is None:
+        replaced = [rec["subject"] for rec in records]
+    kept = {"$filter": {
+        "input": {"$ifNull": ["$records", []]},
+        "as": "rec",
+        "cond": {"$not": [{"$in": [{"$ifNull": ["$$rec.subject_id", "$$rec.subject"]},
+                                   {"$literal": replaced}]}]},
+    }}
+    fields = dict(extra or {})
+    fields["records"] = {"$concatArrays": [kept, {"$literal": records}]}
+    fields["version"] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+    return [{"$set": fields}]
+
+
+def version_filter(expected_version):
+    """Matches a stored version; documents from before versioning count as 0."""
+    return {"$in": [0, None]} if expected_version == 0 else expected_version
+
+
+def _upsert(collection, key, update):
+    """find_one_and_update with upsert, retried once on a duplicate key.
+
+    Two first saves for the same day can both try to insert; the loser gets
+    DuplicateKeyError and its retry updates the document the winner created.
+    """
+    for attempt in range(2):
+        try:
+            return collection.find_one_and_update(
+                key, update, upsert=True, projection={"version": 1},
+                return_document=ReturnDocument.AFTER)
+        except errors.DuplicateKeyError:
+            if attempt:
+                raise
+
+
+async def _upsert_async(collection, key, update):
+    """_upsert() for an asyncio collection."""
+    for attempt in range(2):
+        try:
+            return await collection.find_one_and_update(
+                key, update, upsert=True, projection={"version": 1},
+                return_document=ReturnDocument.AFTER)
+        except errors.DuplicateKeyError:
+            if attempt:
+                raise
+
+
+def _day_write(key, dictionary, records, expected_version, force, merge, extra):
+    """The one write save_day() makes, shared with save_day_async().
+
+    ``("upsert", update)`` for a merge or a forced save; otherwise the
+    compare-and-set: ``("insert", document)`` when the day must not exist
+    yet (a duplicate key is the conflict) or ``("update", filter, update)``
+    (no match is the conflict). Both carry the new version.
+    """
+    fields = dict(extra or {})
+    replaced = replaced_keys(dictionary, records)
+    records = encode_records(dictionary, records)
+    if merge:
+        return "upsert", merge_update(records, fields, replaced)
+    fields["records"] = records
+    if force:
+        return "upsert", {"$set": fields, "$inc": {"version": 1}}
+    if expected_version is None:
+        return "insert", {**key, **fields, "version": 1}
+    fields["version"] = expected_version + 1
+    return "update", {**key, "version": version_filter(expected_version)}, {"$set": fields}
+
+
+def save_day(db, username, list_name, date_str, records,
+             expected_version=None, force=False, merge=False, extra=None):
+    """Saves one day's records and returns the new document version.
+
+    By default this is a compare-and-set: ``expected_version`` is what
+    doc_version() returned when the form was loaded (None meaning the day
+    had no document). If the stored version differs, SaveConflict is raised
+    and nothing is written.
+
+    ``force`` overwrites the whole day whatever its version (last write
+    wins). ``merge`` replaces only the subjects present in ``records`` and
+    keeps every other subject already stored for the day, so edits to
+    different subjects from two devices both survive. ``extra`` holds more
+    top-level fields to set, e.g. ``{"is_import": True}``.
+
+    ``records`` name their subjects; they are stored by the timetable's
+    subject ids, adding ids for subjects it does not know yet.
+    """
+    collection = db.attendance_records
+    key = day_key(username, list_name, date_str)
+    dictionary = subject_ids(db, list_name, [rec["subject"] for rec in records])
+    kind, *write = _day_write(key, dictionary, records, expected_version, force, merge, extra)
+    if kind == "upsert":
+        version = _upsert(collection, key, write[0])["version"]
+    elif kind == "insert":
+        try:
+            collection.insert_one(write[0])
+        except errors.DuplicateKeyError:
+            raise SaveConflict(collection.find_one(key, DAY_RECORD_FIELDS))
+        version = write[0]["version"]
+    else:
+        if collection.update_one(*write).matched_count == 0:
+            raise SaveConflict(collection.find_one(key, DAY_RECORD_FIELDS))
+        version = write[1]["$set"]["version"]
+    touch_records(db, username, list_name)
+    return version
+
+
+async def save_day_async(db, username, list_name, date_str, records,
+                         expected_version=None, force=False, merge=False, extra=None):
+    """save_day() for an asyncio database handle."""
+    collection = db.attendance_records
+    key = day_key(username, list_name, date_str)
+    dictionary = await subject_ids_async(db, list_name, [rec["subject"] for rec in records])
+    kind, *write = _day_write(key, dictionary, records, expected_version, force, merge, extra)
+    if kind == "upsert":
+        version = (await _upsert_async(collection, key, write[0]))["version"]
+    elif kind == "insert":
+        try:
+            await collection.insert_one(write[0])
+        except errors.DuplicateKeyError:
+            raise SaveConflict(await collection.find_one(key, DAY_RECORD_FIELDS))
+        version = write[0]["version"]
+    else:
+        if (await collection.update_one(*write)).matched_count == 0:
+            raise SaveConflict(await collection.find_one(key, DAY_RECORD_FIELDS))
+        version = write[1]["$set"]["version"]
+    await db.attendance_stamps.update_one(*_stamp_update(username, list_name), upsert=True)
+    return version
+
+
+# ---- ROSTER ----
+# A timetable owner marks one date for every student at once. Day documents
+# are sharded on (username, list_name) (see sharding.py), so whole-timetable
+# operations first look up the timetable's students in attendance_stamps and
+# then name them, instead of sending a list_name-only query to every shard.
+
+def roster_usernames(db, list_name):
+    """Sorted usernames of everyone who has saved attendance on ``list_name``.
+
+    Read from the change stamps, which every write path keeps, so the
+    sharded day documents are not scanned.
+    """
+    return sorted(db.attendance_stamps.distinct("username", {"list_name": list_name}))
+
+
+def roster_day(db, list_name, date_str, usernames):
+    """The day documents of ``usernames`` for one date, as {username: document}."""
+    cursor = db.attendance_records.find(
+        {"username": {"$in": list(usernames)}, "list_name": list_name, "date": date_str},
+        {"_id": 0, "username": 1, **DAY_RECORD_FIELDS})
+    return {doc["username"]: doc for doc in cursor}
+
+
+def delete_timetable_records(db, list_name, batch_size=500):
+    """Deletes every student's days and archive for ``list_name``, in
+    batches of ``batch_size`` students, then its stamps and the tombstones
+    of its resets. Returns the number of day documents deleted."""
+    usernames = roster_usernames(db, list_name)
+    deleted = 0
+    for i in range(0, len(usernames), batch_size):
+        query = {"username": {"$in": usernames[i:i + batch_size]}, "list_name": list_name}
+        deleted += db.attendance_records.delete_many(query).deleted_count
+        db.attendance_archive.delete_many(query)
+    db.attendance_stamps.delete_many({"list_name": list_name})
+    db.attendance_tombstones.delete_many({"list_name": list_name})
+    return deleted
+
+
+def move_user_records(db, old_username, new_username, session=None, batch_size=500):
+    """Moves a user's days and archives to ``new_username``.
+
+    ``username`` is part of the shard key, and a multi-document update can't
+    change a shard key, so each batch is deleted under the old name and
+    inserted under the new one. Pass a transaction's ``session`` so a failure
+    leaves everything under the old name.
+    """
+    for collection in (db.attendance_records, db.attendance_archive):
+        while True:
+            docs = list(collection.find({"username": old_username}, session=session,
+                                        limit=batch_size))
+            if not docs:
+                break
+            collection.delete_many({"username": old_username,
+                                    "_id": {"$in": [doc["_id"] for doc in docs]}},
+                                   session=session)
+            collection.insert_many([{**doc, "username": new_username} for doc in docs],
+                                   session=session)
+
+
+def save_roster(db, list_name, date_str, marks, marked_by):
+    """Writes one date for many students in a single unordered bulk write.
+
+    ``marks`` maps username to that student's records for the day. Each day
+    document is replaced wholesale (last write wins, like an import) and
+    gets ``marked_by``. Unordered, so the server applies the writes in
+    parallel batches and one failing document does not stop the rest.
+    Returns the number of day documents written.
+    """
+    if not marks:
+        return 0
+    now = datetime.now(timezone.utc)
+    dictionary = subject_ids(db, list_name, sorted(
+        {rec["subject"] for records in marks.values() for rec in records}))
+    day_ops = [UpdateOne(day_key(username, list_name, date_str),
+                         {"$set": {"records": encode_records(dictionary, records),
+                                   "marked_by": marked_by},
+                          "$inc": {"version": 1}}, upsert=True)
+               for username, records in marks.items()]
+    stamp_ops = [UpdateOne({"username": username, "list_name": list_name},
+                           {"$set": {"modified_at": now}}, upsert=True)
+                 for username in marks]
+    try:
+        result = db.attendance_records.bulk_write(day_ops, ordered=False)
+        written = result.upserted_count + result.matched_count
+    except errors.BulkWriteError as e:
+        # Two upserts racing on one new day: retry the losers once, as _upsert does.
+        retry = [day_ops[err["index"]] for err in e.details["writeErrors"]
+                 if err["code"] == 11000]
+        if len(retry) < len(e.details["writeErrors"]):
+            raise
+        db.attendance_records.bulk_write(retry, ordered=False)
+        written = len(day_ops)
+    db.attendance_stamps.bulk_write(stamp_ops, ordered=False)
+    return written
+
+
+# ---- BACKFILL ----
+
+def backfill_days(db, username, list_name, timetable, start, end):
+    """Marks every class scheduled from ``start`` to ``end`` ("YYYY-MM-DD",
+    inclusive) as attended, each date by the schedule version in force on
+    it (see models.Timetable.day_on). Holidays of the timetable's calendar
+    and dates the user already has, hot or archived, are left alone.
+    Returns the number of days written.
+    """
+    key = {"username": username, "list_name": list_name}
+    marked = set(db.attendance_records.distinct(
+        "date", {**key, "date": {"$gte": start, "$lte": end}}))
+    summary = archived_summary(db, username, list_name)
+    if summary is not None:
+        marked.update(row["_id"] for row in summary["daily"])
+    skipped = marked | set(timetable.calendar.holidays if timetable.calendar else ())
+
+    days = {}
+    day, last = date.fromisoformat(start), date.fromisoformat(end)
+    while day <= last:
+        date_str = day.isoformat()
+        schedule = () if date_str in skipped else timetable.day_on(date_str)
+        if len(schedule):
+            days[date_str] = [{"subject": subject, "hours_conducted": hours,
+                               "hours_present": hours, "status": "Present"}
+                              for subject, hours in schedule]
+        day += timedelta(days=1)
+    if not days:
+        return 0
+
+    dictionary = subject_ids(db, list_name, sorted(
+        {rec["subject"] for records in days.values() for rec in records}))
+    written = len(days)
+    try:
+        db.attendance_records.insert_many(
+            [{**key, "date": date_str, "records": encode_records(dictionary, records),
+              "version": 1} for date_str, records in days.items()], ordered=False)
+    except errors.BulkWriteError as e:
+        # A date marked meanwhile keeps its marks.
+        if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+            raise
+        written -= len(e.details["writeErrors"])
+    touch_records(db, username, list_name)
+    return written
+
+
+# ---- RANGE ANALYTICS ----
+
+def _date_match(username, list_name, start=None, end=None):
+    """Day-document filter; ``start``/``end`` are inclusive "YYYY-MM-DD" strings.
+
+    Dates are stored as ISO strings, so string bounds sort correctly and the
+    match is answered as a range scan on the (username, list_name, date) index.
+    """
+    match = {"username": username, "list_name": list_name}
+    bounds = {}
+    if start:
+        bounds["$gte"] = start
+    if end:
+        bounds["$lte"] = end
+    if bounds:
+        match["date"] = bounds
+    return match
+
+
+# Server-side versions of models.record_hours() and models.record_subject(),
+# applied to an unwound "$records".
+_SUBJECT_EXPR = {"$ifNull": ["$records.subject_id", "$records.subject"]}
+_CONDUCTED_EXPR = {"$ifNull": ["$records.hours_conducted",
+                               {"$ifNull": ["$records.hours", 1]}]}
+_PRESENT_EXPR = {"$ifNull": ["$records.hours_present", {
+    "$cond": [{"$eq": ["$records.status", "Present"]}, _CONDUCTED_EXPR, 0]}]}
+
+
+def range_stats_pipeline(username, list_name, start=None, end=None):
+    """Aggregation returning per-subject totals and a weekly trend in one pass.
+
+    The single result document has ``subjects`` (conducted/present hours per
+    subject) and ``weekly`` (hours and attendance % per ISO week, oldest
+    first). Work is proportional to the days inside the range.
+    """
+    return [
+        {"$match": _date_match(username, list_name, start, end)},
+        {"$project": {"_id": 0, "date": 1, **RECORD_FIELDS}},
+        {"$unwind": "$records"},
+        {"$project": {"date": 1, "subject": _SUBJECT_EXPR,
+                      "conducted": _CONDUCTED_EXPR, "present": _PRESENT_EXPR}},
+        {"$facet": {
+            "subjects": [
+                {"$group": {"_id": "$subject",
+                            "conducted": {"$sum": "$conducted"},
+                            "present": {"$sum": "$present"}}},
+                {"$sort": {"_id": 1}},
+            ],
+            "weekly": [
+                {"$set": {"day": {"$dateFromString": {
+                    "dateString": "$date", "format": "%Y-%m-%d", "onError": None}}}},
+                {"$match": {"day": {"$ne": None}}},
+                {"$group": {"_id": {"year": {"$isoWeekYear": "$day"},
+                                    "week": {"$isoWeek": "$day"}},
+                            "week_start": {"$min": "$date"},
+                            "conducted": {"$sum": "$conducted"},
+                            "present": {"$sum": "$present"}}},
+                {"$set": {"percentage": {"$cond": [
+                    {"$gt": ["$conducted", 0]},
+                    {"$multiply": [{"$divide": ["$present", "$conducted"]}, 100]},
+                    0]}}},
+                {"$sort": {"_id.year": 1, "_id.week": 1}},
+            ],
+        }},
+    ]
+
+
+def fetch_range_stats(db, username, list_name, start=None, end=None):
+    """Runs range_stats_pipeline() and adds any archived days in the range
+    that are not also in the hot collection.
+
+    Returns ``(subject_stats, weekly)`` where ``subject_stats`` maps subject
+    name to a SubjectTotals and ``weekly`` is a list of
+    ``{"year", "week", "week_start", "conducted", "present", "percentage"}``.
+    """
+    result, archived, keys = run_reads(db, range_stats_reads(username, list_name, start, end))
+    return range_stats(result, archived, subject_dictionary(db, list_name, keys))
+
+
+async def fetch_range_stats_async(db, username, list_name, start=None, end=None):
+    """fetch_range_stats() for an asyncio database handle."""
+    result, archived, keys = await run_reads_async(
+        db, range_stats_reads(username, list_name, start, end))
+    return range_stats(result, archived, await subject_dictionary_async(db, list_name, keys))
+
+
+def range_stats_reads(username, list_name, start=None, end=None):
+    """The reads behind fetch_range_stats(), shared by the sync and asyncio
+    callers: yields ``(collection, method, *args)`` for run_reads() and
+    returns ``(result, archived, keys)`` for range_stats(), ``keys`` being
+    the subject keys to decode."""
+    rows = yield ("attendance_records", "aggregate",
+                  range_stats_pipeline(username, list_name, start, end))
+    result = rows[0] if rows else {"subjects": [], "weekly": []}
+    archived = yield from _archived_range_reads(username, list_name, start, end)
+    keys = [row["_id"] for row in result["subjects"]] + list(archived[0] if archived else ())
+    return result, archived, keys
+
+
+def run_reads(db, reads):
+    """Runs a reads generator such as range_stats_reads(); returns its result."""
+    try:
+        step = next(reads)
+        while True:
+            collection, method, *args = step
+            if method == "aggregate":
+                step = reads.send(list(db[collection].aggregate(*args)))
+            else:
+                step = reads.send(getattr(db[collection], method)(*args))
+    except StopIteration as done:
+        return done.value
+
+
+async def run_reads_async(db, reads):
+    """run_reads() for an asyncio database handle."""
+    try:
+        step = next(reads)
+        while True:
+            collection, method, *args = step
+            if method == "aggregate":
+                cursor = await db[collection].aggregate(*args)
+                step = reads.send(await cursor.to_list())
+            else:
+                step = reads.send(await getattr(db[collection], method)(*args))
+    except StopIteration as done:
+        return done.value
+
+
+def decode_totals(subjects, rows):
+    """``{subject name: [conducted, present]}`` from ``(key, conducted, present)``
+    rows, adding up a subject stored both by id and, before ids, by name."""
+    totals = {}
+    for key, conducted, present in rows:
+        hours = totals.setdefault(subjects.name(key), [0, 0])
+        hours[0] += conducted
+        hours[1] += present
+    return totals
+
+
+def range_stats(result, archived=None, subjects=None):
+    """Turns a range_stats_pipeline() result, plus ``archived`` ``(totals,
+    daily)`` if any, into fetch_range_stats()'s return value. ``subjects``
+    (the timetable's SubjectDictionary) decodes subject ids."""
+    subjects = subjects or SubjectDictionary()
+    rows = [(row["_id"], row["conducted"], row["present"]) for row in result["subjects"]]
+    if archived:
+        rows += [(key, c, p) for key, (c, p) in archived[0].items()]
+    subject_stats = {subject: SubjectTotals(subject, c, p)
+                     for subject, (c, p) in decode_totals(subjects, rows).items()}
+    weeks = {(row["_id"]["year"], row["_id"]["week"]): {
+        "year": row["_id"]["year"], "week": row["_id"]["week"],
+        "week_start": row["week_start"], "conducted": row["conducted"],
+        "present": row["present"]} for row in result["weekly"]}
+
+    if archived:
+        for row in archived[1]:
+            try:
+                year, week, _ = datetime.strptime(row["_id"], "%Y-%m-%d").isocalendar()
+            except ValueError:
+                continue
+            bucket = weeks.setdefault((year, week), {
+                "year": year, "week": week, "week_start": row["_id"],
+                "conducted": 0, "present": 0})
+            bucket["week_start"] = min(bucket["week_start"], row["_id"])
+            bucket["conducted"] += row["conducted"]
+            bucket["present"] += row["present"]
+    subject_stats = dict(sorted(subject_stats.items(), key=lambda item: str(item[0])))
+
+    weekly = [{**bucket, "percentage": bucket["present"] / bucket["conducted"] * 100
+               if bucket["conducted"] > 0 else 0}
+              for _, bucket in sorted(weeks.items())]
+    return subject_stats, weekly
+
+
+def archived_totals(summary, overlap, days=None, hot_dates=()):
+    """``(totals, daily)`` for range_stats() from archive_overlap()'s result.
+
+    ``days`` (the archived days in the range) is only needed when the range
+    does not cover the whole archive, or when ``hot_dates`` is not empty:
+    those dates were re-marked after archiving, the hot copy wins, and the
+    archived copy is left out as in daily_totals().
+    """
+    daily, whole = overlap
+    if hot_dates:
+        daily = [row for row in daily if row["_id"] not in hot_dates]
+        days = [day for day in days if day["date"] not in hot_dates]
+    elif whole:
+        return ({row["subject"]: (row["conducted"], row["present"])
+                 for row in summary["totals"]}, daily)
+    return {subject: tuple(hours) for subject, hours in subject_hours(days).items()}, daily
+
+
+def hot_copies_query(username, list_name, overlap):
+    """Filter for hot day documents on the dates archive_overlap() found
+    archived, for the ``hot_dates`` of archived_totals()."""
+    return {"username": username, "list_name": list_name,
+            "date": {"$in": [row["_id"] for row in overlap[0]]}}
+
+
+def _archived_range(db, username, list_name, start, end):
+    """``(totals, daily)`` of the archived days between ``start`` and ``end``,
+    or None if none are archived.
+
+    ``totals`` maps subject key to (conducted, present). When the range covers
+    the whole archive both come from its summary; only a range that cuts
+    through it, or a day also in the hot collection, needs the compressed days.
+    """
+    return run_reads(db, _archived_range_reads(username, list_name, start, end))
+
+
+def _archived_range_reads(username, list_name, start, end):
+    """_archived_range() as a reads generator, for range_stats_reads()."""
+    summary = yield ("attendance_archive", "find_one",
+                     {"username": username, "list_name": list_name}, SUMMARY_FIELDS)
+    overlap = archive_overlap(summary, start, end)
+    if overlap is None:
+        return None
+    hot_dates = set((yield ("attendance_records", "distinct", "date",
+                            hot_copies_query(username, list_name, overlap))))
+    days = None
+    if not overlap[1] or hot_dates:
+        days = days_in_range((yield ("attendance_archive", "find_one",
+                                     archive_query(username, list_name, start, end),
+                                     {"_id": 0, "data": 1})), start, end)
+    return archived_totals(summary, overlap, days, hot_dates)
+
+
+def daily_totals(db, username, list_name, start=None, end=None):
+    """Per-day conducted/present hours, oldest first, archived days included.
+
+    The server sums each day's records, so one small row per day comes back:
+    ``{"_id": "YYYY-MM-DD", "conducted": int, "present": int}``. Days with
+    no records are left out.
+    """
+    pipeline = [
+        {"$match": _date_match(username, list_name, start, end)},
+        {"$project": {"_id": 0, "date": 1, **RECORD_FIELDS}},
+        {"$unwind": "$records"},
+        {"$group": {"_id": "$date",
+                    "conducted": {"$sum": _CONDUCTED_EXPR},
+                    "present": {"$sum": _PRESENT_EXPR}}},
+        {"$sort": {"_id": 1}},
+    ]
+    rows = list(db.attendance_records.aggregate(pipeline))
+    archived = _archived_range(db, username, list_name, start, end)
+    if archived:
+        # A date in both places was re-marked after archiving; the hot one wins.
+        hot_dates = {row["_id"] for row in rows}
+        rows = sorted(rows + [row for row in archived[1] if row["_id"] not in hot_dates],
+                      key=lambda row: row["_id"])
+    return rows
+
+
+# ---- DASHBOARD OVERVIEW ----
+
+def user_records_stamp(db, username):
+    """Time of the user's last write to any timetable, or None."""
+    doc = db.attendance_stamps.find_one(
+        {"username": username}, {"_id": 0, "modified_at": 1},
+        sort=[("modified_at", -1)])
+    return doc["modified_at"] if doc else None
+
+
+def overview_pipeline(username, weekday):
+    """One aggregation for the dashboard overview across all of a user's lists.
+
+    Groups the user's records per (list, subject), then a ``$facet`` returns
+    those ``subjects`` rows next to ``lists``, where a ``$lookup`` on
+    ``timetables`` attaches the schedule entries for ``weekday`` and the
+    subject dictionary that decodes both.
+    """
+    return [
+        {"$match": {"username": username}},
+        {"$project": {"_id": 0, "list_name": 1, **RECORD_FIELDS}},
+        {"$unwind": "$records"},
+        {"$group": {"_id": {"list_name": "$list_name", "subject": _SUBJECT_EXPR},
+                    "conducted": {"$sum": _CONDUCTED_EXPR},
+                    "present": {"$sum": _PRESENT_EXPR}}},
+        {"$facet": {
+            "subjects": [
+                {"$project": {"_id": 0, "list_name": "$_id.list_name",
+                              "subject": "$_id.subject", "conducted": 1, "present": 1}},
+            ],
+            "lists": [
+                {"$group": {"_id": "$_id.list_name"}},
+                {"$lookup": {"from": "timetables", "localField": "_id",
+                             "foreignField": "_id", "as": "timetable"}},
+                {"$project": {"today": {"$ifNull": [
+                    {"$arrayElemAt": [f"$timetable.schedule.{weekday}", 0]}, []]},
+                              "subjects": {"$ifNull": [
+                                  {"$arrayElemAt": ["$timetable.subjects", 0]}, []]}}},
+            ],
+        }},
+    ]
+
+
+def dashboard_overview(db, username, weekday, target_pct=80):
+    """Per-list overall attendance, subjects below target and ``weekday``'s classes.
+
+    Returns a list sorted by list name of ``{"list_name", "conducted",
+    "present", "percentage", "below_target": [(subject, pct)], "today":
+    [(subject, hours)]}``. Archived semesters are added from their stored
+    totals.
+    """
+    result = next(db.attendance_records.aggregate(overview_pipeline(username, weekday)),
+                  {"subjects": [], "lists": []})
+    rows = {}
+    for row in result["subjects"]:
+        rows.setdefault(row["list_name"], []).append(
+            (row["subject"], row["conducted"], row["present"]))
+    for doc in db.attendance_archive.find({"username": username},
+                                          {"_id": 0, "list_name": 1, "totals": 1}):
+        for row in doc.get("totals", []):
+            rows.setdefault(doc["list_name"], []).append(
+                (row["subject"], row["conducted"], row["present"]))
+    dictionaries = {row["_id"]: SubjectDictionary(row.get("subjects") or ())
+                    for row in result["lists"]}
+    today = {row["_id"]: DaySchedule.from_entries(weekday, row["today"], dictionaries[row["_id"]])
+             for row in result["lists"]}
+
+    overview = []
+    for list_name in sorted(rows, key=str):
+        # Lists with only archived days were not part of the lookup.
+        subjects = dictionaries[list_name] if list_name in dictionaries \
+            else subject_dictionary(db, list_name)
+        totals = [SubjectTotals(subject, c, p) for subject, (c, p)
+                  in decode_totals(subjects, rows[list_name]).items()]
+        conducted = sum(t.conducted for t in totals)
+        present = sum(t.present for t in totals)
+        overview.append({
+            "list_name": list_name, "conducted": conducted, "present": present,
+            "percentage": present / conducted * 100 if conducted > 0 else 0,
+            "below_target": sorted(((t.subject, t.percentage) for t in totals
+                                    if t.conducted > 0 and t.percentage < target_pct),
+                                   key=lambda item: str(item[0])),
+            "today": [(subject, hours) for subject, hours
+                      in today.get(list_name, ()) if hours],
+        })
+    return overview
+
+
+# ---- TARGETS ----
+
+def classes_needed(conducted, present, target_pct=80):
+    """Consecutive hours to attend to reach ``target_pct`` percent.
+
+    Solves (P + x) / (C + x) = t for x, i.e. x = (tC - P) / (1 - t). Kept in
+    whole percents so the 80% case is exactly the familiar 4C - 5P.
+    """
+    if target_pct >= 100:
+        return 0 if present >= conducted else math.inf
+    return max(0, math.ceil((target_pct * conducted - 100 * present) / (100 - target_pct)))
+
+
+def at_risk_pipeline(target_pct=80, list_name=None):
+    """Per-(username, list_name, subject) totals below ``target_pct``, in one pass.
+
+    Each output row has the totals, the current percentage and
+    ``classes_needed`` computed with the same formula as classes_needed().
+    Archived semesters are added from the totals stored with them; a day
+    caught between the two collections while it is being moved counts in both.
+    """
+    match = {"list_name": list_name} if list_name else {}
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "username": 1, "list_name": 1, **RECORD_FIELDS}},
+        {"$unwind": "$records"},
+        {"$group": {"_id": {"username": "$username", "list_name": "$list_name",
+                            "subject": _SUBJECT_EXPR},
+                    "conducted": {"$sum": _CONDUCTED_EXPR},
+                    "present": {"$sum": _PRESENT_EXPR}}},
+        {"$unionWith": {"coll": "attendance_archive", "pipeline": [
+            {"$match": match},
+            {"$unwind": "$totals"},
+            {"$project": {"_id": {"username": "$username", "list_name": "$list_name",
+                                  "subject": "$totals.subject"},
+                          "conducted": "$totals.conducted", "present": "$totals.present"}},
+        ]}},
+        # Decode subject ids with the timetable's dictionary, then add up a
+        # subject stored by id and, in days from before ids, by name.
+        {"$lookup": {"from": "timetables", "localField": "_id.list_name",
+                     "foreignField": "_id", "as": "timetable"}},
+        {"$set": {"_id.subject": {"$ifNull": [{"$arrayElemAt": [{"$map": {
+            "input": {"$filter": {
+                "input": {"$ifNull": [{"$arrayElemAt": ["$timetable.subjects", 0]}, []]},
+                "as": "entry", "cond": {"$eq": ["$$entry.id", "$_id.subject"]}}},
+            "as": "entry", "in": "$$entry.name"}}, 0]}, "$_id.subject"]}}},
+        {"$group": {"_id": "$_id", "conducted": {"$sum": "$conducted"},
+                    "present": {"$sum": "$present"}}},
+        {"$match": {"conducted": {"$gt": 0}, "$expr": {"$lt": [
+            {"$multiply": ["$present", 100]},
+            {"$multiply": ["$conducted", target_pct]}]}}},
+        {"$project": {
+            "_id": 0,
+            "username": "$_id.username",
+            "list_name": "$_id.list_name",
+            "subject": "$_id.subject",
+            "conducted": 1,
+            "present": 1,
+            "percentage": {"$multiply": [{"$divide": ["$present", "$conducted"]}, 100]},
+            "classes_needed": {"$ceil": {"$divide": [
+                {"$subtract": [{"$multiply": ["$conducted", target_pct]},
+                               {"$multiply": ["$present", 100]}]},
+                100 - target_pct]}},
+            "target": {"$literal": target_pct},
+        }},
+    ]
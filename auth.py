@@ -0,0 +1,145 @@
+"""Password hashing and persistent login sessions.
+
+Sessions: after a login the browser keeps a signed cookie holding a random
+token and its expiry time. The ``sessions`` collection stores a hash of the
+token, the username and the expiry; a TTL index removes expired entries.
+A returning browser is logged in by checking the signature and expiry
+(no database work for forged or stale cookies) and then looking the token
+up, so bcrypt never runs for it. Deleting the session document logs that
+browser out everywhere.
+
+Passwords: bcrypt is deliberately slow. PasswordHasher runs it on a small,
+fixed-size thread pool so a burst of logins cannot take every CPU away from
+the page reruns of users who are already signed in.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from passlib.context import CryptContext
+from pymongo import ASCENDING
+
+SESSION_COOKIE = "attendance_session"
+DEFAULT_SESSION_DAYS = 30
+DEFAULT_BCRYPT_ROUNDS = 12
+DEFAULT_BCRYPT_WORKERS = 2
+
+
+class PasswordHasher:
+    """bcrypt hashing on a bounded worker pool.
+
+    ``rounds`` is the bcrypt cost for new hashes. Existing hashes with a
+    different cost still verify, and verify() returns an upgraded hash so the
+    caller can store it.
+    """
+
+    def __init__(self, rounds=DEFAULT_BCRYPT_ROUNDS, workers=DEFAULT_BCRYPT_WORKERS):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                                    bcrypt__rounds=rounds)
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix="bcrypt")
+
+    def hash(self, password):
+        return self.pool.submit(self.context.hash, password).result()
+
+    def verify(self, password, hashed):
+        """Returns (matches, new_hash); new_hash is None unless a rehash is due."""
+        return self.pool.submit(self.context.verify_and_update, password, hashed).result()
+
+    async def verify_async(self, password, hashed):
+        """verify() for asyncio callers: waits on the same pool without blocking the loop."""
+        return await asyncio.wrap_future(
+            self.pool.submit(self.context.verify_and_update, password, hashed))
+
+
+# ---- SESSIONS ----
+
+def ensure_session_indexes(db):
+    """TTL index so MongoDB deletes sessions once ``expires_at`` has passed."""
+    db.sessions.create_index("expires_at", expireAfterSeconds=0,
+                             name="sessions_ttl")
+    db.sessions.create_index([("username", ASCENDING)], name="sessions_username")
+
+
+def _sign(secret, payload):
+    digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def _token_id(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def new_session(secret, username, days=DEFAULT_SESSION_DAYS):
+    """Returns (session document, cookie value) for a new session; stores nothing."""
+    token = secrets.token_urlsafe(32)
+    expires = int(time.time()) + int(days * 86400)
+    doc = {
+        "_id": _token_id(token),
+        "username": username,
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.fromtimestamp(expires, timezone.utc),
+    }
+    payload = f"{token}.{expires}"
+    return doc, f"{payload}.{_sign(secret, payload)}"
+
+
+def create_session(db, secret, username, days=DEFAULT_SESSION_DAYS):
+    """Stores a new session and returns the cookie value for it."""
+    doc, cookie_value = new_session(secret, username, days)
+    db.sessions.insert_one(doc)
+    return cookie_value
+
+
+def _parse_cookie(secret, cookie_value):
+    """Returns the token of a well-signed, unexpired cookie, else None."""
+    if not cookie_value or cookie_value.count(".") != 2:
+        return None
+    token, expires, signature = cookie_value.split(".")
+    if not hmac.compare_digest(signature, _sign(secret, f"{token}.{expires}")):
+        return None
+    if not expires.isdigit() or int(expires) < time.time():
+        return None
+    return token
+
+
+def session_query(secret, cookie_value):
+    """The ``sessions`` filter for a well-signed, unexpired cookie, else None."""
+    token = _parse_cookie(secret, cookie_value)
+    if token is None:
+        return None
+    return {"_id": _token_id(token),
+            "expires_at": {"$gt": datetime.now(timezone.utc)}}
+
+
+def resolve_session(db, secret, cookie_value):
+    """Returns the username a session cookie belongs to, or None."""
+    query = session_query(secret, cookie_value)
+    if query is None:
+        return None
+    doc = db.sessions.find_one(query, {"username": 1})
+    return doc["username"] if doc else None
+
+
+def revoke_session(db, cookie_value):
+    """Deletes the session behind a cookie (logout)."""
+    if cookie_value and cookie_value.count(".") == 2:
+        db.sessions.delete_one({"_id": _token_id(cookie_value.split(".")[0])})
+
+
+def revoke_user_sessions(db, username, keep_cookie=None):
+    """Deletes all of a user's sessions, except ``keep_cookie``'s if given."""
+    query = {"username": username}
+    if keep_cookie and keep_cookie.count(".") == 2:
+        query["_id"] = {"$ne": _token_id(keep_cookie.split(".")[0])}
+    db.sessions.delete_many(query)
+
+
+def session_max_age(days=DEFAULT_SESSION_DAYS):
+    """Cookie max-age in seconds for a session lasting ``days``."""
+    return int(timedelta(days=days).total_seconds())
@@ -0,0 +1,52 @@
+"""Creates the change stamps missing for data saved before stamps existed.
+
+The roster, "delete for everyone" and timetable backups find a timetable's
+students from ``attendance_stamps``, so a student whose days were all saved
+before stamps existed is invisible to them until this has run. Run it once
+per database (it is safe to repeat and to run while the app is up). It reads
+the whole of attendance_records and attendance_archive, which is why the app
+does not run it on startup.
+
+Examples:
+    python backfill_stamps.py --dry-run
+    python backfill_stamps.py
+"""
+import argparse
+import sys
+
+from pymongo import errors
+
+from attendance_store import STAMPED_COLLECTIONS, backfill_stamps
+from mongo_connection import create_client, load_secrets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only count the stamps that exist now.")
+    parser.add_argument("--mongo-uri",
+                        help="Defaults to mongo_uri from .streamlit/secrets.toml or $MONGO_URI.")
+    args = parser.parse_args(argv)
+
+    secrets = load_secrets()
+    mongo_uri = args.mongo_uri or secrets.get("mongo_uri")
+    if not mongo_uri:
+        parser.error("No MongoDB URI: pass --mongo-uri or set mongo_uri in secrets.toml.")
+
+    db = create_client(secrets, mongo_uri).get_database()
+    try:
+        before = db.attendance_stamps.estimated_document_count()
+        if args.dry_run:
+            print(f"{before} stamps; a backfill would scan {', '.join(STAMPED_COLLECTIONS)}.")
+            return 0
+        backfill_stamps(db)
+        created = db.attendance_stamps.estimated_document_count() - before
+        print(f"Created {created} missing stamps.")
+    except errors.PyMongoError as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
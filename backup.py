@@ -0,0 +1,278 @@
+"""Per-user and per-timetable backups as a gzip-compressed BSON stream.
+
+A backup is one gzip stream of BSON documents: a header naming the scope,
+then one ``{"c": collection, "d": document}`` entry per stored document.
+export_backup() writes it straight from batched cursors and
+restore_backup() reads it back entry by entry and writes unordered
+``bulk_write`` batches, so memory use does not grow with the size of the
+timetable. No Streamlit imports, so the CLI (backup_attendance.py) and
+the app share it.
+
+A scope is ``{"username": ...}`` (the user's account, the timetables they
+own and all their attendance), ``{"list_name": ...}`` (one timetable and
+every user's attendance in it) or both (one user's attendance in one
+timetable, plus the timetable if they own it). Archived days are included
+as their compressed archive documents.
+"""
+import gzip
+from datetime import datetime, timezone
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReplaceOne, UpdateOne, errors
+
+from archive import archived_summary
+from attendance_store import day_key, roster_usernames
+from subjects import DICTIONARY_FIELDS, forget_dictionary
+
+BACKUP_FORMAT = "attendance-backup"
+BACKUP_VERSION = 1
+BATCH_SIZE = 1000
+
+# For each backed-up collection: scope key -> the document field it matches.
+# A collection without a field for the scope's key is not part of it.
+SCOPE_FIELDS = {
+    "users": {"username": "_id"},
+    "timetables": {"username": "owner", "list_name": "_id"},
+    "attendance_records": {"username": "username", "list_name": "list_name"},
+    "attendance_archive": {"username": "username", "list_name": "list_name"},
+}
+RAW_DOCUMENTS = CodecOptions(document_class=RawBSONDocument)
+
+
+class BackupError(Exception):
+    """The file is not a backup this version can restore."""
+
+
+def scope_query(scope, collection):
+    """Filter for ``collection``'s part of ``scope``, or None if it has none."""
+    fields = SCOPE_FIELDS[collection]
+    if any(key not in fields for key in scope):
+        return None
+    return {fields[key]: value for key, value in scope.items()}
+
+
+def in_scope(scope, collection, doc):
+    query = scope_query(scope, collection)
+    return query is not None and all(doc.get(field) == value for field, value in query.items())
+
+
+def backup_file_name(scope, now=None):
+    name = "-".join(scope[key] for key in ("username", "list_name") if key in scope)
+    stamp = (now or datetime.now(timezone.utc)).strftime("%Y%m%d-%H%M%S")
+    safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in name)
+    return f"attendance-{safe}-{stamp}.bson.gz"
+
+
+# ---- EXPORT ----
+
+def _export_queries(db, scope, collection, batch_size):
+    """The finds that read ``collection``'s part of ``scope``. A timetable's
+    day documents are read in batches of its students, so each find names
+    the shard key instead of being sent to every shard."""
+    query = scope_query(scope, collection)
+    if query is None:
+        return
+    if collection not in ("attendance_records", "attendance_archive") or "username" in query:
+        yield query
+        return
+    usernames = roster_usernames(db, scope["list_name"])
+    for i in range(0, len(usernames), batch_size):
+        yield {**query, "username": {"$in": usernames[i:i + batch_size]}}
+
+
+def export_backup(db, scope, fileobj, batch_size=BATCH_SIZE):
+    """Writes ``scope``'s documents to the binary file object ``fileobj``.
+
+    Documents are copied as raw BSON, one cursor batch at a time. Returns
+    ``{collection: documents written}``.
+    """
+    counts = {}
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as out:
+        out.write(bson.encode({"format": BACKUP_FORMAT, "version": BACKUP_VERSION,
+                               "scope": scope, "created_at": datetime.now(timezone.utc)}))
+        for collection in SCOPE_FIELDS:
+            if scope_query(scope, collection) is None:
+                continue
+            counts[collection] = 0
+            raw = db.get_collection(collection, codec_options=RAW_DOCUMENTS)
+            for query in _export_queries(db, scope, collection, batch_size):
+                for doc in raw.find(query, batch_size=batch_size):
+                    out.write(bson.encode({"c": collection, "d": doc}))
+                    counts[collection] += 1
+    return counts
+
+
+# ---- RESTORE ----
+
+def read_backup(fileobj):
+    """``(header, entries)`` of a backup; ``entries`` yields (collection, doc)
+    lazily. Raises BackupError if the file is not a backup."""
+    stream = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    documents = bson.decode_file_iter(stream)
+    try:
+        header = next(documents)
+    except (OSError, EOFError, StopIteration, bson.errors.BSONError) as e:
+        raise BackupError("not an attendance backup") from e
+    if header.get("format") != BACKUP_FORMAT:
+        raise BackupError("not an attendance backup")
+    if header.get("version") != BACKUP_VERSION:
+        raise BackupError(f"backup version {header.get('version')} is not supported")
+    return header, _entries(documents)
+
+
+def _entries(documents):
+    try:
+        for entry in documents:
+            yield entry["c"], entry["d"]
+    except (OSError, EOFError, KeyError, bson.errors.BSONError) as e:
+        raise BackupError("the backup file is damaged or incomplete") from e
+
+
+def _restore_op(collection, doc, overwrite):
+    """The write that restores one document. Without ``overwrite`` it only
+    inserts documents that are missing; the user's account is never
+    overwritten, so a restore can't roll back a password change, and a
+    timetable keeps its current subject dictionary."""
+    body = {k: v for k, v in doc.items() if k != "_id"}
+    if collection == "attendance_records":
+        key = day_key(doc["username"], doc["list_name"], doc["date"])
+    elif collection == "attendance_archive":
+        key = {"username": doc["username"], "list_name": doc["list_name"]}
+    elif collection == "timetables" and overwrite:
+        # A timetable that now belongs to someone else is not taken over:
+        # the upsert fails on the _id and the document is left as it is.
+        key = {"_id": doc["_id"], "owner": doc.get("owner")}
+        # The subject dictionary only ever grows, and days saved since the
+        # backup use its newer ids, so it is kept and only filled in when
+        # the timetable is missing; ids are never handed out twice.
+        update = {"$set": {k: v for k, v in body.items() if k not in DICTIONARY_FIELDS}}
+        if "subjects" in body:
+            update["$setOnInsert"] = {"subjects": body["subjects"]}
+        if "next_subject_id" in body:
+            update["$max"] = {"next_subject_id": body["next_subject_id"]}
+        return UpdateOne(key, update, upsert=True)
+    else:
+        key = {"_id": doc["_id"]}
+    if overwrite and collection != "users":
+        return ReplaceOne(key, body, upsert=True)
+    return UpdateOne(key, {"$setOnInsert": body}, upsert=True)
+
+
+def _write_batch(db, collection, ops):
+    """Writes one batch of restore ops; returns how many changed something."""
+    try:
+        details = db[collection].bulk_write(ops, ordered=False).bulk_api_result
+    except errors.BulkWriteError as e:
+        # A duplicate key is a timetable now owned by someone else, or a day
+        # another session created meanwhile; either way the newer one stays.
+        if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+            raise
+        details = e.details
+    return details["nUpserted"] + details["nModified"]
+
+
+def archived_dates(db, username, list_name):
+    """The dates in a user's archive for ``list_name``."""
+    summary = archived_summary(db, username, list_name)
+    return {row["_id"] for row in summary["daily"]} if summary else set()
+
+
+def check_restore_allowed(db, scope, username):
+    """Raises BackupError unless ``username`` may restore a backup of ``scope``:
+    their own account's, or a timetable they own or that no longer exists.
+
+    Returns True when only ``username``'s own documents may come back: for
+    a timetable that no longer exists nothing shows who owned it, and the
+    file itself could have been edited, so other students' attendance is
+    left to an administrator (backup_attendance.py).
+    """
+    if "username" in scope:
+        if scope["username"] != username:
+            raise BackupError("this backup belongs to another user")
+        return False
+    timetable = db.timetables.find_one({"_id": scope["list_name"]}, {"owner": 1})
+    if timetable is None:
+        return True
+    if timetable.get("owner") != username:
+        raise BackupError(f"'{scope['list_name']}' belongs to another user")
+    return False
+
+
+def restore_backup(db, fileobj, overwrite=False, as_user=None, batch_size=BATCH_SIZE):
+    """Restores a backup written by export_backup().
+
+    Without ``overwrite`` only missing documents come back, which undoes a
+    delete without touching anything marked since. A day that has been
+    archived since the backup stays in the archive rather than coming back
+    as a second, older copy. Entries outside the
+    backup's own scope are ignored. With ``as_user`` the restore runs on
+    that user's behalf: see check_restore_allowed(), and timetables owned
+    by anyone else are skipped, so an edited file can't take them over.
+    Returns ``{"scope": ..., "restored": {collection: n}, "unchanged": n,
+    "skipped": n}``, ``skipped`` counting other users' documents left out.
+    """
+    header, entries = read_backup(fileobj)
+    scope = header["scope"]
+    own_only = as_user is not None and check_restore_allowed(db, scope, as_user)
+    result = {"scope": scope, "restored": {}, "unchanged": 0, "skipped": 0}
+    pending = {}
+    touched = set()
+    timetables = set()
+    archived = {}
+
+    def flush(collection):
+        ops = pending.pop(collection, [])
+        if ops:
+            written = _write_batch(db, collection, ops)
+            result["restored"][collection] = result["restored"].get(collection, 0) + written
+            result["unchanged"] += len(ops) - written
+
+    for collection, doc in entries:
+        if collection not in SCOPE_FIELDS or not in_scope(scope, collection, doc):
+            continue
+        if collection == "timetables" and as_user is not None and doc.get("owner") != as_user:
+            continue
+        if collection == "timetables":
+            timetables.add(doc["_id"])
+        elif collection in ("attendance_records", "attendance_archive"):
+            if own_only and doc["username"] != as_user:
+                result["skipped"] += 1
+                continue
+            pair = (doc["username"], doc["list_name"])
+            touched.add(pair)
+            if collection == "attendance_records" and not overwrite:
+                if pair not in archived:
+                    archived[pair] = archived_dates(db, *pair)
+                if doc["date"] in archived[pair]:
+                    result["unchanged"] += 1
+                    continue
+        pending.setdefault(collection, []).append(_restore_op(collection, doc, overwrite))
+        if len(pending[collection]) >= batch_size:
+            flush(collection)
+    for collection in list(pending):
+        flush(collection)
+    if overwrite:
+        # The archive in place now is either the backup's or, if it had
+        # none, the current one; restored days it covers go back out.
+        for username, list_name in touched:
+            dates = archived_dates(db, username, list_name)
+            if dates:
+                dropped = db.attendance_records.delete_many(
+                    {"username": username, "list_name": list_name,
+                     "date": {"$in": sorted(dates)}}).deleted_count
+                dropped = min(dropped, result["restored"].get("attendance_records", 0))
+                if dropped:
+                    result["restored"]["attendance_records"] -= dropped
+                    result["unchanged"] += dropped
+    for list_name in timetables:
+        forget_dictionary(list_name)  # Its subject ids may differ from the cached ones.
+
+    now = datetime.now(timezone.utc)
+    stamp_ops = [UpdateOne({"username": username, "list_name": list_name},
+                           {"$set": {"modified_at": now}}, upsert=True)
+                 for username, list_name in touched]
+    for i in range(0, len(stamp_ops), batch_size):
+        db.attendance_stamps.bulk_write(stamp_ops[i:i + batch_size], ordered=False)
+    return result
@@ -0,0 +1,71 @@
+"""Backs up one user's or one timetable's data, or restores such a backup.
+
+A backup holds the user's account, the timetables they own and all their
+attendance (--username), or one timetable and every user's attendance in
+it (--list), as a gzip-compressed BSON file. Archived days are included.
+Both directions stream in batches, so even a very large timetable needs
+little memory.
+
+By default a restore only brings back what is missing, for example after
+"Delete for All", "Clear My Records" or a reset date; days marked since
+the backup are kept. --overwrite replaces them with the backed-up copy.
+
+Examples:
+    python backup_attendance.py --username alice --out alice.bson.gz
+    python backup_attendance.py --list "Semester 4"
+    python backup_attendance.py --restore attendance-Semester_4-20260101-060000.bson.gz
+"""
+import argparse
+import sys
+
+from pymongo import errors
+
+from backup import BackupError, backup_file_name, export_backup, restore_backup
+from mongo_connection import create_client, load_secrets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--username", help="Back up this user's data.")
+    parser.add_argument("--list", dest="list_name", help="Back up this timetable.")
+    parser.add_argument("--out", help="Backup file to write (default: a name with the date).")
+    parser.add_argument("--restore", metavar="FILE", help="Restore this backup file instead.")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="With --restore, replace records that exist now.")
+    parser.add_argument("--mongo-uri",
+                        help="Defaults to mongo_uri from .streamlit/secrets.toml or $MONGO_URI.")
+    args = parser.parse_args(argv)
+
+    if not args.restore and bool(args.username) == bool(args.list_name):
+        parser.error("Pass either --username or --list.")
+    secrets = load_secrets()
+    mongo_uri = args.mongo_uri or secrets.get("mongo_uri")
+    if not mongo_uri:
+        parser.error("No MongoDB URI: pass --mongo-uri or set mongo_uri in secrets.toml.")
+
+    db = create_client(secrets, mongo_uri).get_database()
+    try:
+        if args.restore:
+            with open(args.restore, "rb") as f:
+                result = restore_backup(db, f, overwrite=args.overwrite)
+            restored = ", ".join(f"{n} {collection}" for collection, n
+                                 in result["restored"].items()) or "nothing"
+            print(f"Restored {restored}; {result['unchanged']} documents were already there.")
+            return 0
+        scope = {"username": args.username} if args.username else {"list_name": args.list_name}
+        path = args.out or backup_file_name(scope)
+        with open(path, "wb") as f:
+            counts = export_backup(db, scope, f)
+        written = ", ".join(f"{n} {collection}" for collection, n in counts.items())
+        print(f"Wrote {path}: {written}.")
+    except BackupError as e:
+        print(f"Can't restore {args.restore}: {e}", file=sys.stderr)
+        return 1
+    except errors.PyMongoError as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""Short-lived check-in codes and a buffered writer for their redemptions.
+
+When a class starts, a timetable owner creates a code for one (timetable,
+date, subject). Students redeem it with one click instead of filling in the
+marking form, so a class-sized burst costs one small rerun per student.
+
+Redemptions are not written one by one. CheckinQueue buffers them in memory
+and a background thread flushes them to ``attendance_records`` in unordered
+``bulk_write`` batches, so hundreds of check-ins per second become a few
+round trips. Each write only adds the subject if the student's day does not
+already have it, so redeeming twice (or after marking by hand) changes
+nothing. A check-in for a day that has been archived first moves the day
+back, so the student does not end up with two copies. The buffer is bounded: past ``max_pending`` waiting check-ins,
+submit() raises CheckinQueueFull and the student is asked to try again.
+No Streamlit imports, so the load test can drive it directly.
+"""
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne, errors
+
+from archive import unarchive_day
+from attendance_store import day_key
+from mongo_connection import UNAVAILABLE_ERRORS
+from subjects import subject_ids
+
+logger = logging.getLogger(__name__)
+
+# No 0/O or 1/I/L, so a code read off a projector is not mistyped.
+CODE_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+CODE_LENGTH = 6
+DEFAULT_CODE_MINUTES = 10
+CODE_FIELDS = {"list_name": 1, "date": 1, "subject": 1, "subject_id": 1, "hours": 1,
+               "expires_at": 1}
+
+
+class CheckinQueueFull(Exception):
+    """Too many check-ins are waiting to be written; nothing was queued."""
+
+
+def ensure_checkin_indexes(db):
+    """TTL index so MongoDB deletes codes once ``expires_at`` has passed."""
+    db.checkin_codes.create_index("expires_at", expireAfterSeconds=0,
+                                  name="checkin_codes_ttl")
+
+
+def create_code(db, list_name, date_str, subject, hours, owner,
+                minutes=DEFAULT_CODE_MINUTES):
+    """Stores a new check-in code and returns it.
+
+    The code keeps the subject's name for display and its id, which is what
+    check-ins write into the day documents.
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=minutes)
+    dictionary = subject_ids(db, list_name, [subject])
+    subject_id = dictionary.id_for(subject) if dictionary is not None else None
+    while True:
+        code = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+        fields = {"_id": code, "list_name": list_name, "date": date_str,
+                  "subject": subject, "hours": int(hours), "owner": owner,
+                  "expires_at": expires_at}
+        if subject_id is not None:
+            fields["subject_id"] = subject_id
+        try:
+            db.checkin_codes.insert_one(fields)
+            return code
+        except errors.DuplicateKeyError:
+            continue
+
+
+def find_code(db, code):
+    """The stored code document for ``code`` (any case), or None.
+
+    Expiry is not checked here; the TTL monitor only runs once a minute,
+    so callers use code_expired().
+    """
+    return db.checkin_codes.find_one({"_id": code.strip().upper()}, CODE_FIELDS)
+
+
+def code_expired(code_doc, now=None):
+    expires_at = code_doc["expires_at"]
+    if expires_at.tzinfo is None:  # BSON dates come back naive unless tz_aware.
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return (now or datetime.now(timezone.utc)) >= expires_at
+
+
+def active_codes(db, list_name, date_str):
+    """Unexpired codes for one timetable and date, newest first."""
+    return list(db.checkin_codes.find(
+        {"list_name": list_name, "date": date_str,
+         "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        CODE_FIELDS).sort("expires_at", -1))
+
+
+def checkin_op(code_doc, username):
+    """The idempotent upsert that marks ``username`` present for a code.
+
+    The filter only matches a day that lacks the subject, whether stored by
+    id or, in a day saved before subject ids, by name. When the subject is
+    already there the upsert tries to insert a second day document and
+    the unique day index rejects it, which CheckinQueue counts as a
+    duplicate rather than an error.
+    """
+    hours = code_doc["hours"]
+    record = {"subject": code_doc["subject"], "hours_conducted": hours,
+              "hours_present": hours, "status": "Present"}
+    lacks = {"records.subject": {"$ne": code_doc["subject"]}}
+    if "subject_id" in code_doc:
+        record = {"subject_id": code_doc["subject_id"],
+                  **{k: v for k, v in record.items() if k != "subject"}}
+        lacks["records.subject_id"] = {"$ne": code_doc["subject_id"]}
+    key = day_key(username, code_doc["list_name"], code_doc["date"])
+    return UpdateOne({**key, **lacks},
+                     {"$push": {"records": record}, "$inc": {"version": 1}},
+                     upsert=True)
+
+
+class CheckinQueue:
+    """In-process buffer of check-ins, flushed by one background thread.
+
+    submit() only takes a lock and appends, so a page rerun never waits on
+    the database. The flusher wakes when ``max_batch`` check-ins are waiting
+    or ``flush_interval`` seconds after the first one arrived, whichever is
+    sooner. While the database is unreachable the batch is kept and retried.
+    A batch that fails for any other reason is retried ``max_attempts``
+    times; check-ins the database still rejects are logged and kept in
+    ``dead_letters``, and the students may redeem the code again.
+    """
+
+    def __init__(self, db, max_batch=500, flush_interval=0.25, retry_seconds=2.0,
+                 max_pending=20000, max_attempts=3):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.retry_seconds = retry_seconds
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.pending = []
+        # (code, username) pairs already accepted, per code expiry, so a
+        # double click is dropped before it reaches the queue.
+        self.accepted = {}
+        self.dead_letters = deque(maxlen=max_pending)
+        self.stats = {"submitted": 0, "written": 0, "duplicates": 0,
+                      "batches": 0, "failed_batches": 0, "rejected": 0,
+                      "dead_lettered": 0}
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.idle = threading.Condition(self.lock)
+        self.in_flight = 0
+        self.thread = threading.Thread(target=self._run, name="checkin-flusher",
+                                       daemon=True)
+        self.thread.start()
+
+    def submit(self, code_doc, username):
+        """Queues one check-in; False if this user already redeemed the code.
+        Raises CheckinQueueFull when ``max_pending`` check-ins are waiting."""
+        key = (code_doc["_id"], username)
+        with self.lock:
+            if key in self.accepted:
+                return False
+            if len(self.pending) + self.in_flight >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise CheckinQueueFull("too many check-ins are waiting to be written")
+            self.accepted[key] = code_doc["expires_at"]
+            self.pending.append((code_doc, username))
+            self.stats["submitted"] += 1
+            if len(self.pending) >= self.max_batch or len(self.pending) == 1:
+                self.wake.notify()
+        return True
+
+    def redeemed(self, code, username):
+        """True once ``username``'s check-in for ``code`` has been accepted."""
+        with self.lock:
+            return (code, username) in self.accepted
+
+    def wait_until_flushed(self, timeout=None):
+        """Blocks until everything submitted so far is written (or timeout)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while self.pending or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.wake.notify()
+                self.idle.wait(remaining)
+        return True
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "queued": len(self.pending) + self.in_flight}
+
+    def _run(self):
+        attempts = 0
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.wake.wait()
+                if len(self.pending) < self.max_batch:
+                    # Let the burst build up into one batch.
+                    self.wake.wait(self.flush_interval)
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+                self.in_flight = len(batch)
+            rejected = []
+            try:
+                written, duplicates, rejected = self._write(batch)
+            except Exception as e:
+                attempts += 1
+                unavailable = isinstance(e, UNAVAILABLE_ERRORS)
+                if unavailable or attempts < self.max_attempts:
+                    logger.warning("Check-in flush failed, retrying: %s", e)
+                    with self.lock:
+                        self.pending[:0] = batch
+                        self.in_flight = 0
+                        self.stats["failed_batches"] += 1
+                    time.sleep(self.retry_seconds)
+                    continue
+                logger.exception("Giving up on a batch of %d check-ins", len(batch))
+                written, duplicates, rejected = 0, 0, [(item, str(e)) for item in batch]
+            attempts = 0
+            with self.lock:
+                self.in_flight = 0
+                self.stats["written"] += written
+                self.stats["duplicates"] += duplicates
+                self.stats["batches"] += 1
+                if rejected:
+                    self._dead_letter(rejected)
+                self._forget_expired()
+                if not self.pending:
+                    self.idle.notify_all()
+
+    def _write(self, batch):
+        """One unordered bulk write for the batch; returns (written, duplicates,
+        rejected), ``rejected`` being ((code_doc, username), error) pairs the
+        database refused for a reason other than a duplicate key."""
+        self._unarchive(batch)
+        items = list(batch)
+        ops = [checkin_op(code_doc, username) for code_doc, username in items]
+        duplicates = 0
+        rejected = []
+        for attempt in range(2):
+            try:
+                self.db.attendance_records.bulk_write(ops, ordered=False)
+                break
+            except errors.BulkWriteError as e:
+                write_errors = e.details["writeErrors"]
+                rejected += [(items[err["index"]], err.get("errmsg", ""))
+                             for err in write_errors if err["code"] != 11000]
+                # A duplicate key is either the subject already being there,
+                # or two new-day upserts racing; one retry tells them apart.
+                retry = [err["index"] for err in write_errors if err["code"] == 11000]
+                if attempt:
+                    duplicates = len(retry)
+                ops = [ops[i] for i in retry]
+                items = [items[i] for i in retry]
+                if not ops:
+                    break
+        stamps = {(username, code_doc["list_name"]) for code_doc, username in batch}
+        now = datetime.now(timezone.utc)
+        self.db.attendance_stamps.bulk_write(
+            [UpdateOne({"username": username, "list_name": list_name},
+                       {"$set": {"modified_at": now}}, upsert=True)
+             for username, list_name in stamps], ordered=False)
+        return len(batch) - duplicates - len(rejected), duplicates, rejected
+
+    def _unarchive(self, batch):
+        """Moves back the archived days the batch is about to write to, with
+        one lookup per (timetable, date) in the batch."""
+        users = {}
+        for code_doc, username in batch:
+            users.setdefault((code_doc["list_name"], code_doc["date"]), set()).add(username)
+        for (list_name, date_str), usernames in users.items():
+            for doc in self.db.attendance_archive.find(
+                    {"username": {"$in": sorted(usernames)}, "list_name": list_name,
+                     "first_date": {"$lte": date_str}, "last_date": {"$gte": date_str}},
+                    {"_id": 0, "username": 1}):
+                unarchive_day(self.db, doc["username"], list_name, date_str)
+
+    def _dead_letter(self, rejected):
+        """Keeps check-ins the database refused and lets their students redeem
+        the code again. Called with the lock held."""
+        for (code_doc, username), error in rejected:
+            logger.error("Check-in of %s for code %s was not written: %s",
+                         username, code_doc["_id"], error)
+            self.dead_letters.append({"code": code_doc["_id"], "username": username,
+                                      "list_name": code_doc["list_name"],
+                                      "date": code_doc["date"], "error": error})
+            self.accepted.pop((code_doc["_id"], username), None)
+        self.stats["dead_lettered"] += len(rejected)
+
+    def _forget_expired(self):
+        now = datetime.now(timezone.utc)
+        for key in [key for key, expires_at in self.accepted.items()
+                    if code_expired({"expires_at": expires_at}, now)]:
+            del self.accepted[key]
@@ -0,0 +1,156 @@
+"""Check-in burst test: how many redemptions per second one process absorbs.
+
+Simulates a class starting: many students redeem the same check-in codes
+at once from many threads, all going through one CheckinQueue the way one
+``streamlit run app.py`` server does. Some students click twice, and a
+second queue (standing in for another server process) replays part of the
+burst, so idempotency is checked both in-process and in the database.
+
+Reports the rate at which check-ins were accepted and the rate at which
+they reached the database, then verifies every student has exactly one
+entry per code. Exits 1 if verification fails or the end-to-end rate is
+below --min-rate.
+
+Examples:
+    python checkin_load_test.py --mongomock
+    python checkin_load_test.py --mongo-uri mongodb://localhost:27017/attendance_load --students 5000
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from datetime import date
+
+from attendance_store import ensure_indexes
+from checkin import CheckinQueue, create_code, ensure_checkin_indexes, find_code
+from load_test import connect
+from models import record_subject
+from subjects import subject_dictionary
+
+LIST_NAME = "Check-in Load Test"
+SUBJECTS = ["Mathematics", "Physics", "Chemistry", "Data Structures"]
+
+
+def run_burst(queue, code_docs, students, threads, repeat_every):
+    """Submits every (student, code) pair from ``threads`` threads.
+
+    Every ``repeat_every``-th student submits each code twice. Returns the
+    seconds taken to submit.
+    """
+    def worker(index):
+        for n in range(index, len(students), threads):
+            for code_doc in code_docs:
+                queue.submit(code_doc, students[n])
+                if repeat_every and n % repeat_every == 0:
+                    queue.submit(code_doc, students[n])
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def verify(db, date_str, students):
+    """Problems found in the written day documents, as a list of strings."""
+    problems = []
+    docs = list(db.attendance_records.find(
+        {"list_name": LIST_NAME, "date": date_str},
+        {"_id": 0, "username": 1, "records.subject": 1, "records.subject_id": 1}))
+    dictionary = subject_dictionary(db, LIST_NAME)
+    if len(docs) != len(students):
+        problems.append(f"{len(docs)} day documents for {len(students)} students")
+    for doc in docs:
+        subjects = [dictionary.name(record_subject(rec)) for rec in doc.get("records", [])]
+        if sorted(subjects) != sorted(SUBJECTS):
+            problems.append(f"{doc['username']}: {subjects}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/attendance_load",
+                        help="Database to write to (default: %(default)s).")
+    parser.add_argument("--mongomock", action="store_true",
+                        help="Use an in-memory mongomock database instead of a server.")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32,
+                        help="Concurrent submitting threads (default 32).")
+    parser.add_argument("--max-batch", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=0.25)
+    parser.add_argument("--repeat-every", type=int, default=10,
+                        help="Every Nth student clicks twice (0 disables).")
+    parser.add_argument("--min-rate", type=float, default=200.0,
+                        help="Fail below this many written check-ins per second.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    db = connect(args)
+    ensure_indexes(db)
+    ensure_checkin_indexes(db)
+    date_str = date.today().isoformat()
+    db.attendance_records.delete_many({"list_name": LIST_NAME})
+    db.attendance_stamps.delete_many({"list_name": LIST_NAME})
+    # A fresh timetable, so the codes carry subject ids as real ones do.
+    db.timetables.replace_one({"_id": LIST_NAME},
+                              {"owner": "loadtest", "is_public": False, "schedule": {}},
+                              upsert=True)
+    code_docs = [find_code(db, create_code(db, LIST_NAME, date_str, subject, 1, "loadtest"))
+                 for subject in SUBJECTS]
+    students = [f"checkin_student_{n:05d}" for n in range(args.students)]
+
+    # Room for the whole burst: this measures throughput, not the cap.
+    expected = len(students) * len(code_docs)
+    queue = CheckinQueue(db, max_batch=args.max_batch, flush_interval=args.flush_interval,
+                         max_pending=expected)
+    started = time.perf_counter()
+    submit_secs = run_burst(queue, code_docs, students, args.threads, args.repeat_every)
+    queue.wait_until_flushed()
+    total_secs = time.perf_counter() - started
+    stats = queue.snapshot()
+
+    # Another process replaying a tenth of the burst must not add anything.
+    replay = CheckinQueue(db, max_batch=args.max_batch, flush_interval=args.flush_interval)
+    run_burst(replay, code_docs, students[::10], args.threads, 0)
+    replay.wait_until_flushed()
+    replay_stats = replay.snapshot()
+
+    problems = verify(db, date_str, students)
+    if replay_stats["written"]:
+        problems.append(f"replay wrote {replay_stats['written']} check-ins")
+    if stats["dead_lettered"]:
+        problems.append(f"{stats['dead_lettered']} check-ins were rejected by the database")
+    results = {
+        "check_ins": expected,
+        "accepted": stats["submitted"],
+        "submit_per_s": round(stats["submitted"] / submit_secs, 1),
+        "written_per_s": round(stats["written"] / total_secs, 1),
+        "batches": stats["batches"],
+        "failed_batches": stats["failed_batches"],
+        "replay_duplicates": replay_stats["duplicates"],
+        "problems": problems[:20],
+    }
+    print(f"{expected} check-ins from {len(students)} students on {args.threads} threads")
+    print(f"  accepted       {results['submit_per_s']:>10.1f} /s")
+    print(f"  written        {results['written_per_s']:>10.1f} /s in {stats['batches']} batches")
+    print(f"  replayed       {replay_stats['submitted']} check-ins, "
+          f"{replay_stats['duplicates']} rejected by the database")
+    for problem in problems[:20]:
+        print(f"  PROBLEM: {problem}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if problems or stats["written"] != expected:
+        return 1
+    if results["written_per_s"] < args.min_rate:
+        print(f"Below --min-rate {args.min_rate:.0f}/s.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
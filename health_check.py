@@ -0,0 +1,50 @@
+"""Readiness probe: can the app's MongoDB be reached, and how fast?
+
+Pings the database with the app's own connection settings and prints one
+JSON line with the ping latency and the current replica set primary. The
+exit code makes it usable as a container readiness/liveness command:
+0 ready, 1 unreachable, 2 reachable but slower than --max-latency-ms.
+
+Examples:
+    python health_check.py
+    python health_check.py --max-latency-ms 200 --timeout-ms 2000
+"""
+import argparse
+import json
+import sys
+
+from mongo_connection import create_client, load_secrets, ping
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri",
+                        help="Defaults to mongo_uri from .streamlit/secrets.toml or $MONGO_URI.")
+    parser.add_argument("--timeout-ms", type=int, default=3000,
+                        help="How long to look for a reachable server (default 3000).")
+    parser.add_argument("--max-latency-ms", type=float,
+                        help="Report not ready when the ping takes longer than this.")
+    args = parser.parse_args(argv)
+
+    secrets = load_secrets()
+    mongo_uri = args.mongo_uri or secrets.get("mongo_uri")
+    if not mongo_uri:
+        parser.error("No MongoDB URI: pass --mongo-uri or set mongo_uri in secrets.toml.")
+
+    client = create_client(secrets, mongo_uri,
+                           serverSelectionTimeoutMS=args.timeout_ms,
+                           connectTimeoutMS=args.timeout_ms)
+    try:
+        status = ping(client)
+    finally:
+        client.close()
+    status["ready"] = status["ok"] and (
+        args.max_latency_ms is None or status["latency_ms"] <= args.max_latency_ms)
+    print(json.dumps(status))
+    if not status["ok"]:
+        return 1
+    return 0 if status["ready"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,674 @@
+"""Concurrent-session load test for the Attendance Tracker.
+
+Drives many simulated student sessions through app.py with Streamlit's
+``AppTest`` harness. Each session logs in, opens the dashboard, marks
+attendance, and opens the analysis and prediction pages. All sessions share
+one process, the same way a single ``streamlit run app.py`` server does.
+
+The concurrency is ramped up level by level. For each level the script
+reports throughput, per-page latency percentiles, script reruns and process
+RSS, and it marks the saturation point: once a level stops adding throughput
+or p95 latency goes over budget, the level with the highest throughput.
+
+It also reports the bytes each page visit sends and receives, and
+``--wire-budget`` turns those numbers into a pass/fail check so a query that
+loses its projection is caught. With mongomock the bytes are counted at the
+collection methods instead of on the wire, so the two backends need their
+own budget files; wire_budget.json is the mongomock one the tests check.
+
+Examples:
+    python load_test.py --mongomock
+    python load_test.py --mongo-uri mongodb://localhost:27017/attendance_load --levels 1,4,16,32
+    python load_test.py --mongomock --users 5 --levels 1 --flows 1 --save-wire-budget wire_budget.json
+    python load_test.py --mongomock --users 5 --levels 1 --flows 1 --wire-budget wire_budget.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+import bson
+import pymongo
+import streamlit
+from pymongo import monitoring
+from passlib.context import CryptContext
+from session_footprint import state_footprint
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.secrets import Secrets
+from streamlit import config
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import app_test as app_test_module
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday",
+                "Thursday", "Friday", "Saturday"]
+PAGES = ["login", "dashboard", "mark_attendance",
+         "save_attendance", "analysis", "prediction"]
+SUBJECT_NAMES = ["Mathematics", "Physics", "Chemistry", "Data Structures",
+                 "Operating Systems", "Computer Networks", "Databases"]
+# Every seeded timetable shares one subject dictionary: ids 1.. in this order.
+SUBJECT_DICTIONARY = [{"id": i, "name": name} for i, name in enumerate(SUBJECT_NAMES, 1)]
+LOAD_TEST_PASSWORD = "loadtest"
+
+# Script runs per session (AppTest runs plus st.rerun() calls), keyed by
+# id() of the session's state object, which both threads can see.
+_run_counts = {}
+# BSON bytes of MongoDB commands and replies per session, keyed the same way.
+_wire_bytes = {}
+
+
+# ---- BENCHMARK DATASET ----
+
+def build_schedule(rng):
+    """Returns a weekday schedule using a random subset of SUBJECT_NAMES, by id."""
+    subjects = rng.sample(SUBJECT_NAMES, k=5)
+    schedule = {}
+    for day in DAYS_OF_WEEK:
+        todays = rng.sample(subjects, k=3)
+        schedule[day] = [{"id": SUBJECT_NAMES.index(s) + 1, "hours": rng.randint(1, 2)}
+                         for s in todays]
+    return schedule
+
+
+def seed_database(db, users=50, lists=5, days=120, seed=7):
+    """Drops and re-creates a deterministic benchmark dataset in ``db``.
+
+    Creates ``lists`` public timetables and ``users`` accounts (all with the
+    password LOAD_TEST_PASSWORD). Every user gets ``days`` days of history on
+    one timetable. Returns the list of (username, list_name) pairs.
+    """
+    rng = random.Random(seed)
+    for name in ("users", "timetables", "attendance_records", "attendance_stamps"):
+        db.drop_collection(name)
+
+    # One bcrypt hash for everybody keeps seeding fast.
+    hashed = CryptContext(schemes=["bcrypt"]).hash(LOAD_TEST_PASSWORD)
+    timetables = []
+    for i in range(lists):
+        list_name = f"Load Test Semester {i + 1}"
+        schedule = build_schedule(rng)
+        timetables.append((list_name, schedule))
+        db.timetables.insert_one({"_id": list_name, "schedule": schedule,
+                                  "subjects": SUBJECT_DICTIONARY,
+                                  "next_subject_id": len(SUBJECT_NAMES) + 1,
+                                  "owner": "loadtest_owner", "is_public": True})
+
+    pairs = []
+    today = date.today()
+    for u in range(users):
+        username = f"loadtest_user_{u:05d}"
+        list_name, schedule = timetables[u % lists]
+        db.users.insert_one({"_id": username, "password": hashed})
+        day_docs = []
+        for offset in range(1, days + 1):
+            day = today - timedelta(days=offset)
+            day_name = day.strftime("%A")
+            if day_name not in schedule:
+                continue
+            records = []
+            for subject in schedule[day_name]:
+                present = rng.choices(
+                    [subject["hours"], 0], weights=[85, 15])[0]
+                records.append({
+                    "subject_id": subject["id"],
+                    "hours_conducted": subject["hours"],
+                    "hours_present": present,
+                    "status": "Present" if present else "Absent",
+                })
+            day_docs.append({"list_name": list_name, "username": username,
+                             "date": day.strftime("%Y-%m-%d"), "records": records})
+        if day_docs:
+            db.attendance_records.insert_many(day_docs)
+            db.attendance_stamps.insert_one({"username": username, "list_name": list_name,
+                                             "modified_at": datetime.now(timezone.utc)})
+        pairs.append((username, list_name))
+    return pairs
+
+
+# ---- INSTRUMENTATION ----
+
+def install_hooks(mongo_uri, skip_ui_sleeps):
+    """Prepares the process for many AppTest sessions running at once.
+
+    AppTest swaps ``st.secrets``, the global ``Runtime`` and the
+    ``global.appTest`` config option in and out around every run, which is
+    fine for one test but races when sessions run in parallel threads. Here
+    they are set once for the whole process, and the first runtime AppTest
+    creates is kept, so caches are shared between sessions the way they are
+    on a real server.
+
+    A real server compiles app.py once into a shared script cache, while
+    every AppTest run compiles it again; parallel compiles can trip a
+    CPython parser bug, so compiled bytecode is shared here as well.
+
+    The hooks also count script runs per session, including the st.rerun()
+    calls the app makes, and the MongoDB bytes each session moves. app.py
+    sleeps after most saves so the success message stays visible; with
+    ``skip_ui_sleeps`` those sleeps are no-ops inside script runs, so the
+    test measures server work rather than idle time.
+    """
+    # AppTest runs scripts on helper threads that log a warning on every call.
+    # Streamlit resets its logger levels when config changes, so use a filter.
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: "missing ScriptRunContext" not in record.getMessage())
+
+    secrets = Secrets()
+    secrets._secrets = {"mongo_uri": mongo_uri,
+                        "cookie_secret": "load-test-cookie-secret",
+                        # A fresh journal, so saves left over from an earlier run aren't replayed.
+                        "save_journal_path": os.path.join(tempfile.mkdtemp(), "save_journal.sqlite3")}
+    streamlit.secrets = secrets
+
+    config.set_option("global.appTest", True)
+    app_test_module.patch_config_options = lambda options: contextlib.nullcontext()
+
+    shared = {}
+    original_instance = Runtime.instance.__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            shared.setdefault("runtime", cls._instance)
+        if "runtime" in shared:
+            return shared["runtime"]
+        return original_instance(cls)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(
+        lambda cls: cls._instance is not None or "runtime" in shared)
+
+    original_get_bytecode = ScriptCache.get_bytecode
+    bytecode = {}
+    compile_lock = threading.Lock()
+
+    def shared_get_bytecode(self, script_path):
+        with compile_lock:
+            if script_path not in bytecode:
+                bytecode[script_path] = original_get_bytecode(self, script_path)
+            return bytecode[script_path]
+
+    ScriptCache.get_bytecode = shared_get_bytecode
+
+    original_run = AppTest._run
+    original_rerun = streamlit.rerun
+    original_sleep = time.sleep
+
+    def counting_run(self, *args, **kwargs):
+        key = id(self._session_state._state)
+        _run_counts[key] = _run_counts.get(key, 0) + 1
+        return original_run(self, *args, **kwargs)
+
+    def counting_rerun(*args, **kwargs):
+        # Called on the script thread, so find the session through its context.
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            key = id(ctx.session_state._state)
+            _run_counts[key] = _run_counts.get(key, 0) + 1
+        return original_rerun(*args, **kwargs)
+
+    def script_sleep(seconds):
+        if get_script_run_ctx() is not None:
+            return None
+        return original_sleep(seconds)
+
+    AppTest._run = counting_run
+    streamlit.rerun = counting_rerun
+    # Must be registered before app.py creates its client.
+    monitoring.register(WireBytesListener())
+    if skip_ui_sleeps:
+        time.sleep = script_sleep
+
+
+class WireBytesListener(monitoring.CommandListener):
+    """Adds up the BSON size of every command and reply per session.
+
+    pymongo reports commands on the thread that issued them, which for the
+    app is the session's script thread, so the script context says which
+    session a command belongs to. Sizes are before wire compression, so
+    they measure what projections control.
+    """
+
+    def started(self, event):
+        self._add(event.command)
+
+    def succeeded(self, event):
+        self._add(event.reply)
+
+    def failed(self, event):
+        pass
+
+    @staticmethod
+    def _add(document):
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is not None:
+            key = id(ctx.session_state._state)
+            _wire_bytes[key] = _wire_bytes.get(key, 0) + len(bson.encode(document))
+
+
+def current_rss_mb():
+    """Returns the resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is KB on Linux and bytes on macOS; this is a peak value.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+# ---- SIMULATED SESSION ----
+
+class SimulatedSession:
+    """One browser session walking through the main pages of app.py."""
+
+    def __init__(self, username, list_name, timeout):
+        self.username = username
+        self.list_name = list_name
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.timings = []  # (page, seconds, reruns, wire bytes)
+        self.errors = []
+        self.state_bytes = 0
+
+    def _step(self, page, action):
+        key = id(self.at._session_state._state)
+        _run_counts[key] = 0
+        _wire_bytes[key] = 0
+        start = time.perf_counter()
+        try:
+            action()
+            if self.at.exception:
+                self.errors.append(
+                    (page, str(self.at.exception[0].message)))
+        except Exception as e:  # Keep the load test running on app errors.
+            self.errors.append((page, repr(e)))
+        elapsed = time.perf_counter() - start
+        self.timings.append((page, elapsed, _run_counts.pop(key, 0),
+                             _wire_bytes.pop(key, 0)))
+
+    def _goto(self, page):
+        self.at.session_state["page"] = page
+        self.at.session_state["selected_list"] = self.list_name
+        self.at.run()
+
+    def _login(self):
+        self.at.run()
+        self.at.text_input(key="login_user").input(self.username)
+        self.at.text_input(key="login_pass").input(LOAD_TEST_PASSWORD)
+        self.at.button(key="login_button").click().run()
+
+    def _mark_attendance(self):
+        self._goto("attendance_marking")
+        # Sunday has no schedule, so always mark the most recent weekday.
+        day = date.today()
+        while day.strftime("%A") == "Sunday":
+            day -= timedelta(days=1)
+        self.at.date_input[0].set_value(day).run()
+
+    def _save_attendance(self):
+        for button in self.at.button:
+            if button.label.startswith("Save Attendance"):
+                button.click().run()
+                return
+        raise RuntimeError("no attendance form on the marking page")
+
+    def _prediction(self):
+        self._goto("prediction")
+        self.at.selectbox[0].set_value(self.list_name).run()
+
+    def run_flow(self):
+        self._step("login", self._login)
+        self._step("dashboard", lambda: self._goto("dashboard"))
+        self._step("mark_attendance", self._mark_attendance)
+        self._step("save_attendance", self._save_attendance)
+        self._step("analysis", lambda: self._goto("analysis"))
+        self._step("prediction", self._prediction)
+        # What this session holds on the server after the flow.
+        self.state_bytes = sum(state_footprint(self.at.session_state).values())
+
+
+def run_level(pairs, concurrency, flows_per_session, timeout):
+    """Runs ``concurrency`` sessions in parallel and returns their results."""
+    def worker(index):
+        username, list_name = pairs[index % len(pairs)]
+        results = []
+        for _ in range(flows_per_session):
+            session = SimulatedSession(username, list_name, timeout)
+            session.run_flow()
+            results.append(session)
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        sessions = [s for batch in pool.map(worker, range(concurrency))
+                    for s in batch]
+    wall = time.perf_counter() - start
+    return summarize_level(concurrency, sessions, wall)
+
+
+def summarize_level(concurrency, sessions, wall):
+    per_page = {page: [] for page in PAGES}
+    page_reruns = {page: 0 for page in PAGES}
+    page_bytes = {page: 0 for page in PAGES}
+    total_reruns = 0
+    errors = []
+    for session in sessions:
+        errors.extend(session.errors)
+        for page, elapsed, reruns, wire_bytes in session.timings:
+            per_page[page].append(elapsed)
+            page_reruns[page] += reruns
+            page_bytes[page] += wire_bytes
+            total_reruns += reruns
+
+    latency = {}
+    for page, values in per_page.items():
+        if values:
+            latency[page] = {
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "mean_ms": statistics.fmean(values) * 1000,
+                "reruns_per_visit": page_reruns[page] / len(values),
+                "wire_kb_per_visit": page_bytes[page] / len(values) / 1024,
+            }
+    return {
+        "concurrency": concurrency,
+        "flows": len(sessions),
+        "wall_s": wall,
+        "flows_per_s": len(sessions) / wall if wall else 0.0,
+        "reruns": total_reruns,
+        "reruns_per_s": total_reruns / wall if wall else 0.0,
+        "rss_mb": current_rss_mb(),
+        "state_kb_per_session": statistics.fmean(
+            s.state_bytes for s in sessions) / 1024 if sessions else 0.0,
+        "errors": len(errors),
+        "sample_errors": errors[:5],
+        "latency": latency,
+    }
+
+
+def find_saturation(levels, min_gain, p95_budget_ms):
+    """Returns the concurrency level where the server saturated, or None.
+
+    The server has saturated once a level adds less than ``min_gain`` (a
+    fraction) throughput over the previous level, or any page's p95 latency
+    is above ``p95_budget_ms``. The level returned is then the one with the
+    highest throughput, since more sessions than that only wait longer.
+    """
+    previous = None
+    for level in levels:
+        worst_p95 = max((p["p95_ms"] for p in level["latency"].values()),
+                        default=0.0)
+        if worst_p95 > p95_budget_ms or (
+                previous and level["flows_per_s"] < previous["flows_per_s"] * (1 + min_gain)):
+            return max(levels, key=lambda l: l["flows_per_s"])["concurrency"]
+        previous = level
+    return None
+
+
+def print_level(level):
+    print(f"\n== concurrency {level['concurrency']}: {level['flows']} flows in "
+          f"{level['wall_s']:.1f}s | {level['flows_per_s']:.2f} flows/s | "
+          f"{level['reruns_per_s']:.1f} reruns/s | RSS {level['rss_mb']:.0f} MB | "
+          f"session state {level['state_kb_per_session']:.1f} KB | errors {level['errors']}")
+    print(f"   {'page':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'reruns':>8}{'wire KB':>10}")
+    for page in PAGES:
+        stats = level["latency"].get(page)
+        if stats:
+            wire = f"{stats['wire_kb_per_visit']:.1f}" if stats["wire_kb_per_visit"] else "-"
+            print(f"   {page:<16}{stats['p50_ms']:>10.1f}"
+                  f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+                  f"{stats['reruns_per_visit']:>8.1f}{wire:>10}")
+    for page, message in level["sample_errors"]:
+        print(f"   ! {page}: {message}")
+
+
+def wire_budget_failures(levels, budget):
+    """(concurrency, page, measured KB, budget KB) for every page over budget.
+
+    ``budget`` maps page name to the most KB one visit may move.
+    """
+    failures = []
+    for level in levels:
+        for page, limit in budget.items():
+            stats = level["latency"].get(page)
+            if stats and stats["wire_kb_per_visit"] > limit:
+                failures.append((level["concurrency"], page,
+                                 stats["wire_kb_per_visit"], limit))
+    return failures
+
+
+def measured_wire_budget(levels, headroom):
+    """A budget file's contents: the largest KB per visit seen, plus headroom."""
+    budget = {}
+    for level in levels:
+        for page, stats in level["latency"].items():
+            # Rounded up, so a small page still gets some headroom.
+            budget[page] = max(budget.get(page, 0.0), math.ceil(
+                stats["wire_kb_per_visit"] * (1 + headroom) * 10) / 10)
+    return budget
+
+
+def patch_mongomock_dates(mongomock):
+    """Adds the date operators app.py's pipelines use but mongomock lacks.
+
+    Covers ``$dateFromString`` for "YYYY-MM-DD" strings and ``$isoWeek`` /
+    ``$isoWeekYear``; everything else is left to mongomock.
+    """
+    from mongomock import aggregate
+    original = aggregate._Parser._handle_date_operator
+
+    def handle_date_operator(self, operator, values):
+        if operator == "$dateFromString":
+            try:
+                return datetime.strptime(self.parse(values["dateString"]), "%Y-%m-%d")
+            except (TypeError, ValueError):
+                return values.get("onError")
+        if operator in ("$isoWeek", "$isoWeekYear"):
+            year, week, _ = self.parse(values).isocalendar()
+            return week if operator == "$isoWeek" else year
+        return original(self, operator, values)
+
+    aggregate._Parser._handle_date_operator = handle_date_operator
+
+
+def patch_mongomock_bulk_write(mongomock):
+    """Lets mongomock's bulk builder accept the ``sort`` argument that newer
+    pymongo versions pass for every UpdateOne and ReplaceOne."""
+    builder = mongomock.collection.BulkOperationBuilder
+    original_update, original_replace = builder.add_update, builder.add_replace
+
+    def add_update(self, selector, doc, multi=False, upsert=False, sort=None, **kwargs):
+        return original_update(self, selector, doc, multi, upsert, **kwargs)
+
+    def add_replace(self, selector, doc, upsert=False, sort=None, **kwargs):
+        return original_replace(self, selector, doc, upsert, **kwargs)
+
+    builder.add_update = add_update
+    builder.add_replace = add_replace
+
+
+def patch_mongomock_wire_bytes(mongomock):
+    """Counts bytes for mongomock the way WireBytesListener does for a server.
+
+    mongomock never builds commands, so each collection call counts the BSON
+    size of its filter, projection, pipeline or documents, and of the
+    documents it returns. Calls mongomock makes to itself while serving one
+    (aggregate() reading the collection through find()) are not counted.
+    """
+    from mongomock.collection import Collection, Cursor
+    from mongomock.command_cursor import CommandCursor
+    if getattr(Collection, "counts_wire_bytes", False):
+        return  # Already patched by an earlier connect().
+    Collection.counts_wire_bytes = True
+    depth = threading.local()
+
+    def size(value):
+        if isinstance(value, dict):
+            return len(bson.encode(value))
+        if isinstance(value, (list, tuple)):
+            return sum(size(item) for item in value)
+        if hasattr(value, "_filter"):  # UpdateOne and the other bulk_write operations.
+            return size(value._filter) + size(getattr(value, "_doc", None))
+        return 0
+
+    def count(nbytes):
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is not None and nbytes:
+            key = id(ctx.session_state._state)
+            _wire_bytes[key] = _wire_bytes.get(key, 0) + nbytes
+
+    def counted(method):
+        def wrapper(self, *args, **kwargs):
+            outermost = not getattr(depth, "level", 0)
+            depth.level = getattr(depth, "level", 0) + 1
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                depth.level -= 1
+            if outermost:
+                count(size(args) + size([v for v in kwargs.values() if isinstance(v, dict)]))
+                if isinstance(result, dict):
+                    count(size(result))
+                elif isinstance(result, list):  # distinct()
+                    count(len(bson.encode({"values": result})))
+            return result
+        return wrapper
+
+    def counted_next(method):
+        def wrapper(self):
+            doc = method(self)
+            if not getattr(depth, "level", 0):
+                count(size(doc))
+            return doc
+        return wrapper
+
+    for name in ("find", "find_one", "aggregate", "distinct", "count_documents",
+                 "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+                 "delete_one", "delete_many", "find_one_and_update",
+                 "find_one_and_replace", "find_one_and_delete", "bulk_write"):
+        setattr(Collection, name, counted(getattr(Collection, name)))
+    for cursor in (Cursor, CommandCursor):
+        cursor.__next__ = counted_next(cursor.__next__)
+        cursor.next = cursor.__next__
+
+
+def connect(args):
+    """Returns a database handle, patching in mongomock when requested."""
+    if args.mongomock:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--mongomock needs the 'mongomock' package (pip install mongomock).")
+        patch_mongomock_dates(mongomock)
+        patch_mongomock_bulk_write(mongomock)
+        patch_mongomock_wire_bytes(mongomock)
+        shared = mongomock.MongoClient(args.mongo_uri)
+        # app.py builds its own client; hand every caller the seeded one.
+        pymongo.MongoClient = lambda *a, **kw: shared
+        return shared.get_database()
+    return pymongo.MongoClient(args.mongo_uri).get_database()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/attendance_load",
+                        help="Database to seed and test against. It is DROPPED when seeding.")
+    parser.add_argument("--mongomock", action="store_true",
+                        help="Use an in-process mongomock database instead of a server.")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="Reuse the dataset already in the database.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--lists", type=int, default=5)
+    parser.add_argument("--days", type=int, default=120,
+                        help="Days of history per user.")
+    parser.add_argument("--levels", default="1,2,4,8,16",
+                        help="Comma-separated concurrency levels to ramp through.")
+    parser.add_argument("--flows", type=int, default=2,
+                        help="Full page flows per session at each level.")
+    parser.add_argument("--min-gain", type=float, default=0.10,
+                        help="Throughput gain below which a level counts as saturated.")
+    parser.add_argument("--p95-budget-ms", type=float, default=2000.0)
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="Per-rerun timeout passed to AppTest.")
+    parser.add_argument("--keep-ui-sleeps", action="store_true",
+                        help="Keep app.py's time.sleep() calls after saves.")
+    parser.add_argument("--stop-at-saturation", action="store_true")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--wire-budget", metavar="PATH",
+                        help="JSON of page -> max KB per visit; exit 1 if a page goes over.")
+    parser.add_argument("--save-wire-budget", metavar="PATH",
+                        help="Write the measured KB per visit (+10%%) as a budget file.")
+    args = parser.parse_args(argv)
+
+    db = connect(args)
+    if args.no_seed:
+        pairs = [(d["username"], d["_id"]) for d in db.attendance_records.aggregate([
+            {"$group": {"_id": "$list_name", "username": {"$first": "$username"}}}])]
+        if not pairs:
+            sys.exit("No attendance records found; run without --no-seed first.")
+    else:
+        print(f"Seeding {args.users} users x {args.days} days ...")
+        pairs = seed_database(db, args.users, args.lists, args.days)
+
+    install_hooks(args.mongo_uri, skip_ui_sleeps=not args.keep_ui_sleeps)
+    levels = []
+    for concurrency in [int(c) for c in args.levels.split(",") if c.strip()]:
+        level = run_level(pairs, concurrency, args.flows, args.timeout)
+        levels.append(level)
+        print_level(level)
+        if args.stop_at_saturation and find_saturation(
+                levels, args.min_gain, args.p95_budget_ms) is not None:
+            break
+
+    saturation = find_saturation(levels, args.min_gain, args.p95_budget_ms)
+    best = max(levels, key=lambda l: l["flows_per_s"]) if levels else None
+    print()
+    if saturation is None:
+        print("No saturation within the tested levels; try higher --levels.")
+    else:
+        print(f"Saturation at concurrency {saturation}.")
+    if best:
+        print(f"Peak throughput {best['flows_per_s']:.2f} flows/s "
+              f"at concurrency {best['concurrency']}.")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"levels": levels, "saturation": saturation}, f, indent=2)
+    if args.save_wire_budget:
+        with open(args.save_wire_budget, "w") as f:
+            json.dump(measured_wire_budget(levels, 0.10), f, indent=2)
+        print(f"Wrote wire budget to {args.save_wire_budget}.")
+    if args.wire_budget:
+        with open(args.wire_budget) as f:
+            failures = wire_budget_failures(levels, json.load(f))
+        for concurrency, page, measured, limit in failures:
+            print(f"OVER WIRE BUDGET at concurrency {concurrency}: {page} "
+                  f"moved {measured:.1f} KB per visit (budget {limit:.1f} KB)")
+        if failures:
+            return 1
+        print("All pages within the wire budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Converts timetables and attendance to subject ids, or reports the saving.
+
+Timetables now store each subject's name once, in ``subjects``, and
+schedules and day records refer to subjects by a small integer id. The app
+reads both forms, so old data keeps working without this script, but until
+it has run a renamed subject's older days still carry the old name. Run it
+once per database (it is safe to repeat and to run while the app is up).
+
+For each timetable it assigns ids to every subject named in the schedule,
+the day records or the archive, then rewrites the schedule, the day
+documents in batches and the archived days. A day changed while the batch
+was being written is skipped and picked up by the next run. Versions are
+not bumped, so open marking forms are not sent into a save conflict.
+
+--report only measures: the BSON size of every day document with subject
+names against the same documents with ids (plus the dictionaries).
+
+Examples:
+    python migrate_subject_ids.py --report
+    python migrate_subject_ids.py --list "Semester 4" --dry-run
+    python migrate_subject_ids.py
+"""
+import argparse
+import sys
+
+import bson
+from pymongo import UpdateOne, errors
+
+from archive import rewrite_archived_days
+from attendance_store import touch_records, version_filter
+from models import SubjectDictionary
+from mongo_connection import create_client, load_secrets
+from subjects import encode_records, forget_dictionary, subject_ids
+
+BATCH_SIZE = 1000
+
+
+def subject_names(db, list_name, timetable):
+    """Every subject name still stored by name for ``list_name``."""
+    schedules = [timetable.get("schedule") or {}] + [
+        version["schedule"] for version in timetable.get("schedule_versions") or ()]
+    names = {entry["name"] for schedule in schedules for entries in schedule.values()
+             for entry in entries if "name" in entry}
+    names.update(name for name in db.attendance_records.distinct(
+        "records.subject", {"list_name": list_name}) if isinstance(name, str))
+    for doc in db.attendance_archive.find({"list_name": list_name}, {"totals.subject": 1}):
+        names.update(row["subject"] for row in doc.get("totals", [])
+                     if isinstance(row["subject"], str))
+    return sorted(names)
+
+
+def encode_day(dictionary, day):
+    return {**day, "records": encode_records(dictionary, day.get("records", []))}
+
+
+def migrate_timetable(db, timetable, dry_run=False, batch_size=BATCH_SIZE):
+    """Converts one timetable and its attendance; returns ``{"days", "skipped", "archives"}``."""
+    list_name = timetable["_id"]
+    names = subject_names(db, list_name, timetable)
+    counts = {"days": 0, "skipped": 0, "archives": 0}
+    query = {"list_name": list_name, "records.subject": {"$exists": True}}
+    if dry_run:
+        counts["days"] = db.attendance_records.count_documents(query)
+        counts["archives"] = db.attendance_archive.count_documents({"list_name": list_name})
+        return counts
+    dictionary = subject_ids(db, list_name, names)
+    if dictionary is None:
+        return counts  # Deleted meanwhile.
+
+    def encode_schedule(schedule):
+        return {day: [{"id": dictionary.id_for(e["name"]), "hours": e.get("hours", 0)}
+                      if "name" in e else e for e in entries]
+                for day, entries in schedule.items()}
+
+    schedule = timetable.get("schedule") or {}
+    versions = timetable.get("schedule_versions") or []
+    encoded = encode_schedule(schedule)
+    encoded_versions = [{**version, "schedule": encode_schedule(version["schedule"])}
+                        for version in versions]
+    if encoded != schedule or encoded_versions != versions:
+        fields = {"schedule": encoded}
+        if versions:
+            fields["schedule_versions"] = encoded_versions
+        db.timetables.update_one(
+            {"_id": list_name, "schedule": schedule,
+             "schedule_versions": timetable.get("schedule_versions")},
+            {"$set": fields})
+
+    def flush(ops):
+        if ops:
+            result = db.attendance_records.bulk_write(ops, ordered=False)
+            counts["days"] += result.modified_count
+            counts["skipped"] += len(ops) - result.matched_count
+
+    ops = []
+    for doc in db.attendance_records.find(query, {"username": 1, "records": 1, "version": 1},
+                                          batch_size=batch_size):
+        ops.append(UpdateOne(
+            {"_id": doc["_id"], "username": doc["username"], "list_name": list_name,
+             "version": version_filter(doc.get("version", 0))},
+            {"$set": {"records": encode_records(dictionary, doc["records"])}}))
+        if len(ops) >= batch_size:
+            flush(ops)
+            ops = []
+    flush(ops)
+
+    for doc in db.attendance_archive.find({"list_name": list_name}, {"username": 1}):
+        rewrite_archived_days(db, doc["username"], list_name,
+                              lambda day: encode_day(dictionary, day))
+        counts["archives"] += 1
+    touch_records(db, list_name=list_name)
+    forget_dictionary(list_name)
+    return counts
+
+
+def storage_report(db, list_names):
+    """BSON bytes of the day documents ``{"days", "names", "ids", "dictionaries"}``:
+    every record by subject name, and by id with one dictionary per timetable."""
+    report = {"days": 0, "names": 0, "ids": 0, "dictionaries": 0}
+    for list_name in list_names:
+        timetable = db.timetables.find_one({"_id": list_name}, {"subjects": 1}) or {}
+        dictionary = SubjectDictionary.from_doc(timetable)
+        # Names not given an id yet get the ids a migration would give them.
+        missing = sorted(set(subject_names(db, list_name, {})) - set(dictionary.ids))
+        dictionary = SubjectDictionary(
+            [{"id": i, "name": n} for i, n in dictionary.names.items()]
+            + [{"id": dictionary.next_id + i, "name": n} for i, n in enumerate(missing)])
+        report["dictionaries"] += len(bson.encode({"subjects": [
+            {"id": i, "name": n} for i, n in dictionary.names.items()]}))
+        for doc in db.attendance_records.find({"list_name": list_name},
+                                              batch_size=BATCH_SIZE):
+            records = [dictionary.decode(rec) for rec in doc.get("records", [])]
+            report["days"] += 1
+            report["names"] += len(bson.encode({**doc, "records": records}))
+            report["ids"] += len(bson.encode(encode_day(dictionary, {**doc, "records": records})))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--list", dest="list_name", help="Only this timetable.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Count what would be converted without changing anything.")
+    parser.add_argument("--report", action="store_true",
+                        help="Only compare storage with subject names and with ids.")
+    parser.add_argument("--mongo-uri",
+                        help="Defaults to mongo_uri from .streamlit/secrets.toml or $MONGO_URI.")
+    args = parser.parse_args(argv)
+
+    secrets = load_secrets()
+    mongo_uri = args.mongo_uri or secrets.get("mongo_uri")
+    if not mongo_uri:
+        parser.error("No MongoDB URI: pass --mongo-uri or set mongo_uri in secrets.toml.")
+
+    db = create_client(secrets, mongo_uri).get_database()
+    query = {"_id": args.list_name} if args.list_name else {}
+    try:
+        if args.report:
+            report = storage_report(db, [doc["_id"] for doc in db.timetables.find(query, {"_id": 1})])
+            with_ids = report["ids"] + report["dictionaries"]
+            saved = 1 - with_ids / report["names"] if report["names"] else 0
+            print(f"{report['days']} day documents")
+            print(f"  subject names  {report['names']:>12,} bytes")
+            print(f"  subject ids    {with_ids:>12,} bytes "
+                  f"({report['dictionaries']:,} in dictionaries), {saved:.1%} smaller")
+            return 0
+        total = {"timetables": 0, "days": 0, "skipped": 0, "archives": 0}
+        for timetable in db.timetables.find(query, {"schedule": 1, "schedule_versions": 1}):
+            counts = migrate_timetable(db, timetable, dry_run=args.dry_run)
+            total["timetables"] += 1
+            for key, n in counts.items():
+                total[key] += n
+        verb = "Would convert" if args.dry_run else "Converted"
+        print(f"{verb} {total['timetables']} timetables, {total['days']} day documents "
+              f"and {total['archives']} archives.")
+        if total["skipped"]:
+            print(f"{total['skipped']} days changed while converting; run again to finish them.")
+    except errors.PyMongoError as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
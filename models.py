@@ -0,0 +1,325 @@
+"""Typed views of timetable and attendance documents.
+
+Each class is built once from the raw MongoDB document, with the old-format
+fallbacks (``hours`` instead of ``hours_conducted``, ``status`` instead of
+``hours_present``) resolved at parse time. Page code then reads attributes
+instead of repeating dict lookups and fallbacks. ``__slots__`` keeps the
+per-instance memory small, since a page builds one object per day or subject.
+"""
+from bisect import bisect_right
+from datetime import date
+
+# Minimal projections: exactly the fields the from_doc() parsers read.
+TIMETABLE_FIELDS = {"schedule": 1, "schedule_versions": 1, "owner": 1, "is_public": 1,
+                    "calendar": 1, "subjects": 1, "next_subject_id": 1}
+RECORD_FIELDS = {f"records.{field}": 1 for field in
+                 ("subject_id", "subject", "hours_conducted", "hours", "hours_present", "status")}
+DAY_RECORD_FIELDS = {"_id": 0, "date": 1, "version": 1, **RECORD_FIELDS}
+
+
+def record_hours(record):
+    """Returns (hours_conducted, hours_present) for one stored subject record.
+
+    Older records have ``hours`` instead of ``hours_conducted`` (imports
+    write 1) and only a ``status`` instead of ``hours_present``.
+    """
+    conducted = record.get("hours_conducted", record.get("hours", 1))
+    if "hours_present" in record:
+        return conducted, record["hours_present"]
+    return conducted, conducted if record.get("status") == "Present" else 0
+
+
+def record_subject(record):
+    """The stored subject key of one record: its ``subject_id``, or for records
+    written before subject ids the ``subject`` name itself."""
+    return record.get("subject_id", record.get("subject"))
+
+
+def status_for(conducted, present):
+    """"Present", "Absent" or "Partial" for a subject's hours on one day."""
+    if present == 0:
+        return "Absent"
+    if present >= conducted:
+        return "Present"
+    return "Partial"
+
+
+class SubjectDictionary:
+    """A timetable's subject names and their stable integer ids.
+
+    Stored once on the timetable as ``subjects: [{"id", "name"}]`` plus
+    ``next_subject_id``; schedule entries and day records refer to subjects
+    by id. Ids are never reused, so renaming a subject keeps its history.
+    Records written before ids existed hold the name, which name() passes
+    through unchanged.
+    """
+
+    __slots__ = ("names", "ids", "next_id")
+
+    def __init__(self, entries=(), next_id=None):
+        self.names = {entry["id"]: entry["name"] for entry in entries}
+        self.ids = {name: subject_id for subject_id, name in self.names.items()}
+        self.next_id = next_id or max(self.names, default=0) + 1
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Parses a timetable document's ``subjects``; an empty dictionary for None."""
+        doc = doc or {}
+        return cls(doc.get("subjects") or (), doc.get("next_subject_id"))
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_for(self, name):
+        return self.ids.get(name)
+
+    def knows(self, key):
+        """False for an id this copy has not seen (added after it was loaded)."""
+        return not isinstance(key, int) or key in self.names
+
+    def name(self, key):
+        """The subject name for a stored key (an id, or a name from an old record)."""
+        if not isinstance(key, int):
+            return key
+        return self.names.get(key, f"Subject #{key}")
+
+    def encode(self, record):
+        """``record`` with its ``subject`` name replaced by ``subject_id``;
+        unchanged if the name has no id."""
+        subject_id = self.ids.get(record.get("subject"))
+        if subject_id is None:
+            return record
+        encoded = {k: v for k, v in record.items() if k != "subject"}
+        encoded["subject_id"] = subject_id
+        return encoded
+
+    def decode(self, record):
+        """``record`` with a ``subject`` name instead of ``subject_id``."""
+        if "subject_id" not in record:
+            return record
+        decoded = {k: v for k, v in record.items() if k != "subject_id"}
+        decoded["subject"] = self.name(record["subject_id"])
+        return decoded
+
+
+class DaySchedule:
+    """The subjects taught on one weekday, in timetable order, with their hours."""
+
+    __slots__ = ("day", "subjects", "hours")
+
+    def __init__(self, day, subjects, hours):
+        self.day = day
+        self.subjects = subjects
+        self.hours = hours
+
+    @classmethod
+    def from_entries(cls, day, entries, subjects=None):
+        """Parses stored entries: ``{"id", "hours"}``, or ``{"name", "hours"}``
+        in timetables saved before subject ids."""
+        entries = entries or []
+        subjects = subjects or SubjectDictionary()
+        return cls(day, tuple(e["name"] if "name" in e else subjects.name(e["id"]) for e in entries),
+                   tuple(int(e.get("hours", 0)) for e in entries))
+
+    def __iter__(self):
+        """Yields (subject, hours) pairs."""
+        return zip(self.subjects, self.hours)
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def hours_for(self, subject):
+        try:
+            return self.hours[self.subjects.index(subject)]
+        except ValueError:
+            return 0
+
+
+class SemesterCalendar:
+    """First and last day of term plus holidays, all "YYYY-MM-DD" strings.
+
+    Stored on the timetable as ``calendar: {"start", "end", "holidays"}``.
+    ``holidays`` is sorted and de-duplicated, so the tuple doubles as a
+    cache key for anything derived from the calendar.
+    """
+
+    __slots__ = ("start", "end", "holidays")
+
+    def __init__(self, start, end, holidays=()):
+        self.start = start
+        self.end = end
+        self.holidays = tuple(sorted(set(holidays)))
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Parses a timetable's ``calendar`` field; None if it is missing or incomplete."""
+        if not doc or not doc.get("start") or not doc.get("end"):
+            return None
+        return cls(doc["start"], doc["end"], doc.get("holidays") or ())
+
+    def to_doc(self):
+        return {"start": self.start, "end": self.end, "holidays": list(self.holidays)}
+
+
+class Timetable:
+    """A timetable document: owner, visibility, the weekly schedule,
+    the subject dictionary and, optionally, the semester calendar.
+
+    Editing the schedule adds a version that applies from a given date
+    (``schedule_versions: [{"from", "schedule"}]``, sorted by ``from``);
+    ``schedule`` is a copy of the latest. ``days`` is the latest version,
+    and schedule_on() finds the one in force on any date by bisecting the
+    dates the schedule changed. The first version also covers every date
+    before it, and timetables saved before versions have just the one.
+    """
+
+    __slots__ = ("name", "owner", "is_public", "days", "subjects", "calendar", "subject_ids",
+                 "changes", "versions")
+
+    def __init__(self, name, owner, is_public, days, calendar=None, subject_ids=None,
+                 changes=(), versions=None):
+        self.name = name
+        self.owner = owner
+        self.is_public = is_public
+        self.days = days
+        self.calendar = calendar
+        self.subject_ids = subject_ids or SubjectDictionary()
+        # Every subject taught on any day, sorted; used by most pages.
+        self.subjects = tuple(sorted({s for day in days.values() for s in day.subjects}))
+        # Sorted dates a new version took effect, and the version in force
+        # before the first one, between each pair and after the last.
+        self.changes = tuple(changes)
+        self.versions = tuple(versions) if versions else (days,)
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Parses a ``timetables`` document; returns None for None."""
+        if doc is None:
+            return None
+        subject_ids = SubjectDictionary.from_doc(doc)
+
+        def parse(schedule):
+            return {day: DaySchedule.from_entries(day, entries, subject_ids)
+                    for day, entries in (schedule or {}).items()}
+
+        stored = doc.get("schedule_versions") or ()
+        versions = [parse(version["schedule"]) for version in stored]
+        days = versions[-1] if versions else parse(doc.get("schedule"))
+        return cls(doc["_id"], doc.get("owner"), doc.get("is_public", True), days,
+                   SemesterCalendar.from_doc(doc.get("calendar")), subject_ids,
+                   [version["from"] for version in stored[1:]], versions)
+
+    def day(self, day_name):
+        """The DaySchedule for a weekday name such as "Monday" (empty if none)."""
+        schedule = self.days.get(day_name)
+        return schedule if schedule is not None else DaySchedule(day_name, (), ())
+
+    def schedule_on(self, date_str):
+        """The weekday schedules ({day name: DaySchedule}) in force on a
+        "YYYY-MM-DD" date."""
+        return self.versions[bisect_right(self.changes, date_str)]
+
+    def day_on(self, date_str):
+        """The DaySchedule in force on a "YYYY-MM-DD" date, for its weekday."""
+        day_name = date.fromisoformat(date_str).strftime("%A")
+        schedule = self.schedule_on(date_str).get(day_name)
+        return schedule if schedule is not None else DaySchedule(day_name, (), ())
+
+    def subjects_on(self, date_str):
+        """Every subject of the version in force on a date, sorted."""
+        return tuple(sorted({s for day in self.schedule_on(date_str).values()
+                             for s in day.subjects}))
+
+    def weekly_hours(self, day_names):
+        """Hours per subject per weekday as nested tuples, rows in ``self.subjects``
+        order and columns in ``day_names`` order (hashable, for caching)."""
+        return self.version_hours(self.days, day_names)
+
+    def version_hours(self, days, day_names):
+        """weekly_hours() of one schedule version, still in ``self.subjects`` rows."""
+        empty = DaySchedule(None, (), ())
+        return tuple(tuple(days.get(day, empty).hours_for(subject) for day in day_names)
+                     for subject in self.subjects)
+
+    def versioned_hours(self, day_names):
+        """``(changes, hours)``: the version change dates and weekly_hours()
+        of every version, for projecting hours across schedule changes."""
+        return self.changes, tuple(self.version_hours(days, day_names) for days in self.versions)
+
+
+class DayRecord:
+    """One user's attendance on one date, stored column-wise per subject.
+
+    ``subjects``, ``conducted``, ``present`` and ``statuses`` are parallel
+    lists in stored order. A subject that appears more than once (imports
+    write one unit-hour entry per class) keeps every entry; ``totals()``
+    adds them up.
+    """
+
+    __slots__ = ("date", "version", "subjects", "conducted", "present", "statuses")
+
+    def __init__(self, date, version, subjects, conducted, present, statuses):
+        self.date = date
+        self.version = version
+        self.subjects = subjects
+        self.conducted = conducted
+        self.present = present
+        self.statuses = statuses
+
+    @classmethod
+    def from_doc(cls, doc, subject_ids=None):
+        """Parses an ``attendance_records`` document; returns None for None.
+
+        ``subject_ids`` is the timetable's SubjectDictionary, for records that
+        store a ``subject_id``.
+        """
+        if doc is None:
+            return None
+        subject_ids = subject_ids or SubjectDictionary()
+        subjects, conducted, present, statuses = [], [], [], []
+        for rec in doc.get("records", []):
+            c, p = record_hours(rec)
+            subjects.append(subject_ids.name(record_subject(rec)))
+            conducted.append(c)
+            present.append(p)
+            statuses.append(rec.get("status") or status_for(c, p))
+        # Documents written before versioning count as version 0.
+        return cls(doc.get("date"), doc.get("version", 0), subjects, conducted, present, statuses)
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def __iter__(self):
+        """Yields (subject, conducted, present, status) per stored entry."""
+        return zip(self.subjects, self.conducted, self.present, self.statuses)
+
+    def hours(self, subject):
+        """(conducted, present) of the first entry for ``subject``, or None."""
+        try:
+            i = self.subjects.index(subject)
+        except ValueError:
+            return None
+        return self.conducted[i], self.present[i]
+
+    def totals(self):
+        """Total (conducted, present) hours over all subjects."""
+        return sum(self.conducted), sum(self.present)
+
+
+class SubjectTotals:
+    """Conducted and present hours for one subject over some date range."""
+
+    __slots__ = ("subject", "conducted", "present")
+
+    def __init__(self, subject, conducted=0, present=0):
+        self.subject = subject
+        self.conducted = conducted
+        self.present = present
+
+    @property
+    def absent(self):
+        return self.conducted - self.present
+
+    @property
+    def percentage(self):
+        return self.present / self.conducted * 100 if self.conducted > 0 else 0
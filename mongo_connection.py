@@ -0,0 +1,244 @@
+"""MongoDB settings shared by app.py and the command-line tools.
+
+The Streamlit app reads ``st.secrets``; scripts that run outside Streamlit
+read the same ``.streamlit/secrets.toml`` through load_secrets(). Both build
+their client with create_client(), so compression, pool sizes and timeouts
+are configured in one place.
+
+On a replica set, writes and read-your-own-write pages use the primary and
+retry once across an election (retryable writes). Read-only analytics can
+use analytics_database(), which prefers secondaries within a staleness
+bound. CircuitBreaker lets the app stop waiting on an unreachable server.
+"""
+import importlib.util
+import logging
+import os
+import threading
+import time
+import tomllib
+from collections import OrderedDict
+
+import pymongo
+from pymongo import errors
+from pymongo.read_preferences import SecondaryPreferred
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SECRETS_PATHS = [
+    os.path.join(APP_DIR, ".streamlit", "secrets.toml"),
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+]
+
+
+def load_secrets():
+    """Returns the first secrets.toml Streamlit would use, as a dict.
+
+    A ``MONGO_URI`` environment variable overrides ``mongo_uri``, which is
+    handy for cron jobs and containers.
+    """
+    secrets = {}
+    for path in SECRETS_PATHS:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                secrets = tomllib.load(f)
+            break
+    if os.environ.get("MONGO_URI"):
+        secrets["mongo_uri"] = os.environ["MONGO_URI"]
+    return secrets
+
+
+# Secret name -> (MongoClient option, default). Timeouts are milliseconds.
+CLIENT_SETTINGS = {
+    "mongo_max_pool_size": ("maxPoolSize", 50),
+    "mongo_min_pool_size": ("minPoolSize", 0),
+    "mongo_max_idle_ms": ("maxIdleTimeMS", 300000),
+    "mongo_server_selection_timeout_ms": ("serverSelectionTimeoutMS", 5000),
+    "mongo_connect_timeout_ms": ("connectTimeoutMS", 5000),
+    "mongo_socket_timeout_ms": ("socketTimeoutMS", 30000),
+    "mongo_wait_queue_timeout_ms": ("waitQueueTimeoutMS", 10000),
+}
+
+# Python package each wire compressor needs; zlib is always available.
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+DEFAULT_COMPRESSORS = "zstd,snappy,zlib"
+
+
+def available_compressors(names=DEFAULT_COMPRESSORS):
+    """The compressors from ``names`` whose Python package is installed.
+
+    The server picks the first one in the list it also supports. Asking
+    for one without its package only produces a pymongo warning, so those
+    are left out.
+    """
+    wanted = [n.strip() for n in names.split(",") if n.strip()]
+    return [name for name in wanted
+            if name in COMPRESSOR_MODULES and (COMPRESSOR_MODULES[name] is None
+                                               or importlib.util.find_spec(COMPRESSOR_MODULES[name]))]
+
+
+def client_options(secrets):
+    """MongoClient keyword arguments from the optional ``mongo_*`` secrets."""
+    options = {option: int(secrets.get(name, default))
+               for name, (option, default) in CLIENT_SETTINGS.items()}
+    options["retryWrites"] = True
+    options["retryReads"] = True
+    compressors = available_compressors(secrets.get("mongo_compressors", DEFAULT_COMPRESSORS))
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+def create_client(secrets, mongo_uri=None, **overrides):
+    """A MongoClient for ``mongo_uri`` (default: ``secrets["mongo_uri"]``).
+
+    ``overrides`` win over the settings from secrets.
+    """
+    options = client_options(secrets)
+    options.update(overrides)
+    return pymongo.MongoClient(mongo_uri or secrets["mongo_uri"], **options)
+
+
+def create_async_client(secrets, mongo_uri=None, **overrides):
+    """create_client() for asyncio code (the JSON API): same settings, one
+    pool shared by every request the event loop serves."""
+    options = client_options(secrets)
+    options.update(overrides)
+    return pymongo.AsyncMongoClient(mongo_uri or secrets["mongo_uri"], **options)
+
+
+# ---- READ ROUTING ----
+
+DEFAULT_MAX_STALENESS_S = 90  # the smallest bound MongoDB accepts
+
+
+def analytics_database(client, secrets):
+    """The app database with reads sent to a secondary when one is fresh enough.
+
+    Secondaries more than ``mongo_max_staleness_s`` seconds behind the
+    primary are skipped; with none left (or no replica set) reads go to
+    the primary. Only for pages that can show data a little behind.
+    """
+    staleness = int(secrets.get("mongo_max_staleness_s", DEFAULT_MAX_STALENESS_S))
+    return client.get_database(
+        read_preference=SecondaryPreferred(max_staleness=staleness))
+
+
+# ---- CIRCUIT BREAKER ----
+
+# Errors that mean the server could not be reached, as opposed to a bad query.
+UNAVAILABLE_ERRORS = (errors.ConnectionFailure,)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the database while the breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling MongoDB after repeated connection failures.
+
+    After ``failure_threshold`` failures in a row the breaker opens and
+    calls fail at once with CircuitOpen, instead of each waiting for the
+    server selection timeout. After ``reset_seconds`` one trial call is let
+    through: success closes the breaker, another failure re-opens it.
+    Thread-safe, so one instance can serve every session of the server.
+    """
+
+    def __init__(self, failure_threshold=3, reset_seconds=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """True while calls are being refused (the database looks down)."""
+        with self.lock:
+            return self.opened_at is not None and (
+                self.trial_running or self.clock() - self.opened_at < self.reset_seconds)
+
+    def _before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial_running or self.clock() - self.opened_at < self.reset_seconds:
+                raise CircuitOpen("the database is unreachable")
+            self.trial_running = True
+
+    def _after_call(self, failed):
+        with self.lock:
+            self.trial_running = False
+            if not failed:
+                if self.opened_at is not None:
+                    logger.info("Database reachable again; circuit closed.")
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Database unreachable; circuit opened.")
+                self.opened_at = self.clock()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs ``fn``; connection errors count as failures and are re-raised."""
+        self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except UNAVAILABLE_ERRORS:
+            self._after_call(failed=True)
+            raise
+        except BaseException:
+            # A query error still proves the server answered.
+            self._after_call(failed=False)
+            raise
+        self._after_call(failed=False)
+        return result
+
+
+class LastKnownResults:
+    """Bounded, thread-safe LRU of the latest successful result per read key.
+
+    Used to keep showing totals while the database is unreachable.
+    """
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+
+# ---- HEALTH ----
+
+def ping(client):
+    """Pings the server and describes the result.
+
+    Returns ``{"ok", "latency_ms", "primary", "error"}``; ``primary`` is
+    "host:port" of the replica set primary, or None if there is none.
+    """
+    start = time.perf_counter()
+    try:
+        client.admin.command("ping")
+    except errors.PyMongoError as e:
+        return {"ok": False, "latency_ms": None, "primary": None, "error": str(e)}
+    latency_ms = (time.perf_counter() - start) * 1000
+    primary = client.primary
+    return {"ok": True, "latency_ms": round(latency_ms, 1),
+            "primary": f"{primary[0]}:{primary[1]}" if primary else None,
+            "error": None}
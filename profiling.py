@@ -0,0 +1,190 @@
+"""Profiles chosen reruns of one session, for finding slow page code.
+
+An admin arms the next N reruns of their own browser tab. Each is run
+under cProfile, and tracemalloc compares snapshots from its start and end,
+so the admin page can show where that rerun spent its Python time and what
+it allocated. ProfileStore keeps the latest results of the server process.
+Nothing is profiled or traced until a run is armed, so this can stay in
+production. No Streamlit imports.
+
+A rerun that ends with st.rerun() or st.stop() never reaches the end of
+the script; the app finishes its profile at the start of the next rerun
+instead. tracemalloc traces the whole process, so allocation sites can
+include other sessions running at the same time.
+"""
+import cProfile
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import deque
+
+TRACE_FRAMES = 10
+TOP_ALLOCATIONS = 20
+
+_tracing_lock = threading.Lock()
+_tracing_runs = 0  # Profiles using tracemalloc; it is stopped when the last one ends.
+
+
+def _start_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        _tracing_runs += 1
+
+
+def _stop_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        _tracing_runs -= 1
+        if _tracing_runs == 0:
+            tracemalloc.stop()
+
+
+def function_label(func):
+    """"file.py:12 name" for a pstats function key; built-ins keep their name."""
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{line} {name}"
+
+
+class ProfileRun:
+    """cProfile and tracemalloc over one rerun: start(), then finish() once."""
+
+    def __init__(self, page, username, trace_memory=True):
+        self.page = page
+        self.username = username
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile()
+        self.started_at = None
+        self._before = None
+        self._release = None
+
+    def start(self):
+        self.started_at = time.time()
+        if self.trace_memory:
+            _start_tracing()
+            # Stops tracing even if this run is dropped without finish().
+            self._release = weakref.finalize(self, _stop_tracing)
+            self._before = tracemalloc.take_snapshot()
+        self.profiler.enable()
+
+    def finish(self):
+        """Stops profiling and returns the result for ProfileStore.add()."""
+        self.profiler.disable()
+        allocations = []
+        if self._before is not None:
+            after = tracemalloc.take_snapshot()
+            self._release()
+            skip = [tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__)]
+            allocations = [
+                {"site": f"{os.path.basename(diff.traceback[0].filename)}:{diff.traceback[0].lineno}",
+                 "file": diff.traceback[0].filename,
+                 "kb": diff.size_diff / 1024, "blocks": diff.count_diff}
+                for diff in after.filter_traces(skip).compare_to(
+                    self._before.filter_traces(skip), "lineno")[:TOP_ALLOCATIONS]]
+            self._before = None
+        stats = pstats.Stats(self.profiler)
+        return {"page": self.page, "username": self.username, "started_at": self.started_at,
+                "seconds": stats.total_tt, "calls": stats.total_calls,
+                "stats": stats.stats, "allocations": allocations}
+
+
+class ProfileStore:
+    """The latest ``max_profiles`` rerun profiles of this process, newest first."""
+
+    def __init__(self, max_profiles=50):
+        self.profiles = deque(maxlen=max_profiles)
+        self.lock = threading.Lock()
+
+    def add(self, result):
+        with self.lock:
+            self.profiles.appendleft(result)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.profiles)
+
+    def clear(self):
+        with self.lock:
+            self.profiles.clear()
+
+
+# ---- VIEWS ----
+
+def top_functions(stats, limit=30, sort="cumulative"):
+    """The ``limit`` functions with the most ``sort`` time ("cumulative" or
+    "self"), as dicts with the function, calls and both times in seconds."""
+    index = 3 if sort == "cumulative" else 2
+    rows = sorted(stats.items(), key=lambda item: item[1][index], reverse=True)[:limit]
+    return [{"function": function_label(func), "calls": nc, "self_s": tt, "cumulative_s": ct}
+            for func, (_, nc, tt, ct, _) in rows]
+
+
+def call_tree(stats, max_depth=20, min_fraction=0.005):
+    """Flame graph rows ``(depth, start, width, function)`` in seconds.
+
+    pstats only keeps caller -> callee totals, not whole stacks, so a
+    function called from several places splits its callees' time in
+    proportion, as profile viewers do, and callees never outgrow their
+    caller's box (recursion counts time twice otherwise). Roots are the
+    calls made directly from the script. Boxes under ``min_fraction`` of
+    the run are left out, which also bounds the number of rows.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [(func, entry[3]) for func, entry in stats.items()
+             if not any(caller in stats for caller in entry[4])]
+    total = sum(seconds for _, seconds in roots) or 1.0
+    rows = []
+
+    def visit(func, depth, start, width, path):
+        rows.append((depth, start, width, func))
+        if depth + 1 >= max_depth:
+            return
+        scale = width / stats[func][3] if stats[func][3] else 0
+        offset = start
+        for child, seconds in sorted(callees.get(func, ()), key=lambda c: c[1], reverse=True):
+            child_width = min(seconds * scale, start + width - offset)
+            if child in path or child_width < total * min_fraction:
+                continue
+            visit(child, depth + 1, offset, child_width, path | {child})
+            offset += child_width
+
+    offset = 0.0
+    for func, seconds in sorted(roots, key=lambda r: r[1], reverse=True):
+        if seconds >= total * min_fraction:
+            visit(func, 0, offset, seconds, {func})
+            offset += seconds
+    return rows
+
+
+def collapsed_stacks(stats, max_depth=40, min_fraction=0.0005):
+    """The profile as "root;caller;function microseconds" lines, the input
+    format of flamegraph.pl and speedscope. Self time is spread over a
+    function's stacks in the same proportions as call_tree()."""
+    lines = {}
+    rows = call_tree(stats, max_depth=max_depth, min_fraction=min_fraction)
+    path = []
+    for depth, _, width, func in rows:
+        del path[depth:]
+        path.append(function_label(func).replace(";", ","))
+        own = stats[func][2] * (width / stats[func][3]) if stats[func][3] else 0
+        key = ";".join(path)
+        lines[key] = lines.get(key, 0) + own
+    return "\n".join(f"{stack} {round(seconds * 1e6)}"
+                     for stack, seconds in lines.items() if seconds > 0)
+
+
+def pstats_bytes(stats):
+    """The stats in the file format of cProfile.Profile.dump_stats(), for
+    pstats, snakeviz and similar tools."""
+    return marshal.dumps(stats)
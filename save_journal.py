@@ -0,0 +1,330 @@
+"""A local write-ahead journal for the marking form's saves.
+
+A save is first appended to a SQLite file on the app server and
+acknowledged as soon as that commit is on disk, so a slow or unreachable
+database neither blocks the form nor loses the marks. One background
+thread per server process replays the journal into ``attendance_records``
+in order, with the same compare-and-set as a direct save_day(), and
+retries while the database is unreachable.
+
+Each save carries a ``save_id`` that is stored on the day document. If the
+server stops between writing a day and removing its journal entry, the
+replay sees its own ``save_id`` on the conflicting document and counts the
+save as written, so replaying is idempotent per (username, list_name, date).
+
+While a day's save waits, the marking form is filled from it, and saving
+that form again replaces the waiting entry's records. If the earlier save
+is already being written, the new one is checked against the version that
+save produced rather than the one it started from: the journal remembers
+the version each of its saves wrote, and only a day still at exactly that
+version is taken over without a conflict. A save that conflicts
+with a change made elsewhere stays in the journal as a conflict until the
+user chooses a version. No Streamlit imports.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from archive import unarchive_day
+from attendance_store import SaveConflict, day_key, save_day
+from mongo_connection import UNAVAILABLE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# How long the version a save wrote is remembered, for saves of forms that
+# were filled from it.
+WRITTEN_KEEP_SECONDS = 24 * 3600
+MAX_RETRY_SECONDS = 600  # Longest wait between tries of a failed entry.
+
+PENDING, CONFLICT, FAILED, WRITTEN = "pending", "conflict", "failed", "written"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS saves (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    save_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    list_name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    records TEXT NOT NULL,
+    changed TEXT NOT NULL,
+    expected_version INTEGER,
+    base_save_id TEXT,
+    state TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    retry_at REAL
+);
+CREATE INDEX IF NOT EXISTS saves_day ON saves (username, list_name, date);
+CREATE TABLE IF NOT EXISTS written (
+    save_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    written_at REAL NOT NULL
+);
+"""
+ENTRY_FIELDS = ("id", "save_id", "username", "list_name", "date", "records", "changed",
+                "expected_version", "base_save_id", "state", "queued_at", "attempts", "last_error",
+                "retry_at")
+
+
+def _entry(row):
+    if row is None:
+        return None
+    entry = dict(zip(ENTRY_FIELDS, row))
+    entry["records"] = json.loads(entry["records"])
+    entry["changed"] = json.loads(entry["changed"])
+    return entry
+
+
+class SaveJournal:
+    """Durable queue of day saves, drained by one background thread.
+
+    append() only writes to the local file. The drainer wakes for each new
+    entry and, while the database is unreachable, retries the oldest one
+    every ``retry_seconds``. An entry that fails for any other reason is
+    marked failed and tried again later, waiting twice as long after each
+    failure (up to MAX_RETRY_SECONDS), while the entries behind it go on.
+    A restart tries failed entries again straight away.
+    """
+
+    def __init__(self, db, path, retry_seconds=2.0):
+        self.db = db
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("UPDATE saves SET state = ? WHERE state = ?", (PENDING, FAILED))
+        self.stats = {"appended": 0, "written": 0, "replayed": 0, "conflicts": 0,
+                      "failed": 0, "retries": 0}
+        self.in_flight = None  # Id of the entry being written.
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.settled = threading.Condition(self.lock)
+        self.thread = threading.Thread(target=self._run, name="save-journal-drainer",
+                                       daemon=True)
+        self.thread.start()
+
+    def _query(self, sql, args=()):
+        return self.conn.execute(sql, args).fetchall()
+
+    def append(self, username, list_name, date_str, records, expected_version=None,
+               changed=None, base_save_id=None):
+        """Journals one save of the marking form and returns its entry id.
+
+        ``expected_version`` is the version the form was loaded from, as for
+        save_day(). ``changed`` are the records the user edited, kept for
+        the merge offered on a conflict (all of ``records`` by default).
+        ``base_save_id`` is the ``save_id`` of the waiting entry the form
+        was filled from, if any.
+        """
+        changed = records if changed is None else changed
+        key = (username, list_name, date_str)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                waiting = self._query(
+                    "SELECT id, changed FROM saves WHERE save_id = ? AND state != ?",
+                    (base_save_id, CONFLICT)) if base_save_id else []
+                if waiting and waiting[0][0] != self.in_flight:
+                    entry_id, earlier = waiting[0]
+                    subjects = ({rec["subject"] for rec in json.loads(earlier)}
+                                | {rec["subject"] for rec in changed})
+                    self.conn.execute(
+                        "UPDATE saves SET records = ?, changed = ?, state = ? WHERE id = ?",
+                        (json.dumps(records),
+                         json.dumps([rec for rec in records if rec["subject"] in subjects]),
+                         PENDING, entry_id))
+                else:
+                    entry_id = self.conn.execute(
+                        "INSERT INTO saves (save_id, username, list_name, date, records, changed,"
+                        " expected_version, base_save_id, state, queued_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (uuid.uuid4().hex,) + key + (json.dumps(records), json.dumps(changed),
+                                                     expected_version, base_save_id, PENDING,
+                                                     time.time())).lastrowid
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.stats["appended"] += 1
+            self.wake.notify()
+        return entry_id
+
+    def wait(self, entry_id, timeout):
+        """Waits up to ``timeout`` seconds for an entry to be written.
+
+        Returns WRITTEN, CONFLICT, or PENDING if it is still waiting.
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                rows = self._query("SELECT state FROM saves WHERE id = ?", (entry_id,))
+                if not rows:
+                    return WRITTEN
+                if rows[0][0] == CONFLICT:
+                    return CONFLICT
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return PENDING
+                self.settled.wait(remaining)
+
+    def day_entry(self, username, list_name, date_str):
+        """The journal entry still waiting for one day, or None.
+
+        Its ``state`` is PENDING (or FAILED) until it is written, and
+        CONFLICT when the day was changed elsewhere first.
+        """
+        with self.lock:
+            return _entry(self.conn.execute(
+                f"SELECT {', '.join(ENTRY_FIELDS)} FROM saves WHERE username = ?"
+                " AND list_name = ? AND date = ? ORDER BY id DESC LIMIT 1",
+                (username, list_name, date_str)).fetchone())
+
+    def user_entries(self, username):
+        """Number of ``username``'s entries per state, e.g. {"pending": 2}."""
+        with self.lock:
+            return dict(self._query(
+                "SELECT state, COUNT(*) FROM saves WHERE username = ? GROUP BY state",
+                (username,)))
+
+    def discard(self, username, list_name, date_str):
+        """Drops a day's conflicting entries once the user has chosen a version."""
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM saves WHERE username = ? AND list_name = ? AND date = ?"
+                " AND state = ?", (username, list_name, date_str, CONFLICT))
+            self.settled.notify_all()
+
+    def rename_user(self, old_username, new_username):
+        with self.lock:
+            self.conn.execute("UPDATE saves SET username = ? WHERE username = ?",
+                              (new_username, old_username))
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, **dict(self._query(
+                "SELECT state, COUNT(*) FROM saves GROUP BY state"))}
+
+    def wait_until_drained(self, timeout=None):
+        """Blocks until no entry is waiting to be written (or timeout)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while self._query("SELECT 1 FROM saves WHERE state = ? LIMIT 1", (PENDING,)):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.settled.wait(remaining)
+        return True
+
+    # ---- DRAINER ----
+
+    def _next_entry(self):
+        """The oldest entry due to be written, or None (lock held)."""
+        return _entry(self.conn.execute(
+            f"SELECT {', '.join(ENTRY_FIELDS)} FROM saves WHERE state = ?"
+            " OR (state = ? AND retry_at <= ?) ORDER BY id LIMIT 1",
+            (PENDING, FAILED, time.time())).fetchone())
+
+    def _run(self):
+        while True:
+            with self.lock:
+                entry = self._next_entry()
+                while entry is None:
+                    next_retry = self._query("SELECT MIN(retry_at) FROM saves WHERE state = ?",
+                                             (FAILED,))[0][0]
+                    self.wake.wait(None if next_retry is None
+                                   else max(0.0, next_retry - time.time()))
+                    entry = self._next_entry()
+                self.in_flight = entry["id"]
+            try:
+                outcome = self._write(entry)
+            except UNAVAILABLE_ERRORS as e:
+                logger.warning("Journal replay failed, retrying: %s", e)
+                with self.lock:
+                    self.in_flight = None
+                    self.stats["retries"] += 1
+                    self.conn.execute(
+                        "UPDATE saves SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                        (str(e), entry["id"]))
+                time.sleep(self.retry_seconds)
+                continue
+            except Exception as e:
+                logger.exception("Journal entry %d could not be written", entry["id"])
+                outcome = (FAILED, str(e))
+            with self.lock:
+                self.in_flight = None
+                self._settle(entry, *outcome)
+                self.settled.notify_all()
+
+    def _base_version(self, entry):
+        """The version the save ``entry``'s form was filled from wrote, or None."""
+        if not entry["base_save_id"]:
+            return None
+        with self.lock:
+            rows = self._query("SELECT version FROM written WHERE save_id = ?",
+                               (entry["base_save_id"],))
+        return rows[0][0] if rows else None
+
+    def _write(self, entry):
+        """Writes one entry; returns (WRITTEN, version or None) or (CONFLICT, None)."""
+        key = day_key(entry["username"], entry["list_name"], entry["date"])
+        expected_version = entry["expected_version"]
+        moved = False
+        for _ in range(3):
+            try:
+                return WRITTEN, save_day(
+                    self.db, entry["username"], entry["list_name"], entry["date"],
+                    entry["records"], expected_version=expected_version,
+                    extra={"save_id": entry["save_id"]})
+            except SaveConflict:
+                doc = self.db.attendance_records.find_one(key, {"_id": 0, "version": 1, "save_id": 1})
+            if doc is None:
+                # Archived days are only viewed from the archive; saving one
+                # moves it back first, with the version the form was filled from.
+                if moved or unarchive_day(self.db, entry["username"], entry["list_name"],
+                                          entry["date"]) is None:
+                    break
+                moved = True
+                continue
+            if doc.get("save_id") == entry["save_id"]:
+                # Written before a restart, and not removed from the journal
+                # yet. Others may have changed the day since, so its version
+                # is not one this journal wrote.
+                self.stats["replayed"] += 1
+                return WRITTEN, None
+            base_version = self._base_version(entry)
+            # Only the save the form was filled from came in between: the day
+            # is still exactly what that save wrote. Other writers leave a
+            # save_id in place, so the version is what tells.
+            if (base_version is None or doc["version"] != base_version
+                    or doc.get("save_id") != entry["base_save_id"]
+                    or expected_version == base_version):
+                break
+            expected_version = base_version
+        return CONFLICT, None
+
+    def _settle(self, entry, state, result):
+        """Records the outcome of writing ``entry`` (lock held)."""
+        if state == WRITTEN:
+            self.stats["written"] += 1
+            self.conn.execute("DELETE FROM saves WHERE id = ?", (entry["id"],))
+            now = time.time()
+            if result is not None:
+                self.conn.execute("INSERT OR REPLACE INTO written VALUES (?, ?, ?)",
+                                  (entry["save_id"], result, now))
+            self.conn.execute("DELETE FROM written WHERE written_at < ?",
+                              (now - WRITTEN_KEEP_SECONDS,))
+        elif state == CONFLICT:
+            self.stats["conflicts"] += 1
+            self.conn.execute("UPDATE saves SET state = ? WHERE id = ?", (CONFLICT, entry["id"]))
+        else:
+            self.stats["failed"] += 1
+            delay = min(self.retry_seconds * 2 ** entry["attempts"], MAX_RETRY_SECONDS)
+            self.conn.execute(
+                "UPDATE saves SET state = ?, last_error = ?, attempts = attempts + 1,"
+                " retry_at = ? WHERE id = ?", (FAILED, result, time.time() + delay, entry["id"]))
@@ -0,0 +1,91 @@
+"""Measures how much server memory each browser session's state uses.
+
+Streamlit keeps every session's ``st.session_state`` in the server process
+for as long as the tab is open, so its size times the number of connected
+users is a real part of the server's memory. deep_size() estimates one
+value; FootprintRegistry keeps the latest total per session so the admin
+page can show the whole server. No Streamlit imports, so load_test.py can
+use it too.
+"""
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+def deep_size(obj, seen=None):
+    """Approximate bytes used by ``obj`` and everything it references.
+
+    Follows dicts, lists, tuples, sets, ``__dict__`` and ``__slots__``;
+    NumPy arrays count their data buffer. Shared objects count once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if isinstance(slot, str) and hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def state_footprint(state):
+    """Bytes per key for a mapping such as ``st.session_state``, largest first."""
+    seen = set()
+    sizes = {str(key): deep_size(state[key], seen) for key in list(state.keys())}
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+class FootprintRegistry:
+    """Latest session-state size of every live session in this process.
+
+    Sessions report themselves on each rerun, with record() when they have
+    measured their state and touch() otherwise; one that has not reported
+    for ``max_idle_seconds`` is taken to be closed and forgotten.
+    """
+
+    def __init__(self, max_idle_seconds=3600):
+        self.max_idle_seconds = max_idle_seconds
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def record(self, session_id, total_bytes, keys, username=None, page=None):
+        with self.lock:
+            self.sessions[session_id] = {
+                "username": username, "page": page, "bytes": total_bytes,
+                "keys": keys, "seen_at": time.time()}
+
+    def touch(self, session_id, username=None, page=None):
+        """Marks a session as seen without measuring it again; False if it
+        has no recorded size (new, or forgotten as idle)."""
+        with self.lock:
+            info = self.sessions.get(session_id)
+            if info is None:
+                return False
+            info.update(username=username, page=page, seen_at=time.time())
+            return True
+
+    def snapshot(self):
+        """Live sessions as a list of dicts, largest first (prunes idle ones)."""
+        cutoff = time.time() - self.max_idle_seconds
+        with self.lock:
+            for session_id in [s for s, info in self.sessions.items()
+                               if info["seen_at"] < cutoff]:
+                del self.sessions[session_id]
+            rows = [{"session": session_id, **info}
+                    for session_id, info in self.sessions.items()]
+        return sorted(rows, key=lambda row: row["bytes"], reverse=True)
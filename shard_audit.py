@@ -0,0 +1,186 @@
+"""Checks that every page sends shard-targeted queries, and sets up sharding.
+
+Walks the app's pages with Streamlit's AppTest harness, as a student and as
+the timetable's owner, and records every command sent to the sharded
+collections (see sharding.py). Each is counted as single-shard (one
+username), targeted (a batch of usernames) or broadcast (no shard key, so
+mongos asks every shard). The report lists them per page; the script exits
+1 if any page broadcasts.
+
+Run it against a mongos to see real routing: --setup shards the collections
+on (username, list_name) after seeding, and --explain asks the router how
+many shards each recorded query reaches. A local two-shard cluster is
+enough, e.g. with mtools:
+    mlaunch init --sharded 2 --replicaset --nodes 1
+
+Needs a real MongoDB; mongomock does not report commands. The database is
+seeded with the load test's dataset, so it is DROPPED unless --no-seed.
+
+Examples:
+    python shard_audit.py --mongo-uri mongodb://localhost:27017/attendance_shard --setup --explain
+    python shard_audit.py --no-seed
+"""
+import argparse
+import json
+import sys
+from urllib.parse import urlsplit
+
+import pymongo
+from pymongo import monitoring
+
+from attendance_store import ensure_indexes
+from load_test import (LOAD_TEST_PASSWORD, SimulatedSession, install_hooks,
+                       seed_database)
+from sharding import (ROUTINGS, RoutingAudit, shard_collections, shard_key_filter,
+                      shards_touched)
+
+
+def student_steps(session):
+    """(label, action) pairs for one student's visit to every page."""
+    def click(label):
+        def action():
+            next(b for b in session.at.button if b.label == label).click().run()
+        return action
+
+    return [
+        ("login", session._login),
+        ("dashboard", lambda: session._goto("dashboard")),
+        ("attendance_marking", session._mark_attendance),
+        ("save_attendance", session._save_attendance),
+        ("view_attendance", lambda: session._goto("view_attendance")),
+        ("view_absent_report", lambda: session._goto("view_absent_report")),
+        ("analysis", lambda: session._goto("analysis")),
+        ("prediction", session._prediction),
+        ("reset_attendance", lambda: session._goto("reset_attendance")),
+        ("backup", lambda: session._goto("backup")),
+        ("clear_my_records", lambda: (session._goto("dashboard"),
+                                      click("🧹 Clear My Records")(),
+                                      click("Yes, Clear My Records")())),
+    ]
+
+
+def owner_steps(session, list_name, new_username):
+    """(label, action) pairs for the timetable owner, ending with deleting it."""
+    def click(key):
+        def action():
+            session.at.button(key=key).click().run()
+        return action
+
+    def change_username():
+        session._goto("change_username")
+        session.at.text_input[0].input(new_username)
+        session.at.text_input[1].input(LOAD_TEST_PASSWORD)
+        next(b for b in session.at.button
+             if b.label == "Confirm and Change Username").click().run()
+
+    return [
+        ("login", session._login),
+        ("roster", lambda: session._goto("roster")),
+        ("save_roster", lambda: next(b for b in session.at.button
+                                     if b.label.startswith("💾 Save Roster")).click().run()),
+        ("change_username", change_username),
+        ("delete_for_all", lambda: (session._goto("dashboard"),
+                                    click(f"delete_all_{list_name}")(),
+                                    click(f"confirm_delete_{list_name}")())),
+    ]
+
+
+def run_steps(audit, role, steps):
+    errors = []
+    for label, action in steps:
+        audit.label = f"{role}: {label}"
+        try:
+            action()
+        except Exception as e:  # Keep auditing the remaining pages.
+            errors.append((audit.label, repr(e)))
+    audit.label = None
+    return errors
+
+
+def print_report(audit, explained):
+    print(f"{'page':<34} {'collection':<20} {'command':<10} "
+          + " ".join(f"{how:>9}" for how in ROUTINGS))
+    for (label, collection, command), counts in audit.summary().items():
+        if label is None:
+            continue
+        print(f"{label:<34} {collection:<20} {command:<10} "
+              + " ".join(f"{counts[how]:>9}" for how in ROUTINGS))
+    if explained:
+        print()
+        print("Shards reached, from the router's explain:")
+        for (collection, query), shards in sorted(explained.items(), key=str):
+            print(f"  {shards} shard(s)  {collection} {query}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/attendance_shard",
+                        help="Database to seed and audit. It is DROPPED when seeding.")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="Reuse the dataset already in the database.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30, help="Days of history per user.")
+    parser.add_argument("--setup", action="store_true",
+                        help="Shard the collections (needs a mongos).")
+    parser.add_argument("--explain", action="store_true",
+                        help="Ask the router how many shards each recorded query reaches.")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Also write the report to this file.")
+    args = parser.parse_args(argv)
+
+    db_name = urlsplit(args.mongo_uri).path.lstrip("/") or "test"
+    audit = RoutingAudit(db_name)
+    # Before any client exists, so the app's client reports to it too.
+    monitoring.register(audit)
+    client = pymongo.MongoClient(args.mongo_uri)
+    db = client[db_name]
+    if args.no_seed:
+        pairs = [(d["username"], d["list_name"]) for d in db.attendance_stamps.find()]
+    else:
+        print(f"Seeding {args.users} users x {args.days} days ...")
+        pairs = seed_database(db, args.users, lists=1, days=args.days)
+    if len(pairs) < 2:
+        sys.exit("Need at least two users with attendance on one timetable.")
+    if args.setup:
+        for name in shard_collections(client, db_name):
+            print(f"Sharded {db_name}.{name} on (username, list_name).")
+    # Done here so building the indexes isn't counted against the first page.
+    ensure_indexes(db)
+
+    (student, list_name), (owner, _) = pairs[0], pairs[1]
+    db.timetables.update_one({"_id": list_name}, {"$set": {"owner": owner}})
+    install_hooks(args.mongo_uri, skip_ui_sleeps=True)
+    errors = run_steps(audit, "student", student_steps(
+        SimulatedSession(student, list_name, args.timeout)))
+    errors += run_steps(audit, "owner", owner_steps(
+        SimulatedSession(owner, list_name, args.timeout), list_name, f"{owner}_renamed"))
+
+    explained = {}
+    if args.explain:
+        for label, collection, _, _, query in audit.operations:
+            key = (collection, str(shard_key_filter(query)))
+            if label is not None and key not in explained:
+                explained[key] = shards_touched(db, collection, shard_key_filter(query))
+    print_report(audit, explained)
+    for label, error in errors:
+        print(f"ERROR on {label}: {error}")
+
+    broadcasts = [op for op in audit.operations if op[0] is not None and op[3] == "broadcast"]
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"operations": [
+                {"page": label, "collection": collection, "command": command,
+                 "routing": how} for label, collection, command, how, _ in audit.operations
+                if label is not None], "errors": errors}, f, indent=2)
+    print()
+    if broadcasts:
+        for label, collection, command, _, query in broadcasts:
+            print(f"BROADCAST on {label}: {command} {collection} {query}")
+        return 1
+    print(f"All {sum(op[0] is not None for op in audit.operations)} operations "
+          "on sharded collections named the shard key.")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Shard key layout for ``attendance_records`` and ``attendance_archive``.
+
+These two collections grow with the number of students, so they are the
+ones sharded, on the ranged key SHARD_KEY = (username, list_name). It is the
+prefix of both unique indexes (the day key and the archive key), which a
+sharded unique index requires. Every per-student read and write names the
+username, so mongos routes it to the shard that owns that student's chunk.
+Ranged rather than hashed keeps one student's timetables together and lets
+the dashboard's username-only aggregation stay on one shard.
+
+Queries about a whole timetable have no username. They look up the
+timetable's students in ``attendance_stamps`` (small and unsharded; every
+write path keeps one stamp per student and timetable) and then send
+``{"username": {"$in": batch}, "list_name": ...}`` batches; see
+attendance_store.delete_timetable_records(). Everything else (users,
+timetables, stamps, sessions, check-in codes) stays unsharded on the
+primary shard.
+
+RoutingAudit classifies the commands the app sends, from pymongo's command
+monitoring, as "single" (one username), "targeted" (a list of usernames)
+or "broadcast" (no shard key: mongos asks every shard). shard_audit.py
+drives the pages through it. No Streamlit imports.
+"""
+import threading
+
+from pymongo import monitoring
+
+from archive import ensure_archive_indexes
+from attendance_store import ensure_indexes
+
+SHARD_KEY = {"username": 1, "list_name": 1}
+SHARDED_COLLECTIONS = ("attendance_records", "attendance_archive")
+ROUTINGS = ("single", "targeted", "broadcast")
+
+
+def shard_collections(client, db_name):
+    """Shards the growing collections of ``db_name`` on SHARD_KEY (run against
+    a mongos). Their indexes are created first, since sharding checks them.
+    Returns the collections that were sharded now."""
+    db = client[db_name]
+    ensure_indexes(db)
+    ensure_archive_indexes(db)
+    client.admin.command("enableSharding", db_name)
+    sharded = {doc["_id"] for doc in client.config.collections.find(
+        {"_id": {"$in": [f"{db_name}.{name}" for name in SHARDED_COLLECTIONS]}},
+        {"_id": 1})}
+    done = []
+    for name in SHARDED_COLLECTIONS:
+        namespace = f"{db_name}.{name}"
+        if namespace not in sharded:
+            client.admin.command("shardCollection", namespace, key=SHARD_KEY)
+            done.append(name)
+    return done
+
+
+# ---- ROUTING AUDIT ----
+
+def routing(query):
+    """How mongos routes ``query`` on a collection sharded on SHARD_KEY."""
+    clauses = [query] + list(query.get("$and", []))
+    for clause in clauses:
+        username = clause.get("username")
+        if isinstance(username, str):
+            return "single"
+        if isinstance(username, dict):
+            if isinstance(username.get("$eq"), str):
+                return "single"
+            if "$in" in username:
+                return "targeted"
+    return "broadcast"
+
+
+def command_queries(name, command):
+    """The filters (or, for inserts, documents) that decide where one
+    command goes, or None for commands that are not routed on a filter."""
+    if name in ("find", "count", "distinct"):
+        return [command.get("filter") or command.get("query") or {}]
+    if name == "findAndModify":
+        return [command.get("query") or {}]
+    if name == "delete":
+        return [op["q"] for op in command.get("deletes", [])]
+    if name == "update":
+        return [op["q"] for op in command.get("updates", [])]
+    if name == "insert":
+        return list(command.get("documents", []))
+    if name == "aggregate":
+        pipeline = command.get("pipeline") or [{}]
+        return [pipeline[0].get("$match", {})]
+    return None
+
+
+def shard_key_filter(query):
+    """The SHARD_KEY fields of ``query``, for explaining its routing."""
+    return {field: query[field] for field in SHARD_KEY if field in query}
+
+
+class RoutingAudit(monitoring.CommandListener):
+    """Records the routing of every command on a sharded collection.
+
+    Register it before the client is created. ``label`` (e.g. the page
+    being visited) is stored with each operation.
+    """
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.label = None
+        self.operations = []  # (label, collection, command, routing, query)
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.database_name != self.db_name:
+            return
+        collection = event.command.get(event.command_name)
+        if collection not in SHARDED_COLLECTIONS:
+            return
+        queries = command_queries(event.command_name, event.command)
+        if queries is None:
+            return
+        with self._lock:
+            for query in queries:
+                self.operations.append((self.label, collection, event.command_name,
+                                        routing(query), query))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def summary(self):
+        """``{(label, collection, command): {routing: count}}``."""
+        counts = {}
+        with self._lock:
+            for label, collection, command, how, _ in self.operations:
+                row = counts.setdefault((label, collection, command), dict.fromkeys(ROUTINGS, 0))
+                row[how] += 1
+        return counts
+
+
+def shards_touched(db, collection, query):
+    """Number of shards mongos would send ``query`` to, from its explain."""
+    plan = db.command("explain", {"find": collection, "filter": query},
+                      verbosity="queryPlanner")["queryPlanner"]["winningPlan"]
+    return len(plan.get("shards", [])) or 1
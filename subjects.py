@@ -0,0 +1,169 @@
+"""Stable integer ids for each timetable's subjects.
+
+Subject names are stored once per timetable (see models.SubjectDictionary);
+schedules and day records hold small integer ids instead of repeating the
+name in every record. That keeps documents and wire traffic small and lets
+a subject be renamed without orphaning its history.
+
+subject_dictionary() keeps each timetable's dictionary in a per-process
+cache. Decoding an id the cached copy has not seen reloads it, and entries
+expire after DICTIONARY_TTL seconds so renames made by another server
+process show up. subject_ids() hands out ids for new names (imports and
+the API can write subjects the timetable does not schedule) with a
+compare-and-set on ``next_subject_id``. No Streamlit imports; the ``_async``
+variants serve the JSON API's asyncio client.
+"""
+import threading
+import time
+
+from models import DayRecord, SubjectDictionary, record_subject
+
+DICTIONARY_TTL = 60.0
+DICTIONARY_FIELDS = {"subjects": 1, "next_subject_id": 1}
+
+_cache = {}  # list_name -> (loaded_at, SubjectDictionary)
+_cache_lock = threading.Lock()
+
+
+def _cached(list_name, keys):
+    with _cache_lock:
+        entry = _cache.get(list_name)
+    if entry is None or time.monotonic() - entry[0] > DICTIONARY_TTL:
+        return None
+    if not all(entry[1].knows(key) for key in keys):
+        return None
+    return entry[1]
+
+
+def _remember(list_name, dictionary):
+    with _cache_lock:
+        _cache[list_name] = (time.monotonic(), dictionary)
+    return dictionary
+
+
+def forget_dictionary(list_name=None):
+    """Drops the cached dictionary of ``list_name`` (every one by default)."""
+    with _cache_lock:
+        if list_name is None:
+            _cache.clear()
+        else:
+            _cache.pop(list_name, None)
+
+
+def record_keys(*docs):
+    """The stored subject keys of every record in the given day documents."""
+    return {record_subject(rec) for doc in docs if doc for rec in doc.get("records", [])}
+
+
+def subject_dictionary(db, list_name, keys=()):
+    """The SubjectDictionary of ``list_name``; empty if the timetable is gone.
+
+    ``keys`` are stored subject keys about to be decoded; an id the cached
+    copy does not know reloads it from ``db``.
+    """
+    return _cached(list_name, keys) or _remember(list_name, SubjectDictionary.from_doc(
+        db.timetables.find_one({"_id": list_name}, DICTIONARY_FIELDS)))
+
+
+def day_records(db, list_name, docs):
+    """DayRecords for day documents of ``list_name``, subject ids decoded;
+    None for each None in ``docs``."""
+    subjects = subject_dictionary(db, list_name, record_keys(*docs))
+    return [DayRecord.from_doc(doc, subjects) for doc in docs]
+
+
+async def subject_dictionary_async(db, list_name, keys=()):
+    """subject_dictionary() for an asyncio database handle."""
+    return _cached(list_name, keys) or _remember(list_name, SubjectDictionary.from_doc(
+        await db.timetables.find_one({"_id": list_name}, DICTIONARY_FIELDS)))
+
+
+# ---- NEW SUBJECTS ----
+
+def _add_names(doc, names):
+    """``(filter, update)`` that adds the names ``doc`` lacks, or None if none."""
+    current = SubjectDictionary.from_doc(doc)
+    missing = list(dict.fromkeys(name for name in names if current.id_for(name) is None))
+    if not missing:
+        return None
+    new = [{"id": current.next_id + i, "name": name} for i, name in enumerate(missing)]
+    # Matching the counter as read makes concurrent additions retry instead
+    # of handing out the same id twice; a missing field matches None.
+    return ({"_id": doc["_id"], "next_subject_id": doc.get("next_subject_id")},
+            {"$push": {"subjects": {"$each": new}},
+             "$set": {"next_subject_id": current.next_id + len(new)}})
+
+
+def subject_ids(db, list_name, names, attempts=5):
+    """SubjectDictionary of ``list_name`` with an id for each of ``names``,
+    adding any that are new. None if the timetable does not exist."""
+    dictionary = _cached(list_name, ())
+    if dictionary is not None and all(dictionary.id_for(name) is not None for name in names):
+        return dictionary
+    for _ in range(attempts):
+        doc = db.timetables.find_one({"_id": list_name}, DICTIONARY_FIELDS)
+        if doc is None:
+            return None
+        change = _add_names(doc, names)
+        if change is None:
+            return _remember(list_name, SubjectDictionary.from_doc(doc))
+        if db.timetables.update_one(*change).modified_count:
+            forget_dictionary(list_name)
+            return subject_dictionary(db, list_name)
+    raise RuntimeError(f"could not add subjects to '{list_name}'")
+
+
+async def subject_ids_async(db, list_name, names, attempts=5):
+    """subject_ids() for an asyncio database handle."""
+    dictionary = _cached(list_name, ())
+    if dictionary is not None and all(dictionary.id_for(name) is not None for name in names):
+        return dictionary
+    for _ in range(attempts):
+        doc = await db.timetables.find_one({"_id": list_name}, DICTIONARY_FIELDS)
+        if doc is None:
+            return None
+        change = _add_names(doc, names)
+        if change is None:
+            return _remember(list_name, SubjectDictionary.from_doc(doc))
+        if (await db.timetables.update_one(*change)).modified_count:
+            forget_dictionary(list_name)
+            return await subject_dictionary_async(db, list_name)
+    raise RuntimeError(f"could not add subjects to '{list_name}'")
+
+
+def encode_records(dictionary, records):
+    """``records`` (with ``subject`` names) as stored, names replaced by ids.
+    Left as they are when the timetable no longer exists (``dictionary`` None)."""
+    if dictionary is None:
+        return records
+    return [dictionary.encode(rec) for rec in records]
+
+
+def replaced_keys(dictionary, records):
+    """Every stored key a merge of ``records`` replaces: the new ids and, for
+    days saved before subject ids, the names."""
+    names = [rec["subject"] for rec in records]
+    if dictionary is None:
+        return names
+    return names + [dictionary.id_for(name) for name in names if dictionary.id_for(name) is not None]
+
+
+# ---- RENAMES ----
+
+def rename_subjects(db, list_name, renames):
+    """Renames subjects of ``list_name`` by id (``{id: new name}``), all in one
+    write so two subjects can swap names. Records refer to ids, so their
+    history follows the new name. Returns False, changing nothing, if a name
+    would be used twice or the dictionary changed meanwhile.
+    """
+    doc = db.timetables.find_one({"_id": list_name}, {"subjects": 1})
+    if doc is None:
+        return False
+    entries = doc.get("subjects") or []
+    renamed = [{**entry, "name": renames.get(entry["id"], entry["name"])} for entry in entries]
+    if len({entry["name"] for entry in renamed}) < len(renamed):
+        return False
+    result = db.timetables.update_one({"_id": list_name, "subjects": entries},
+                                      {"$set": {"subjects": renamed}})
+    forget_dictionary(list_name)
+    return result.matched_count == 1
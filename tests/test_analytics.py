@@ -0,0 +1,31 @@
+import numpy as np
+
+from analytics import semester_projection
+
+
+def _term(days, hours_per_day=1):
+    """``(dates, cumulative)`` for one subject with a class every day."""
+    dates = np.arange(np.datetime64("2026-01-01"), np.datetime64("2026-01-01") + days)
+    return dates, np.cumsum(np.full((1, days), hours_per_day, dtype=np.int64), axis=1)
+
+
+def test_max_skippable_is_capped_at_remaining_hours():
+    dates, cumulative = _term(9)
+    projection = semester_projection(dates, cumulative, "2025-12-31", [100], [100])
+    assert projection["remaining"][0] == 9
+    assert projection["max_skippable"][0] == 9
+    assert projection["needed"][0] == 0
+
+
+def test_max_skippable_below_remaining_near_target():
+    dates, cumulative = _term(10)
+    projection = semester_projection(dates, cumulative, "2025-12-31", [10], [8])
+    # Finishing at 20 hours with 80% needs 16 present: 8 of the 10 left.
+    assert projection["max_skippable"][0] == 2
+
+
+def test_unreachable_target_skips_nothing():
+    dates, cumulative = _term(2)
+    projection = semester_projection(dates, cumulative, "2025-12-31", [10], [0])
+    assert not projection["reachable"][0]
+    assert projection["max_skippable"][0] == 0
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from load_test import find_saturation
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _level(concurrency, flows_per_s, p95_ms=100.0):
+    return {"concurrency": concurrency, "flows_per_s": flows_per_s,
+            "latency": {"dashboard": {"p95_ms": p95_ms}}}
+
+
+def test_saturation_is_the_level_of_peak_throughput():
+    levels = [_level(1, 1.0), _level(2, 1.8), _level(4, 1.7)]
+    assert find_saturation(levels, 0.10, 2000.0) == 2
+
+
+def test_saturation_over_latency_budget_still_reports_the_peak():
+    levels = [_level(1, 1.0, p95_ms=2500.0), _level(2, 1.5)]
+    assert find_saturation(levels, 0.10, 2000.0) == 2
+
+
+def test_no_saturation_while_throughput_grows():
+    assert find_saturation([_level(1, 1.0), _level(2, 1.9)], 0.10, 2000.0) is None
+
+
+def test_pages_stay_within_the_wire_budget():
+    pytest.importorskip("mongomock")
+    # Its own process: the load test patches pymongo and Streamlit globally.
+    result = subprocess.run(
+        [sys.executable, "load_test.py", "--mongomock", "--users", "5", "--levels", "1",
+         "--flows", "1", "--wire-budget", "wire_budget.json"],
+        cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "All pages within the wire budget." in result.stdout
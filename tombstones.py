@@ -0,0 +1,102 @@
+"""Undoable resets of day documents.
+
+reset_days() removes a user's day documents for a date range (or every
+date) of one timetable in a few round trips whatever the range: one find,
+one insert_many and one delete_many. The documents are not thrown away.
+Each is kept in ``attendance_tombstones`` under the reset's id, and
+undo_reset() puts them back with a single bulk insert. A TTL index drops
+tombstones UNDO_DAYS after the reset. Archived days in the range are moved
+back to the hot collection first, so a reset reaches them too. No Streamlit
+imports.
+"""
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, errors
+
+from archive import unarchive_days
+from attendance_store import doc_version, touch_records, version_filter
+
+UNDO_DAYS = 7
+TOMBSTONE_INDEX = "attendance_tombstones_reset"
+
+
+def ensure_tombstone_indexes(db):
+    """TTL index so MongoDB deletes tombstones once ``expires_at`` has passed,
+    and the per-user index the undo list reads."""
+    db.attendance_tombstones.create_index("expires_at", expireAfterSeconds=0,
+                                          name="attendance_tombstones_ttl")
+    db.attendance_tombstones.create_index(
+        [("username", ASCENDING), ("reset_id", ASCENDING)], name=TOMBSTONE_INDEX)
+
+
+def reset_days(db, username, list_name, start=None, end=None):
+    """Moves ``username``'s days of ``list_name`` from ``start`` to ``end``
+    ("YYYY-MM-DD", inclusive; all dates when both are None) to tombstones.
+
+    Returns ``(reset_id, days)``; ``reset_id`` is None if nothing matched.
+    A day saved again between the read and the delete is left in place,
+    with no tombstone.
+    """
+    unarchive_days(db, username, list_name, start, end)
+    key = {"username": username, "list_name": list_name}
+    query = dict(key)
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = start
+        if end:
+            query["date"]["$lte"] = end
+    docs = list(db.attendance_records.find(query))
+    if not docs:
+        return None, 0
+
+    reset_id = ObjectId()
+    now = datetime.now(timezone.utc)
+    db.attendance_tombstones.insert_many([
+        {"reset_id": reset_id, **key, "date": doc["date"], "deleted_at": now,
+         "expires_at": now + timedelta(days=UNDO_DAYS), "day": doc} for doc in docs])
+    deleted = db.attendance_records.delete_many({**key, "$or": [
+        {"_id": doc["_id"], "version": version_filter(doc_version(doc))} for doc in docs]})
+    if deleted.deleted_count < len(docs):
+        kept = [doc["_id"] for doc in db.attendance_records.find(
+            {**key, "_id": {"$in": [doc["_id"] for doc in docs]}}, {"_id": 1})]
+        db.attendance_tombstones.delete_many(
+            {"username": username, "reset_id": reset_id, "day._id": {"$in": kept}})
+    touch_records(db, username, list_name)
+    return reset_id, deleted.deleted_count
+
+
+def undo_reset(db, username, reset_id):
+    """Puts the days of one of ``username``'s resets back and drops its
+    tombstones. Returns the number of days restored; a date marked again
+    since the reset keeps the newer day."""
+    tombstones = list(db.attendance_tombstones.find(
+        {"username": username, "reset_id": reset_id}, {"list_name": 1, "day": 1}))
+    if not tombstones:
+        return 0
+    restored = len(tombstones)
+    try:
+        db.attendance_records.insert_many([t["day"] for t in tombstones], ordered=False)
+    except errors.BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        restored -= len(e.details["writeErrors"])
+    db.attendance_tombstones.delete_many({"username": username, "reset_id": reset_id})
+    touch_records(db, username, tombstones[0]["list_name"])
+    return restored
+
+
+def recent_resets(db, username, limit=5):
+    """``username``'s resets that can still be undone, newest first, as
+    ``{"_id": reset_id, "list_name", "days", "first_date", "last_date",
+    "deleted_at", "expires_at"}``."""
+    return list(db.attendance_tombstones.aggregate([
+        {"$match": {"username": username, "expires_at": {"$gt": datetime.now(timezone.utc)}}},
+        {"$group": {"_id": "$reset_id", "list_name": {"$first": "$list_name"},
+                    "days": {"$sum": 1}, "first_date": {"$min": "$date"},
+                    "last_date": {"$max": "$date"}, "deleted_at": {"$first": "$deleted_at"},
+                    "expires_at": {"$first": "$expires_at"}}},
+        {"$sort": {"deleted_at": DESCENDING, "_id": DESCENDING}},
+        {"$limit": limit},
+    ]))